@@ -0,0 +1,170 @@
+"""Gemini 生成結果快取
+
+以「模型名稱 + 正規化後的 prompt」的 SHA-256 當 key，把生成結果存成
+.cache/gemini/<key>.json。同樣的輸入在 TTL 內不會再呼叫模型：
+手動重跑 workflow、LINE 發送失敗後重試，都直接讀快取。
+
+- TTL：AI_CACHE_TTL 秒 (預設 1 天)
+- 容量：AI_CACHE_MAX_ENTRIES 筆 (預設 200)，超過時刪掉最舊的
+- AI_CACHE_DIR 可改放置位置；設成空字串則只用記憶體快取
+- 記憶體裡只留最近用到的 MEMORY_ENTRIES 筆 (LRU)，長駐排程器跑再久也不會一直長大；
+  只用記憶體時上限是 AI_CACHE_MAX_ENTRIES
+
+另外 remember() / recall() 依名稱保存「上一次成功的結果」(例如上一則氣象評論)，
+給 AI 逾時時當備援；存成 .last 檔，不算在快取容量裡。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get("AI_CACHE_DIR", os.path.join(".cache", "gemini"))
+CACHE_TTL = int(os.environ.get("AI_CACHE_TTL", 24 * 60 * 60))
+MAX_ENTRIES = int(os.environ.get("AI_CACHE_MAX_ENTRIES", 200))
+# 有磁碟快取時，記憶體只是前面一層，留幾筆最近用到的就夠
+MEMORY_ENTRIES = 32
+
+_lock = threading.Lock()
+_memory = OrderedDict()  # key → entry，最近用到的在最後
+_last = {}               # remember() 的名稱 → entry (名稱只有幾個，不會一直長大)
+_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+
+def normalize_prompt(prompt):
+    """去掉每行前後空白並合併連續空白 (f-string 的縮排不影響 key)"""
+    lines = (re.sub(r"\s+", " ", line).strip() for line in prompt.strip().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def cache_key(model, prompt):
+    raw = f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def _memory_put(key, entry):
+    """放進記憶體 LRU，超過上限就丟掉最久沒用到的"""
+    _memory[key] = entry
+    _memory.move_to_end(key)
+    limit = MEMORY_ENTRIES if CACHE_DIR else MAX_ENTRIES
+    while len(_memory) > limit:
+        _memory.popitem(last=False)
+
+
+def _read(key):
+    if key in _memory:
+        _memory.move_to_end(key)
+        return _memory[key]
+    if not CACHE_DIR:
+        return None
+    try:
+        with open(_path(key), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(key, entry):
+    _memory_put(key, entry)
+    if not CACHE_DIR:
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = _path(key) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, _path(key))
+        _evict()
+    except OSError as e:
+        print(f"⚠️ AI 快取寫入失敗: {e}")
+
+
+def _evict():
+    """超過容量時，依修改時間刪掉最舊的檔案"""
+    files = [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR) if name.endswith(".json")]
+    if len(files) <= MAX_ENTRIES:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[:len(files) - MAX_ENTRIES]:
+        try:
+            os.remove(path)
+            _stats["evictions"] += 1
+        except OSError:
+            pass
+
+
+def cached_generate(model, prompt, generate_fn):
+    """
+    有快取就回傳快取，沒有才呼叫 generate_fn(model, prompt) 並寫入快取。
+    generate_fn 拋出的例外不會被快取，會直接往外丟。
+    """
+    key = cache_key(model, prompt)
+    with _lock:
+        entry = _read(key)
+        if entry and time.time() - entry["created_at"] < CACHE_TTL:
+            _stats["hits"] += 1
+            _memory_put(key, entry)
+            print("💾 AI 快取命中，略過模型呼叫")
+            return entry["text"]
+        if entry:
+            _stats["expired"] += 1
+            _memory.pop(key, None)
+        _stats["misses"] += 1
+
+    text = generate_fn(model, prompt)
+
+    with _lock:
+        _write(key, {"model": model, "created_at": time.time(), "text": text})
+    return text
+
+
+def _last_path(name):
+    return os.path.join(CACHE_DIR, f"{name}.last")
+
+
+def remember(name, value):
+    """記下最近一次成功的結果 (要能 JSON 序列化)"""
+    entry = {"created_at": time.time(), "value": value}
+    with _lock:
+        _last[name] = entry
+        if not CACHE_DIR:
+            return
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = _last_path(name) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, _last_path(name))
+        except OSError as e:
+            print(f"⚠️ AI 快取寫入失敗: {e}")
+
+
+def recall(name, max_age=CACHE_TTL):
+    """取回 remember() 存的結果；沒有或超過 max_age 秒回傳 None"""
+    with _lock:
+        entry = _last.get(name)
+        if entry is None and CACHE_DIR:
+            try:
+                with open(_last_path(name), encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+    if entry is None or time.time() - entry["created_at"] > max_age:
+        return None
+    return entry["value"]
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
+
+
+def print_stats():
+    s = stats()
+    print(f"💾 AI 快取：命中 {s['hits']} / 未命中 {s['misses']} (過期 {s['expired']}, 淘汰 {s['evictions']})")
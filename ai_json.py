@@ -0,0 +1,139 @@
+"""Gemini 結構化輸出 (JSON schema)
+
+一次呼叫拿到多個欄位：schema 交給模型 (response_mime_type=application/json + response_schema)，
+回來的文字直接 json.loads，再用同一份 schema 檢查必填欄位、型別與長度，不靠 regex 切段落。
+不合格時只補救一次 (把錯誤訊息和原輸出交回模型修正)，還是不合格就丟 SchemaError，
+由呼叫端改用預設文字。只有合格的結果會寫進 ai_cache，重跑不會讀到壞掉的輸出。
+
+schema 用 Gemini 的 OpenAPI 子集 (dict 即可，不必 import SDK 的型別)：
+    obj({"diary": string("50 字內的日記"), "knowledge": string()})
+
+generate_within() 在時間預算 (pipeline.Budget) 內依序試多個模型 (主要 → 輕量)，
+每個模型的呼叫都帶 timeout，主要模型只能用掉一部分預算，確保輕量模型還有時間。
+"""
+import json
+import time
+
+import ai_cache
+import telemetry
+
+# 主要模型最多用掉剩餘預算的比例 (其餘留給輕量模型)
+PRIMARY_SHARE = 0.6
+# 剩不到這麼多秒就不再呼叫模型
+MIN_CALL_SECONDS = 1.0
+# 預留給收尾 (解析、記錄) 的時間，模型呼叫不會用到預算的最後這一段
+SAFETY_MARGIN = 0.2
+
+
+class SchemaError(ValueError):
+    """模型輸出不是合法 JSON，或不符合 schema"""
+
+
+def string(description=None, max_length=None):
+    schema = {"type": "STRING"}
+    if description:
+        schema["description"] = description
+    if max_length:
+        schema["maxLength"] = max_length
+    return schema
+
+
+def obj(properties, required=None):
+    """所有欄位預設必填；propertyOrdering 讓模型依序產生 (和 prompt 裡的說明順序一致)"""
+    names = list(properties)
+    return {
+        "type": "OBJECT",
+        "properties": properties,
+        "required": names if required is None else list(required),
+        "propertyOrdering": names,
+    }
+
+
+def validate(schema, value, path="$"):
+    """檢查 value 是否符合 schema (只支援這裡用到的 OBJECT / STRING)，不符合丟 SchemaError"""
+    kind = schema["type"]
+    if kind == "OBJECT":
+        if not isinstance(value, dict):
+            raise SchemaError(f"{path} 應該是物件")
+        for name in schema.get("required", ()):
+            if name not in value:
+                raise SchemaError(f"{path} 缺少欄位 {name}")
+        for name, sub in schema["properties"].items():
+            if name in value:
+                validate(sub, value[name], f"{path}.{name}")
+    elif kind == "STRING":
+        if not isinstance(value, str) or not value.strip():
+            raise SchemaError(f"{path} 應該是非空字串")
+        # 模型常常稍微超過字數；超過兩倍才算壞掉 (卡片會被撐爆)
+        limit = schema.get("maxLength")
+        if limit and len(value) > limit * 2:
+            raise SchemaError(f"{path} 長度 {len(value)} 超過上限 {limit}")
+    else:
+        raise SchemaError(f"不支援的 schema 型別 {kind}")
+
+
+def parse(text, schema):
+    """模型回覆 → 通過 schema 檢查的 dict"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        # 少數情況模型還是會包一層 ```json ... ```
+        text = text.partition("\n")[2].rstrip().removesuffix("```")
+    try:
+        value = json.loads(text)
+    except ValueError as e:
+        raise SchemaError(f"不是合法的 JSON ({e})") from None
+    validate(schema, value)
+    return value
+
+
+def _repair_prompt(prompt, text, error):
+    return (f"{prompt}\n\n你上一次的輸出不符合要求的 JSON 格式：{error}\n"
+            f"上一次的輸出：\n{text}\n\n請修正後只輸出符合 schema 的 JSON。")
+
+
+def generate(model, prompt, schema, generate_fn):
+    """
+    呼叫 generate_fn(model, prompt, schema) 拿到 JSON 文字並驗證，回傳 dict。
+    不合格時補救呼叫一次；兩次都失敗丟 SchemaError (例外不會被快取)。
+    """
+    def attempt(model, prompt):
+        text = generate_fn(model, prompt, schema)
+        try:
+            parse(text, schema)
+            return text
+        except SchemaError as e:
+            print(f"⚠️ AI 輸出格式不符 ({e})，請模型修正一次...")
+            telemetry.count("ai_repairs_total", model=model)
+            text = generate_fn(model, _repair_prompt(prompt, text, e), schema)
+            parse(text, schema)
+            return text
+
+    return parse(ai_cache.cached_generate(model, prompt, attempt), schema)
+
+
+def generate_within(models, prompt, schema, generate_fn, budget):
+    """
+    在 budget 內依序試 models，回傳 (dict, 用到的模型)。
+    generate_fn(model, prompt, schema, timeout=秒數)；同一個模型的修正呼叫共用它的時間。
+    全部失敗或時間不夠時丟出最後一個例外 (TimeoutError 代表根本沒時間呼叫)。
+    """
+    error = TimeoutError("AI 時間預算用完")
+    for i, model in enumerate(models):
+        remaining = budget.remaining()
+        if remaining < MIN_CALL_SECONDS:
+            break
+        share = PRIMARY_SHARE if i < len(models) - 1 else 1.0
+        model_deadline = time.perf_counter() + (remaining - SAFETY_MARGIN) * share
+
+        def call(model, prompt, schema):
+            timeout = model_deadline - time.perf_counter()
+            if timeout < MIN_CALL_SECONDS:
+                raise TimeoutError(f"{model} 沒有剩餘時間")
+            return generate_fn(model, prompt, schema, timeout=timeout)
+
+        try:
+            return generate(model, prompt, schema, call), model
+        except Exception as e:
+            print(f"⚠️ {model} 失敗或逾時 ({type(e).__name__}: {e})")
+            error = e
+    raise error
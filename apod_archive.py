@@ -0,0 +1,306 @@
+"""APOD 歷史典藏 (本機 SQLite，APOD_ARCHIVE_DB 預設 .cache/apod.db)
+
+用 API 的 start_date / end_date 區間模式，一次抓 ARCHIVE_BATCH_DAYS 天：
+- 回應是一個 JSON 陣列，邊下載邊逐筆解析 (JSONDecoder.raw_decode)，不整包 json.loads
+- 每一批在同一個 transaction 裡寫入並更新進度 (loaded_through)，中斷後重跑會從下一批接著抓
+- 記憶體上限約是「一筆 APOD + 一個下載區塊」，跟區間長短無關
+
+索引：日期 (主鍵)、媒體類型、月日 (歷史上的今天)、標題關鍵字。
+影片日可以用 substitute_for() 找同一天 (往年) 的圖片代打，全部是本機查詢。
+"""
+import codecs
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import http_client
+
+APOD_API_URL = os.environ.get("APOD_API_URL", "https://api.nasa.gov/planetary/apod")
+DB_PATH = os.environ.get("APOD_ARCHIVE_DB", os.path.join(".cache", "apod.db"))
+BATCH_DAYS = int(os.environ.get("ARCHIVE_BATCH_DAYS", 365))
+
+# APOD 第一天
+FIRST_DATE = date(1995, 6, 16)
+# APOD 依美東日期換日；台灣 (UTC+8) 的「今天」常常比它早一天
+APOD_TIMEZONE = "America/New_York"
+CHUNK_SIZE = 64 * 1024
+FIELDS = ("date", "media_type", "title", "url", "hdurl", "explanation", "copyright")
+
+_WS_RE = re.compile(r"[\s,]*")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_DECODER = json.JSONDecoder()
+# 單一 APOD 物件的上限，超過代表格式有問題
+MAX_OBJECT_CHARS = 1024 * 1024
+# 標題關鍵字不收這些
+STOPWORDS = {"the", "and", "for", "from", "with", "over", "into", "apod", "its", "near", "in", "of", "on", "a", "an"}
+
+
+def apod_today():
+    """APOD 目前的日期 (美東時間)"""
+    try:
+        from zoneinfo import ZoneInfo  # 用到才載入時區資料
+
+        tz = ZoneInfo(APOD_TIMEZONE)
+    except Exception:
+        tz = timezone(timedelta(hours=-5))  # 沒有時區資料時用美東標準時間
+    return datetime.now(tz).date()
+
+
+def iter_json_array(chunks):
+    """從 bytes 區塊逐一產生頂層 JSON 陣列的元素；回應不是陣列 (API 錯誤訊息) 時丟 ValueError"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    started = False
+    done = False
+
+    for chunk in chunks:
+        buf += decoder.decode(chunk)
+        pos = 0
+        while not done:
+            pos = _WS_RE.match(buf, pos).end() if started else len(buf) - len(buf.lstrip())
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError(f"APOD API 沒有回傳陣列: {buf[pos:pos + 200]}")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                done = True
+                pos += 1
+                break
+            try:
+                obj, end = _DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if len(buf) - pos > MAX_OBJECT_CHARS:
+                    raise ValueError("APOD 物件過大或格式錯誤")
+                break
+            yield obj
+            pos = end
+        buf = buf[pos:]
+
+    if not done:
+        raise ValueError("APOD 資料不完整 (下載中斷?)")
+
+
+def title_keywords(title):
+    return {w for w in _WORD_RE.findall((title or "").lower()) if len(w) >= 3 and w not in STOPWORDS}
+
+
+class ApodArchive:
+    def __init__(self, path=DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS apod (
+                date TEXT PRIMARY KEY,
+                month_day TEXT NOT NULL,
+                media_type TEXT,
+                title TEXT,
+                url TEXT,
+                hdurl TEXT,
+                explanation TEXT,
+                copyright TEXT
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS apod_by_month_day ON apod (month_day, media_type);
+            CREATE INDEX IF NOT EXISTS apod_by_media ON apod (media_type, date);
+            CREATE TABLE IF NOT EXISTS keywords (
+                word TEXT NOT NULL,
+                date TEXT NOT NULL,
+                PRIMARY KEY (word, date)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM apod").fetchone()[0]
+
+    # ---------- 寫入 ----------
+    def _insert(self, entries):
+        """寫入多筆 APOD (呼叫端負責 transaction)，回傳筆數"""
+        count = 0
+        for e in entries:
+            if not e.get("date"):
+                continue
+            row = [e.get(f) for f in FIELDS]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO apod (date, month_day, media_type, title, url, hdurl, explanation, copyright)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (row[0], row[0][5:10]) + tuple(row[1:]),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO keywords (word, date) VALUES (?, ?)",
+                ((w, row[0]) for w in title_keywords(e.get("title"))),
+            )
+            count += 1
+        return count
+
+    def record(self, entry):
+        """寫入單筆 (例如今天機器人剛抓到的資料)"""
+        with self.conn:
+            self._insert([entry])
+
+    def loaded_through(self):
+        value = self.get_meta("loaded_through")
+        return date.fromisoformat(value) if value else None
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def load_batch(self, chunks, batch_end):
+        """把一個區間回應寫進資料庫，並在同一個 transaction 裡把進度推進到 batch_end"""
+        with self.conn:
+            count = self._insert(iter_json_array(chunks))
+            current = self.loaded_through()
+            if current is None or batch_end > current:
+                self._set_meta("loaded_through", batch_end.isoformat())
+        return count
+
+    # ---------- 查詢 ----------
+    def get(self, day):
+        row = self.conn.execute("SELECT * FROM apod WHERE date = ?", (str(day),)).fetchone()
+        return dict(row) if row else None
+
+    def date_range(self, start, end, media_type=None):
+        sql = "SELECT * FROM apod WHERE date BETWEEN ? AND ?"
+        args = [str(start), str(end)]
+        if media_type:
+            sql += " AND media_type = ?"
+            args.append(media_type)
+        return [dict(r) for r in self.conn.execute(sql + " ORDER BY date", args)]
+
+    def on_this_day(self, month, day, media_type=None, before=None):
+        """歷年同一天 (新到舊)；before 只取這個日期之前的"""
+        sql = "SELECT * FROM apod WHERE month_day = ?"
+        args = [f"{month:02d}-{day:02d}"]
+        if media_type:
+            sql += " AND media_type = ?"
+            args.append(media_type)
+        if before:
+            sql += " AND date < ?"
+            args.append(str(before))
+        return [dict(r) for r in self.conn.execute(sql + " ORDER BY date DESC", args)]
+
+    def search(self, keyword, limit=20):
+        """標題關鍵字查詢 (新到舊)"""
+        words = title_keywords(keyword)
+        if not words:
+            return []
+        placeholders = ", ".join("?" * len(words))
+        rows = self.conn.execute(
+            f"SELECT a.* FROM apod a JOIN keywords k ON k.date = a.date WHERE k.word IN ({placeholders})"
+            f" GROUP BY a.date HAVING COUNT(*) = ? ORDER BY a.date DESC LIMIT ?",
+            (*words, len(words), limit),
+        )
+        return [dict(r) for r in rows]
+
+    def substitute_for(self, day):
+        """影片日的代打圖片：往年同一天最近的一張圖，沒有就用之前最近的一張圖"""
+        day = date.fromisoformat(str(day))
+        same_day = self.on_this_day(day.month, day.day, media_type="image", before=day)
+        if same_day:
+            return same_day[0]
+        row = self.conn.execute(
+            "SELECT * FROM apod WHERE media_type = 'image' AND date < ? ORDER BY date DESC LIMIT 1", (str(day),)
+        ).fetchone()
+        return dict(row) if row else None
+
+
+def _date_batches(start, end, batch_days):
+    while start <= end:
+        batch_end = min(start + timedelta(days=batch_days - 1), end)
+        yield start, batch_end
+        start = batch_end + timedelta(days=1)
+
+
+def load_archive(api_key, start=None, end=None, batch_days=BATCH_DAYS, archive=None, deadline=None):
+    """
+    批次下載 [start, end] (預設從上次進度接著抓到 APOD 的今天，美東日期)。
+    每批成功才推進進度，失敗就停下，下次執行從失敗的那一批重來。回傳這次寫入的筆數。
+    deadline (time.perf_counter 的截止時間) 到了就不再開始下一批，同樣留給下次執行。
+    """
+    own = archive is None
+    archive = archive if archive is not None else ApodArchive()  # 空的典藏 len() 為 0，不能用 or
+    total = 0
+    try:
+        loaded = archive.loaded_through()
+        if start is None:
+            start = loaded + timedelta(days=1) if loaded else FIRST_DATE
+        end = end or apod_today()
+        if start > end:
+            print("✅ APOD 典藏已是最新")
+            return 0
+
+        for batch_start, batch_end in _date_batches(start, end, batch_days):
+            t0 = time.perf_counter()
+            if deadline is not None and t0 >= deadline:
+                print(f"⏳ 典藏匯入時間預算用完，下次從 {batch_start} 接著抓")
+                break
+            params = {"api_key": api_key, "start_date": batch_start.isoformat(), "end_date": batch_end.isoformat()}
+            try:
+                with http_client.get("nasa_archive", APOD_API_URL, params=params, stream=True,
+                                     deadline=deadline) as resp:
+                    if resp.status_code != 200:
+                        print(f"❌ APOD API 回傳錯誤 {resp.status_code} ({batch_start} ~ {batch_end})，下次從這裡接著抓")
+                        break
+                    count = archive.load_batch(resp.iter_content(CHUNK_SIZE), batch_end)
+            except Exception as e:
+                print(f"❌ APOD 批次下載失敗 ({batch_start} ~ {batch_end})，下次從這裡接著抓: {e}")
+                break
+            total += count
+            print(f"📚 {batch_start} ~ {batch_end}: {count} 筆 ({time.perf_counter() - t0:.1f}s)")
+        print(f"✅ APOD 典藏共 {len(archive)} 筆 (這次新增 / 更新 {total} 筆)")
+    finally:
+        if own:
+            archive.close()
+    return total
+
+
+def update_from_today(api_key, today_data, archive=None, deadline=None):
+    """
+    每天的增量更新：今天的資料是 API 給的就直接寫進去 (不用多打 API)，
+    典藏已經初始化過、中間又漏了幾天時才補抓那段區間。
+    爬蟲 (source 不是 "api") 拿到的資料欄位不完整，不寫進典藏，這一天留給之後的 API 補抓。
+    """
+    own = archive is None
+    archive = archive if archive is not None else ApodArchive()  # 空的典藏 len() 為 0，不能用 or
+    try:
+        from_api = bool(today_data) and today_data.get("source") == "api" and bool(today_data.get("date"))
+        if from_api:
+            archive.record(today_data)
+        elif today_data:
+            print("ℹ️ 今天的 APOD 來自爬蟲，不寫進典藏 (之後由 API 補抓)")
+        loaded = archive.loaded_through()
+        if loaded is None:
+            return  # 還沒做過完整匯入 (taiwanbot.py archive)，只記錄今天
+        today = date.fromisoformat(today_data["date"]) if from_api else apod_today()
+        if loaded < today - timedelta(days=1):
+            load_archive(api_key, end=today, archive=archive, deadline=deadline)
+        elif from_api:
+            with archive.conn:
+                archive._set_meta("loaded_through", max(loaded, today).isoformat())
+    finally:
+        if own:
+            archive.close()
@@ -0,0 +1,193 @@
+"""APOD 網頁 (astropix.html / apYYMMDD.html) 串流擷取
+
+只找機器人需要的東西，拿齊了就停止解析 (後面的頁尾、導覽列不再處理)：
+- 日期、標題：<title>APOD: 2024 January 5 - 標題</title>，標題以圖片後第一個 <b> 為準
+- 媒體：第一個 <img> (外層 <a href> 是高解析度版本)，或影片日的 <iframe> / <video><source>
+- 解說：<b> Explanation: </b> 之後到下一個 <p> / <center> 之前的文字
+
+每一代的 APOD 頁面版型都有點差異 (1995 年的標題在第三個 <center>，近年有影片)，
+benchmarks/apod_corpus/ 收了依不同年份版型重建的頁面當作回歸測試。
+"""
+import codecs
+import re
+from datetime import datetime
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+PAGE_URL = "https://apod.nasa.gov/apod/astropix.html"
+
+_MONTHS = "January|February|March|April|May|June|July|August|September|October|November|December"
+_DATE_RE = re.compile(rf"(\d{{4}})\s+({_MONTHS})\s+(\d{{1,2}})")
+_WS_RE = re.compile(r"\s+")
+# <b> 裡這些字不是標題
+_LABELS = ("explanation", "credit", "copyright", "tomorrow", "authors", "editor")
+
+
+class _Done(Exception):
+    """資料拿齊了，中斷 feed()"""
+
+
+def _text(parts):
+    return _WS_RE.sub(" ", "".join(parts)).strip()
+
+
+def parse_date(text):
+    m = _DATE_RE.search(text or "")
+    if not m:
+        return None
+    try:
+        return datetime.strptime(" ".join(m.groups()), "%Y %B %d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+class ApodExtractor(HTMLParser):
+    def __init__(self, base_url=PAGE_URL):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.done = False
+        self.page_title = None
+        self.title = None
+        self.url = None
+        self.hdurl = None
+        self.media_type = None
+        self.explanation = None
+        self.body_date = None  # 頁面上方的日期文字 (<title> 沒有日期的舊版型用)
+
+        self._capture = None   # 目前在收集文字的欄位："page_title" / "label" / "explanation"
+        self._buf = []
+        self._link = None      # 目前所在 <a> 的 href
+        self._in_video = False
+
+    # ---------- 事件 ----------
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self._capture == "explanation":
+            if tag in ("p", "center"):
+                self._finish_explanation()
+            return
+
+        if tag == "title" and self.page_title is None:
+            self._start("page_title")
+        elif tag == "a":
+            self._link = attrs.get("href")
+        elif tag == "img" and self.url is None and attrs.get("src"):
+            self.media_type = "image"
+            self.url = self._abs(attrs["src"])
+            self.hdurl = self._abs(self._link) if self._link else self.url
+        elif tag == "iframe" and self.url is None and attrs.get("src"):
+            self.media_type = "video"
+            self.url = self.hdurl = self._abs(attrs["src"])
+        elif tag == "video" and self.url is None:
+            self._in_video = True
+            if attrs.get("src"):
+                self._set_video(attrs["src"])
+        elif tag == "source" and self._in_video and self.url is None and attrs.get("src"):
+            self._set_video(attrs["src"])
+        elif tag == "b" and self._capture is None:
+            self._start("label")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self._link = None
+        elif tag == "video":
+            self._in_video = False
+        elif tag == "title" and self._capture == "page_title":
+            self.page_title = _text(self._buf)
+            self._capture = None
+        elif tag == "b" and self._capture == "label":
+            self._label(_text(self._buf))
+        elif tag in ("body", "html") and self._capture == "explanation":
+            self._finish_explanation()
+
+    def handle_data(self, data):
+        if self._capture:
+            self._buf.append(data)
+        elif self.body_date is None and self.url is None:
+            self.body_date = parse_date(data)
+
+    # ---------- 內部 ----------
+    def _start(self, field):
+        self._capture = field
+        self._buf = []
+
+    def _abs(self, href):
+        return urljoin(self.base_url, href.strip())
+
+    def _set_video(self, src):
+        self.media_type = "video"
+        self.url = self.hdurl = self._abs(src)
+
+    def _label(self, text):
+        self._capture = None
+        lowered = text.lower()
+        if lowered.startswith("explanation"):
+            self._start("explanation")
+        elif self.title is None and self.url is not None and text and not lowered.startswith(_LABELS):
+            # 媒體之後第一個不是欄位名稱的 <b> 就是標題
+            self.title = text
+
+    def _finish_explanation(self):
+        self.explanation = _text(self._buf)
+        self._capture = None
+        self.done = True
+        raise _Done
+
+    # ---------- 結果 ----------
+    def result(self):
+        """沒有找到媒體就回傳 None"""
+        if self.url is None:
+            return None
+        title = self.title
+        date = self.body_date
+        if self.page_title:
+            date = parse_date(self.page_title) or date
+            if not title:
+                # "APOD: 2024 January 5 - 標題"
+                title = re.split(r"\s[-–—]\s", self.page_title, maxsplit=1)[-1].strip() or None
+        if self._capture == "explanation" and self.explanation is None:
+            self.explanation = _text(self._buf)
+        return {
+            "date": date,
+            "title": title,
+            "url": self.url,
+            "hdurl": self.hdurl,
+            "media_type": self.media_type,
+            "explanation": self.explanation,
+        }
+
+    def feed(self, data):
+        """餵一段文字；資料拿齊後回傳 True，呼叫端就可以停止下載"""
+        if self.done:
+            return True
+        try:
+            super().feed(data)
+        except _Done:
+            pass
+        return self.done
+
+    def close(self):
+        if self.done:
+            return
+        try:
+            super().close()
+        except _Done:
+            pass
+
+
+def extract(chunks, encoding="utf-8", base_url=PAGE_URL):
+    """從 bytes 區塊擷取 APOD 資料；拿齊就不再讀取剩下的區塊。回傳 (資料或 None, 讀了幾個 bytes)"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    parser = ApodExtractor(base_url)
+    read = 0
+    for chunk in chunks:
+        read += len(chunk)
+        if parser.feed(decoder.decode(chunk)):
+            break
+    else:
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+    return parser.result(), read
@@ -0,0 +1,232 @@
+"""天氣警特報輪詢效能測試 (錄製的 W-C0033-001 回應，不需要任何金鑰)
+
+依序播放 benchmarks/alert_payloads/ 的特報 (無特報 → 北部大雨 → 升級豪雨 / 延長 → 部分解除 → 颱風)，
+每一步輪詢兩次 (第二次內容沒變)，並用假的 LINE 伺服器收訊息：
+- 每次輪詢的結果與耗時 (304、內容雜湊相同、只有解除、有新特報並發送)
+- 從輪詢開始到最後一位受影響訂閱者收到的時間
+- 收件者是否正好是「偏好縣市和新增 / 變更特報有交集」的訂閱者 (暴力比對)，
+  每個人收到的訊息有提到自己訂閱的縣市，其他縣市只會是同一區域的
+- 穩定狀態下每輪的成本 (304 / 伺服器不支援 ETag 時靠內容雜湊)
+
+用法：
+    python benchmarks/bench_alerts.py [--subscribers 100000] [--idle-polls 200]
+收件者不符時 exit code 為 1。
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+
+class FakeCwaLine:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.payload = b""
+        self.etag = None
+        self.use_etag = True
+        self.cwa_requests = 0
+        self.received = {}  # 訂閱者 → 訊息文字
+        self.last_received_at = None
+
+    def set_payload(self, raw):
+        self.payload = raw
+        self.etag = '"' + hashlib.md5(raw).hexdigest() + '"'
+
+    def take_received(self):
+        with self.lock:
+            received, self.received = self.received, {}
+            at, self.last_received_at = self.last_received_at, None
+        return received, at
+
+
+def make_handler(svc):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _reply(self, status, body=b"{}", headers=()):
+            self.send_response(status)
+            for k, v in headers:
+                self.send_header(k, v)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with svc.lock:
+                svc.cwa_requests += 1
+            if svc.use_etag and self.headers.get("If-None-Match") == svc.etag:
+                self._reply(304, b"", [("ETag", svc.etag)])
+            else:
+                self._reply(200, svc.payload, [("ETag", svc.etag)] if svc.use_etag else [])
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            to = body["to"] if isinstance(body["to"], list) else [body["to"]]
+            text = body["messages"][0]["text"]
+            with svc.lock:
+                for rid in to:
+                    svc.received[rid] = text
+                svc.last_received_at = time.perf_counter()
+            self._reply(200)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def make_subscribers(n, rnd):
+    """(ID list, 偏好檔內容)：40% 沒設定 (全部縣市)、30% 一個區域、30% 1~3 個縣市"""
+    from regions import COUNTY_TO_REGION, REGION_MAP
+
+    ids, prefs = [], {}
+    counties, regions = sorted(COUNTY_TO_REGION), list(REGION_MAP)
+    for i in range(n):
+        sid = f"{'C' if rnd.random() < 0.002 else 'U'}{i:032x}"
+        ids.append(sid)
+        roll = rnd.random()
+        if roll < 0.3:
+            prefs[sid] = [rnd.choice(regions)]
+        elif roll < 0.6:
+            prefs[sid] = rnd.sample(counties, rnd.randint(1, 3))
+    return ids, prefs
+
+
+def expected_recipients(ids, prefs, alerts):
+    """暴力比對：偏好縣市和這次新增 / 變更的特報有交集的訂閱者"""
+    from preferences import normalize_selection
+
+    affected = {a["county"] for a in alerts}
+    result = set()
+    if not affected:
+        return result
+    for sid in ids:
+        cities = normalize_selection(prefs.get(sid))
+        if cities is None or cities & affected:
+            result.add(sid)
+    return result
+
+
+def content_matches(text, cities):
+    """訊息提到訂閱的縣市，且其他縣市都在同一個區域 (全部縣市的不用檢查)"""
+    from regions import COUNTY_TO_REGION
+
+    if cities is None:
+        return True
+    regions = {COUNTY_TO_REGION[c] for c in cities}
+    mentioned = [c for c in COUNTY_TO_REGION if c in text]
+    return any(c in cities for c in mentioned) and all(COUNTY_TO_REGION[c] in regions for c in mentioned)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=100000)
+    parser.add_argument("--idle-polls", type=int, default=200, help="穩定狀態量測的輪詢次數")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="alerts-")
+    svc = FakeCwaLine()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(svc))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    # 模組在 import 時讀設定，先把環境變數指到暫存目錄與假伺服器
+    os.environ.update({
+        "CWA_API_KEY": "bench", "CWA_API_BASE": base, "LINE_TOKEN": "bench", "LINE_API_BASE": base,
+        "CWA_SNAPSHOT_DIR": os.path.join(workdir, "cwa"),
+        "SUBSCRIBER_DB": os.path.join(workdir, "subscribers.db"),
+        "SUBSCRIBER_PREFS_FILE": os.path.join(workdir, "prefs.json"),
+        "OUTBOX_DB": os.path.join(workdir, "outbox.db"),
+    })
+    os.environ.pop("WEBHOOK_URL", None)
+    os.environ.pop("SUBSCRIBER_API_URL", None)
+    os.environ.pop("LINE_USER_ID", None)
+    import http_client
+    import weather_alerts
+    from preferences import normalize_selection
+    from subscribers import SubscriberStore
+
+    rnd = random.Random(0)
+    ids, prefs = make_subscribers(args.subscribers, rnd)
+    with open(os.environ["SUBSCRIBER_PREFS_FILE"], "w", encoding="utf-8") as f:
+        json.dump(prefs, f, ensure_ascii=False)
+    with SubscriberStore(os.environ["SUBSCRIBER_DB"]) as store:
+        store.replace_all(ids)
+
+    results = {"subscribers": args.subscribers, "steps": [], "idle": {}}
+    failed = False
+    watcher = weather_alerts.AlertWatcher()
+    try:
+        previous = {}
+        for path in sorted(glob.glob(os.path.join(HERE, "alert_payloads", "*.json"))):
+            with open(path, "rb") as f:
+                raw = f.read()
+            svc.set_payload(raw)
+            current = weather_alerts.parse_alerts(json.loads(raw))
+            new, changed, _ = weather_alerts.diff_alerts(previous, current)
+            expected = expected_recipients(ids, prefs, new + changed)
+            previous = {k: weather_alerts._fingerprint(a) for k, a in current.items()}
+
+            started = time.perf_counter()
+            outcome = watcher.poll()
+            poll_s = time.perf_counter() - started
+            received, last_at = svc.take_received()
+            t0 = time.perf_counter()
+            again = watcher.poll()
+            again_ms = (time.perf_counter() - t0) * 1000
+
+            wrong_content = sum(1 for sid, text in received.items()
+                                if not content_matches(text, normalize_selection(prefs.get(sid))))
+            ok = set(received) == expected and wrong_content == 0 and again == "not_modified"
+            failed |= not ok
+            step = {
+                "payload": os.path.basename(path),
+                "result": outcome,
+                "poll_s": round(poll_s, 3),
+                "last_delivery_s": round(last_at - started, 3) if last_at else None,
+                "recipients": len(received),
+                "expected": len(expected),
+                "wrong_content": wrong_content,
+                "repeat_poll": again,
+                "repeat_poll_ms": round(again_ms, 2),
+            }
+            results["steps"].append(step)
+            print(f"{'✅' if ok else '❌'} {step['payload']}: {outcome} {poll_s:.2f}s, "
+                  f"收件 {len(received)} / 預期 {len(expected)}，重複輪詢 {again} {again_ms:.1f}ms", file=sys.stderr)
+
+        # 穩定狀態：沒有任何變化時每輪的成本
+        for use_etag in (True, False):
+            svc.use_etag = use_etag
+            watcher.poll()
+            t0 = time.perf_counter()
+            outcomes = {watcher.poll() for _ in range(args.idle_polls)}
+            per_poll = (time.perf_counter() - t0) / args.idle_polls * 1000
+            results["idle"]["etag" if use_etag else "no_etag"] = {"ms_per_poll": round(per_poll, 3),
+                                                                  "results": sorted(outcomes)}
+    finally:
+        server.shutdown()
+        http_client.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if failed:
+        print("❌ 收件者或訊息內容和預期不符")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
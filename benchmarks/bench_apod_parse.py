@@ -0,0 +1,148 @@
+"""APOD 網頁擷取效能 / 正確率測試
+
+比較：
+- bs4：舊做法，整頁建 BeautifulSoup 樹，取第一個 <img> 和第二個 <center> 裡的 <b> (沒有解說)
+- stream：apod_page.extract 串流擷取，拿齊就停
+
+語料在 benchmarks/apod_corpus/：依各年代 APOD 版型重建的精簡頁面 (含 iframe / <video> 影片日、
+解說之後的導覽列與頁尾)，不是原始存檔，部分連結換成了 example.org；expected.json 是每頁的正確答案，
+解說只比對開頭和結尾。存下來的真實頁面可以加在命令列 (不比對欄位，只量時間與提早停止)。
+
+提早停止的檢查：用 1 byte 的區塊找出每頁「拿齊資料」的位置，
+再確認用 --chunk 大小的區塊時，讀到包含那個位置的區塊就停了 (後面的區塊沒有被讀)。
+--chunk 預設比語料的每一頁都小，bytes_parsed_pct 才看得出少讀了多少。
+
+用法：
+    python benchmarks/bench_apod_parse.py [--iterations 200] [--chunk 512] [saved_apod.html ...]
+擷取結果不對或沒有提早停止時 exit code 為 1。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import apod_page  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "apod_corpus")
+FIELDS = ("date", "title", "media_type", "url", "hdurl", "explanation")
+BASE = "https://apod.nasa.gov/apod/"
+
+
+def parse_bs4(body, chunk, base_url):
+    """舊的 nasa_bot.get_nasa_from_website 解析邏輯 (整頁下載完才解析)"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body.decode("utf-8", errors="replace"), "html.parser")
+    img_tag = soup.find("img")
+    if not img_tag:
+        return None, len(body)
+    img_url = base_url.rsplit("/", 1)[0] + "/" + img_tag["src"]
+    title = "NASA Unknown Star"
+    center_tags = soup.find_all("center")
+    if len(center_tags) >= 2:
+        title_tag = center_tags[1].find("b")
+        if title_tag:
+            title = title_tag.text.strip()
+    return {"title": title, "url": img_url, "hdurl": img_url, "explanation": None,
+            "date": time.strftime("%Y-%m-%d"), "media_type": "image"}, len(body)
+
+
+def parse_stream(body, chunk, base_url):
+    return apod_page.extract((body[i:i + chunk] for i in range(0, len(body), chunk)), base_url=base_url)
+
+
+def field_ok(name, got, want):
+    if got is None:
+        return False
+    value = got.get(name)
+    if name == "explanation":
+        start, end = want
+        return bool(value) and value.startswith(start) and value.endswith(end)
+    return value == want
+
+
+def early_stop_failures(pages, chunk):
+    """讀到「拿齊資料的位置」所在的區塊就停了嗎？回傳 [(頁面, 實際讀的 bytes, 應該讀的 bytes)]"""
+    failures = []
+    for name, body, _ in pages:
+        needed = parse_stream(body, 1, BASE + name)[1]
+        expected = min(len(body), -(-needed // chunk) * chunk)
+        read = parse_stream(body, chunk, BASE + name)[1]
+        if read != expected:
+            failures.append((name, read, expected))
+    return failures
+
+
+def bench(parse, pages, iterations, chunk):
+    result = {"pages": len(pages)}
+    correct = {f: 0 for f in FIELDS}
+    scored = 0
+    bytes_read = 0
+    for name, body, expected in pages:
+        data, read = parse(body, chunk, BASE + name)
+        bytes_read += read
+        if expected:
+            scored += 1
+            for f in FIELDS:
+                correct[f] += field_ok(f, data, expected[f])
+
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        for name, body, _ in pages:
+            parse(body, chunk, BASE + name)
+    per_page = (time.perf_counter() - t0) / (iterations * len(pages))
+
+    result["per_page_us"] = round(per_page * 1e6, 1)
+    result["bytes_parsed_pct"] = round(100 * bytes_read / sum(len(b) for _, b, _ in pages), 1)
+    if scored:
+        result["accuracy"] = {f: f"{correct[f]}/{scored}" for f in FIELDS}
+        result["fields_correct_pct"] = round(100 * sum(correct.values()) / (scored * len(FIELDS)), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("extra", nargs="*", help="其他存下來的 APOD 頁面 (只量時間)")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--chunk", type=int, default=512, help="模擬下載區塊大小 (bytes，預設比語料的每一頁都小)")
+    args = parser.parse_args()
+
+    with open(os.path.join(CORPUS, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    pages = []
+    for name in sorted(expected):
+        with open(os.path.join(CORPUS, name), "rb") as f:
+            pages.append((name, f.read(), expected[name]))
+    for path in args.extra:
+        with open(path, "rb") as f:
+            pages.append((os.path.basename(path), f.read(), None))
+
+    results = {"stream": bench(parse_stream, pages, args.iterations, args.chunk)}
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        print("⚠️ 沒有安裝 beautifulsoup4，略過舊做法的比較 (pip install beautifulsoup4)")
+    else:
+        results["bs4"] = bench(parse_bs4, pages, args.iterations, args.chunk)
+        results["speedup"] = round(results["bs4"]["per_page_us"] / results["stream"]["per_page_us"], 2)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    failed = False
+    stream = results["stream"]
+    if stream.get("fields_correct_pct", 100) < 100:
+        print("❌ 串流擷取結果和 expected.json 不一致")
+        failed = True
+    for name, read, expected in early_stop_failures(pages, args.chunk):
+        print(f"❌ {name} 沒有在拿齊資料後停止：讀了 {read} bytes，應該只讀 {expected} bytes")
+        failed = True
+    if stream["bytes_parsed_pct"] >= 100:
+        print(f"❌ 區塊 {args.chunk} bytes 時沒有少讀任何內容 (區塊比頁面大時看不出提早停止)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
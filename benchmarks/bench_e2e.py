@@ -0,0 +1,417 @@
+"""端對端效能測試 (不需要任何金鑰)
+
+在本機啟動一個假伺服器，同時扮演：
+- 氣象局 F-C0032-001 與自動氣象站觀測 O-A0001-001
+- APOD API、APOD 官網 (benchmarks/apod_corpus 的頁面) 與圖片
+- Gemini generateContent (延遲可調；依請求的 responseSchema 回 JSON，可注入壞掉的輸出)
+- LINE multicast / push (可注入 429 / 5xx 比例)
+- Discord webhook、GAS 訂閱者 API
+
+每個 (機器人, 訂閱者數) 各開一個子行程跑完整流程 (taiwanbot.py weather / nasa)，
+所有快取 / 資料庫放在暫存目錄，每次都是冷啟動。階段耗時取自 telemetry 的 events.jsonl。
+--located 比例的訂閱者在偏好檔裡有座標 (卡片會顯示最近測站的即時氣溫)。
+輸出 JSON (牆鐘時間、LINE 送達速率、峰值 RSS、各端點請求數)，可以用 --compare 和舊版本的結果比較。
+
+用法：
+    python benchmarks/bench_e2e.py [--sizes 10,1000,100000] [--bots weather,nasa]
+        [--gemini-latency-ms 800] [--gemini-malformed 0.5] [--line-429 0.02] [--line-5xx 0.01] [--located 0.1]
+        [-o results.json] [--compare old.json]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+CITIES = ["基隆市", "臺北市", "新北市", "桃園市", "新竹市", "新竹縣", "苗栗縣", "臺中市", "彰化縣", "南投縣", "雲林縣",
+          "嘉義市", "嘉義縣", "臺南市", "高雄市", "屏東縣", "宜蘭縣", "花蓮縣", "臺東縣", "澎湖縣", "金門縣", "連江縣"]
+GEMINI_TEXT = "今晚的星空像一場安靜的煙火。"
+
+
+def fill_schema(schema):
+    """依 responseSchema 產生一份合格的回覆"""
+    if schema.get("type", "").upper() == "OBJECT":
+        return {name: fill_schema(sub) for name, sub in schema.get("properties", {}).items()}
+    return GEMINI_TEXT
+
+
+# ---------- 假資料 ----------
+def cwa_payload(seed=0):
+    """F-C0032-001 同結構的 36 小時預報"""
+    rnd = random.Random(seed)
+    today = date.today().isoformat()
+    periods = [(f"{today} 06:00:00", f"{today} 18:00:00"), (f"{today} 18:00:00", f"{today} 23:59:59"),
+               (f"{today} 23:59:59", f"{today} 23:59:59")]
+    locations = []
+    for city in CITIES:
+        elements = []
+        for name in ("Wx", "PoP", "MinT", "CI", "MaxT"):
+            times = []
+            for start, end in periods:
+                if name == "Wx":
+                    p = {"parameterName": rnd.choice(["晴時多雲", "多雲", "陰短暫雨"]), "parameterValue": str(rnd.randint(1, 20))}
+                elif name == "PoP":
+                    p = {"parameterName": str(rnd.choice([0, 10, 30, 50, 70, 90])), "parameterUnit": "百分比"}
+                elif name == "CI":
+                    p = {"parameterName": "舒適"}
+                else:
+                    p = {"parameterName": str(rnd.randint(15, 33)), "parameterUnit": "C"}
+                times.append({"startTime": start, "endTime": end, "parameter": p})
+            elements.append({"elementName": name, "time": times})
+        locations.append({"locationName": city, "weatherElement": elements})
+    return {"success": "true", "records": {"datasetDescription": "三十六小時天氣預報", "location": locations}}
+
+
+def sample_image():
+    """APOD 原圖 (有 Pillow 就產生 3000x2000 的 JPEG，沒有就給一小段 bytes，衍生檔會失敗改用原圖網址)"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8\xff\xd9"
+    img = Image.merge("RGB", [Image.effect_noise((3000, 2000), 40 + 20 * i) for i in range(3)])
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def write_locations(path, ids, ratio, seed=0):
+    """偏好檔：ratio 比例的訂閱者填上縣市所在地附近的座標"""
+    from bench_stations import COUNTY_SEATS
+
+    rnd = random.Random(seed)
+    seats = [seat[:2] for seat in COUNTY_SEATS.values()]
+    prefs = {}
+    for sid in ids:
+        if rnd.random() < ratio:
+            lat, lon = rnd.choice(seats)
+            prefs[sid] = {"location": [lat + rnd.gauss(0, 0.08), lon + rnd.gauss(0, 0.08)]}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(prefs, f)
+
+
+def subscriber_ids(n, group_ratio, seed=0):
+    rnd = random.Random(seed)
+    ids = []
+    for i in range(n):
+        prefix = "C" if rnd.random() < group_ratio else "U"
+        ids.append(f"{prefix}{i:032x}")
+    return ids
+
+
+# ---------- 假伺服器 ----------
+class FakeServices:
+    def __init__(self, gemini_latency, gemini_malformed, line_429, line_5xx, latency, seed=0):
+        self.gemini_latency = gemini_latency
+        self.gemini_malformed = gemini_malformed
+        self.line_429 = line_429
+        self.line_5xx = line_5xx
+        self.latency = latency
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.base = None
+        self.cwa = json.dumps(cwa_payload()).encode()
+        self.obs = self._obs_payload()
+        self.image = sample_image()
+        with open(os.path.join(HERE, "apod_corpus", "ap240105.html"), "rb") as f:
+            self.html = f.read()
+        self.subscribers = b"[]"
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = Counter()   # "端點 狀態碼" → 次數
+            self.delivered = Counter()  # LINE 實際收到 (200) 的收件者數，依通道
+
+    @staticmethod
+    def _obs_payload():
+        try:
+            import numpy as np
+            from bench_stations import make_payload
+        except ImportError:
+            return json.dumps({"records": {"Station": []}}).encode()
+        return json.dumps(make_payload(np.random.default_rng(0), 700), ensure_ascii=False).encode()
+
+    def set_subscribers(self, ids):
+        self.subscribers = json.dumps(ids).encode()
+
+    def apod(self):
+        return json.dumps({
+            "date": date.today().isoformat(), "media_type": "image", "title": "The Galaxy NGC 1232",
+            "url": f"{self.base}/apod/image/bench.jpg", "hdurl": f"{self.base}/apod/image/bench_big.jpg",
+            "explanation": "Galaxies are fascinating not only for what is visible, but for what is invisible.",
+        }).encode()
+
+    def line_status(self):
+        with self.lock:
+            roll = self.rnd.random()
+        if roll < self.line_429:
+            return 429
+        if roll < self.line_429 + self.line_5xx:
+            return 500
+        return 200
+
+    def record(self, name, status):
+        with self.lock:
+            self.requests[f"{name} {status}"] += 1
+
+
+def make_handler(svc):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _reply(self, name, status, body=b"{}", content_type="application/json"):
+            svc.record(name, status)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 用戶端逾時先放棄了 (測時間預算時會發生)
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            time.sleep(svc.latency)
+            if path.startswith("/api/v1/rest/datastore/O-A0001-001"):
+                self._reply("cwa_obs", 200, svc.obs)
+            elif path.startswith("/api/v1/rest/datastore/"):
+                self._reply("cwa", 200, svc.cwa)
+            elif path == "/planetary/apod":
+                self._reply("apod_api", 200, svc.apod())
+            elif path == "/apod/astropix.html":
+                self._reply("apod_web", 200, svc.html, "text/html; charset=utf-8")
+            elif path.startswith("/apod/image/"):
+                self._reply("apod_image", 200, svc.image, "image/jpeg")
+            elif path == "/gas":
+                self._reply("gas", 200, svc.subscribers)
+            else:
+                self._reply("unknown", 404)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            path = urlsplit(self.path).path
+            if path.endswith(":generateContent"):
+                time.sleep(svc.gemini_latency)
+                schema = json.loads(body).get("generationConfig", {}).get("responseSchema")
+                text = json.dumps(fill_schema(schema), ensure_ascii=False) if schema else GEMINI_TEXT
+                with svc.lock:
+                    malformed = svc.rnd.random() < svc.gemini_malformed
+                if malformed:
+                    text = text[:len(text) // 2]  # 輸出被截斷
+                reply = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                         "finishReason": "STOP", "index": 0}]}
+                self._reply("gemini", 200, json.dumps(reply, ensure_ascii=False).encode())
+            elif path.startswith("/v2/bot/message/"):
+                time.sleep(svc.latency)
+                channel = path.rsplit("/", 1)[-1]
+                status = svc.line_status()
+                if status == 200:
+                    to = json.loads(body)["to"]
+                    with svc.lock:
+                        svc.delivered[channel] += len(to) if isinstance(to, list) else 1
+                self._reply(f"line_{channel}", status)
+            elif path.startswith("/api/webhooks/"):
+                time.sleep(svc.latency)
+                self._reply("discord", 204, b"")
+            else:
+                self._reply("unknown", 404)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+# ---------- 子行程：跑一次完整流程 ----------
+def run_child(bot):
+    import taiwanbot
+
+    t0 = time.perf_counter()
+    with open(os.environ["BENCH_LOG"], "w", encoding="utf-8") as log:
+        stdout = sys.stdout
+        sys.stdout = log
+        try:
+            code = taiwanbot.main([bot])
+        finally:
+            sys.stdout = stdout
+    wall = time.perf_counter() - t0
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"exit_code": code, "wall_s": round(wall, 3), "peak_rss_mb": round(peak_kb / 1024, 1)}))
+
+
+def child_env(base, workdir):
+    env = dict(os.environ)
+    env.update({
+        "CWA_API_KEY": "bench", "GEMINI_API_KEY": "bench", "LINE_TOKEN": "bench", "NASA_API_KEY": "bench",
+        "CWA_API_BASE": base,
+        "APOD_API_URL": f"{base}/planetary/apod",
+        "APOD_WEB_URL": f"{base}/apod/astropix.html",
+        "GEMINI_API_BASE": base,
+        "LINE_API_BASE": base,
+        "WEBHOOK_URL": f"{base}/api/webhooks/1/bench",
+        "SUBSCRIBER_API_URL": f"{base}/gas",
+        "LINE_USER_ID": "",
+        # 每次都是乾淨的快取 / 資料庫
+        "AI_CACHE_DIR": os.path.join(workdir, "gemini"),
+        "CWA_SNAPSHOT_DIR": os.path.join(workdir, "cwa"),
+        "FORECAST_HISTORY_FILE": os.path.join(workdir, "forecast_history.bin"),
+        "SUBSCRIBER_DB": os.path.join(workdir, "subscribers.db"),
+        "OUTBOX_DB": os.path.join(workdir, "outbox.db"),
+        "APOD_ARCHIVE_DB": os.path.join(workdir, "apod.db"),
+        "IMAGE_CACHE_DIR": os.path.join(workdir, "images"),
+        "SUBSCRIBER_PREFS_FILE": os.path.join(workdir, "prefs.json"),
+        "TELEMETRY_DIR": os.path.join(workdir, "telemetry"),
+        "BENCH_LOG": os.path.join(workdir, "run.log"),
+    })
+    env.pop("IMAGE_PUBLIC_BASE_URL", None)
+    return env
+
+
+def stage_durations(workdir):
+    path = os.path.join(workdir, "telemetry", "events.jsonl")
+    stages = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            events = [json.loads(line) for line in f]
+    except OSError:
+        return stages
+    roots = {e["span"] for e in events if e["type"] == "span" and e["parent"] is None}
+    for e in events:
+        if e["type"] == "span" and (e["parent"] in roots or e["span"] in roots):
+            stages[e["name"]] = round(e["duration_ms"] / 1000, 3)
+    return stages
+
+
+def run_one(svc, bot, size, group_ratio, located, keep):
+    ids = subscriber_ids(size, group_ratio)
+    svc.set_subscribers(ids)
+    svc.reset()
+    workdir = tempfile.mkdtemp(prefix=f"e2e-{bot}-{size}-")
+    try:
+        if located:
+            write_locations(os.path.join(workdir, "prefs.json"), ids, located)
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", bot],
+                             env=child_env(svc.base, workdir), capture_output=True, text=True, cwd=workdir)
+        if out.returncode != 0 and not out.stdout.strip():
+            raise RuntimeError(f"{bot}@{size} 子行程失敗：\n{out.stderr[-2000:]}")
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        stages = stage_durations(workdir)
+        delivered = sum(svc.delivered.values())
+        line_s = stages.get("LINE")
+        result.update({
+            "subscribers": size,
+            "line_delivered": delivered,
+            "line_recipients_per_s": round(delivered / line_s, 1) if line_s else None,
+            "stages_s": stages,
+            "requests": dict(sorted(svc.requests.items())),
+        })
+        if result["exit_code"] != 0 or delivered < size:
+            result["log"] = os.path.join(workdir, "run.log") if keep else None
+        return result
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(old, new):
+    print("📊 和基準比較 (wall_s / LINE 速率)：")
+    for key, run in new["runs"].items():
+        base = old.get("runs", {}).get(key)
+        if not base:
+            continue
+        wall = (run["wall_s"] - base["wall_s"]) / base["wall_s"] * 100
+        line = ""
+        if run.get("line_recipients_per_s") and base.get("line_recipients_per_s"):
+            line = f"，LINE {base['line_recipients_per_s']} → {run['line_recipients_per_s']} 人/秒"
+        print(f"   {key}: {base['wall_s']}s → {run['wall_s']}s ({wall:+.1f}%){line}，"
+              f"RSS {base['peak_rss_mb']} → {run['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,1000,100000", help="訂閱者數 (逗號分隔)")
+    parser.add_argument("--bots", default="weather,nasa")
+    parser.add_argument("--gemini-latency-ms", type=float, default=800)
+    parser.add_argument("--gemini-malformed", type=float, default=0.0, help="Gemini 回傳截斷 JSON 的比例")
+    parser.add_argument("--latency-ms", type=float, default=5, help="其他假端點的延遲")
+    parser.add_argument("--line-429", type=float, default=0.0, help="LINE 回 429 的比例")
+    parser.add_argument("--line-5xx", type=float, default=0.0, help="LINE 回 500 的比例")
+    parser.add_argument("--group-ratio", type=float, default=0.001, help="訂閱者中群組 (走 push) 的比例")
+    parser.add_argument("--located", type=float, default=0.0, help="偏好檔裡有座標的訂閱者比例")
+    parser.add_argument("-o", "--output", help="結果寫到 JSON 檔")
+    parser.add_argument("--compare", help="和之前的結果 JSON 比較")
+    parser.add_argument("--keep", action="store_true", help="保留每次執行的暫存目錄 (看 log)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return 0
+
+    svc = FakeServices(args.gemini_latency_ms / 1000, args.gemini_malformed, args.line_429, args.line_5xx, args.latency_ms / 1000)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(svc))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    svc.base = f"http://127.0.0.1:{server.server_port}"
+
+    results = {
+        "meta": {
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "child", "keep")},
+        },
+        "runs": {},
+    }
+    try:
+        for bot in args.bots.split(","):
+            for size in (int(s) for s in args.sizes.split(",")):
+                key = f"{bot}@{size}"
+                run = results["runs"][key] = run_one(svc, bot, size, args.group_ratio, args.located, args.keep)
+                ok = run["exit_code"] == 0 and run["line_delivered"] >= size
+                print(f"{'✅' if ok else '❌'} {key}: {run['wall_s']}s, LINE {run['line_delivered']}/{size} "
+                      f"({run['line_recipients_per_s']} 人/秒), RSS {run['peak_rss_mb']} MB", file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"✅ 已輸出到 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), results)
+    failed = [k for k, r in results["runs"].items() if r["exit_code"] != 0 or r["line_delivered"] < r["subscribers"]]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
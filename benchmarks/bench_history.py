@@ -0,0 +1,189 @@
+"""預報歷史效能測試 (合成的多年預報，不需要任何金鑰)
+
+模擬每天 4 次發布 × 3 個時段、連續好幾年的 F-C0032-001 (有季節變化與隨機缺值)，量測：
+- 附加寫入、檔案大小、打開 (memory-map) 的時間
+- 趨勢查詢 (和昨天 / 上週比、近 7 日平均、歷史紀錄) 的時間
+- 對照組：同樣的資料存成 JSON lines，每次讀進 Python 物件再逐縣市計算
+
+numpy 版本的結果必須和 Python 逐筆計算完全相同，不同時 exit code 為 1。
+
+用法：
+    python benchmarks/bench_history.py [--years 5] [--queries 50]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import forecast_history  # noqa: E402
+from forecast_history import DAY, RECORD_MIN_DAYS  # noqa: E402
+from forecast_table import MISSING  # noqa: E402
+
+# 時段開始的時刻 (台灣時間)：06:00 今日、18:00 今晚明晨
+PERIOD_HOURS = (6, 18)
+# 發布時刻
+ISSUE_HOURS = (5, 11, 17, 23)
+
+
+def synthesize(history, years, rnd):
+    """依時間順序產生紀錄 (每次發布涵蓋目前和接下來共 3 個時段)，回傳 structured array"""
+    n = len(history.cities)
+    first = forecast_history.parse_time("2021-01-01 00:00:00")
+    days = int(years * 365)
+    issues = first + (np.arange(days)[:, None] * DAY + np.array(ISSUE_HOURS) * 3600).ravel()
+    # 每次發布涵蓋「目前所在的時段」和接下來兩個 (時段從 06:00 / 18:00 開始)
+    grid = first + PERIOD_HOURS[0] * 3600 + np.arange(-1, 2 * days + 2) * (DAY // 2)
+    current = np.searchsorted(grid, issues, side="right") - 1
+    rows = [(int(grid[i + k]), int(issued)) for i, issued in zip(current, issues) for k in range(3)]
+
+    records = np.zeros(len(rows), dtype=history.records.dtype)
+    records["start"], records["issued"] = np.array(rows).T
+    season = np.cos((records["start"] - first) / (365.25 * DAY) * 2 * np.pi)[:, None]
+    night = (records["start"] % DAY == (first + 18 * 3600) % DAY)[:, None]
+    base = 24 - 6 * season - 3 * night + rnd.normal(0, 0.7, (1, n))
+    records["MaxT"] = np.round(base + 4 + rnd.normal(0, 2.5, (len(rows), n)))
+    records["MinT"] = np.round(base - 3 + rnd.normal(0, 2.5, (len(rows), n)))
+    records["PoP"] = rnd.choice([0, 10, 20, 30, 50, 70, 90], (len(rows), n))
+    records["Wx"] = rnd.integers(1, 43, (len(rows), n))
+    for name in forecast_history.ELEMENTS:
+        records[name][rnd.random((len(rows), n)) < 0.01] = MISSING
+    return records
+
+
+def heat_wave(records, starts, rnd):
+    """讓這些時段最新一筆預報的某個縣市高溫破紀錄 (確認紀錄判斷有被測到)"""
+    for start in starts:
+        last = np.flatnonzero(records["start"] == start)[-1]
+        records["MaxT"][last, rnd.integers(records["MaxT"].shape[1])] = 45
+
+
+def write_jsonl(path, history, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            row = {"start": int(r["start"]), "issued": int(r["issued"])}
+            for name in forecast_history.ELEMENTS:
+                row[name] = dict(zip(history.cities, r[name].tolist()))
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def python_trends(path, cities, start):
+    """對照組：讀進 Python 物件，逐縣市計算 (和 ForecastHistory.trends 同樣的定義)"""
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    latest = {}
+    for row in rows:
+        latest[row["start"]] = row  # 同一個時段取最後附加的
+
+    def value(t, name, city):
+        row = latest.get(t)
+        if row is None or row[name][city] == MISSING:
+            return None
+        return row[name][city]
+
+    past = [row for row in rows if row["start"] < start and row["start"] % DAY == start % DAY]
+    days = len({row["start"] // DAY for row in past})
+    result = {}
+    for city in cities:
+        high, low = value(start, "MaxT", city), value(start, "MinT", city)
+        diff = lambda name, days_ago: (None if value(start, name, city) is None
+                                       or value(start - days_ago * DAY, name, city) is None
+                                       else value(start, name, city) - value(start - days_ago * DAY, name, city))
+        week = [value(start - d * DAY, "MaxT", city) for d in range(1, 8)]
+        week = [v for v in week if v is not None]
+        record_high = record_low = None
+        if days >= RECORD_MIN_DAYS:
+            highs = [row["MaxT"][city] for row in past if row["MaxT"][city] != MISSING]
+            lows = [row["MinT"][city] for row in past if row["MinT"][city] != MISSING]
+            record_high, record_low = max(highs, default=None), min(lows, default=None)
+        result[city] = {
+            "max_day": diff("MaxT", 1),
+            "min_day": diff("MinT", 1),
+            "max_week": diff("MaxT", 7),
+            "max_avg7": sum(week) / len(week) if week else None,
+            "record_high": high is not None and record_high is not None and high > record_high,
+            "record_low": low is not None and record_low is not None and low < record_low,
+        }
+    return result
+
+
+def same(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and math.isclose(a, b, abs_tol=1e-9)
+    return a == b
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    value = func(*args)
+    return value, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--queries", type=int, default=50, help="隨機查詢幾個時段")
+    parser.add_argument("--check", type=int, default=5, help="其中幾個和 Python 逐筆計算比對")
+    args = parser.parse_args()
+
+    rnd = np.random.default_rng(0)
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "forecast_history.bin")
+        history = forecast_history.load(path)
+        records = synthesize(history, args.years, rnd)
+        starts = np.unique(records["start"])
+        queries = rnd.choice(starts[len(starts) // 2:], args.queries, replace=False)
+        heat_wave(records, queries[:2], rnd)
+        # 分批附加 (模擬每天寫入)，最後一批單獨計時
+        for chunk in np.array_split(records[:-3], 20):
+            history.append_records(chunk)
+        _, append_s = timed(history.append_records, records[-3:])
+
+        history, open_s = timed(forecast_history.load, path)
+        t0 = time.perf_counter()
+        results = [history.trends(int(start)) for start in queries]
+        trends_s = (time.perf_counter() - t0) / len(queries)
+
+        jsonl = os.path.join(tmp, "forecast_history.jsonl")
+        write_jsonl(jsonl, history, records)
+        checked = min(args.check, len(queries))
+        t0 = time.perf_counter()
+        for start, trends in zip(queries[:checked], results):
+            expected = python_trends(jsonl, history.cities, int(start))
+            for city in history.cities:
+                got = trends.for_city(city)
+                failures += sum(not same(got[k], v) for k, v in expected[city].items())
+        python_s = (time.perf_counter() - t0) / max(checked, 1)
+
+        records_found = sum(int(any(t.for_city(c)["record_high"] for c in history.cities)) for t in results)
+        stats = {
+            "years": args.years,
+            "records": len(history),
+            "cities": len(history.cities),
+            "file_kb": round(os.path.getsize(path) / 1024, 1),
+            "jsonl_kb": round(os.path.getsize(jsonl) / 1024, 1),
+            "append_ms": round(append_s * 1000, 2),
+            "open_ms": round(open_s * 1000, 2),
+            "trends_ms": round(trends_s * 1000, 2),
+            "jsonl_python_trends_ms": round(python_s * 1000, 1),
+            "queries_with_record_high": records_found,
+            "mismatches": failures,
+        }
+        del history, results  # Windows 上 memmap 還開著時刪不掉暫存目錄
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    if failures:
+        print(f"❌ numpy 趨勢和 Python 逐筆計算不同：{failures} 個欄位")
+        return 1
+    print(f"✅ {stats['records']} 筆歷史的趨勢和 Python 逐筆計算完全相同")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""圖片衍生檔檢查 (檔案大小、尺寸、長寬比、處理時間、快取命中)
+
+在本機產生幾種 APOD 常見的「麻煩」原圖：大張 JPEG 星空 (雜訊多、難壓縮)、透明 PNG、
+灰階、超寬全景、直式長圖、純雜訊 (壓不下來)、小圖。也可以額外指定存下來的 APOD 原圖。
+每張都要符合：
+- 每個衍生檔不超過 image_derivatives.DERIVATIVES 的長邊 / 檔案大小上限
+- 長寬比和原圖相差 2% 以內 (小圖不放大)
+- 第一次處理在 --max-seconds 內；第二次走快取，不重新產生
+
+用法：
+    python benchmarks/bench_image_derivatives.py [--max-seconds 5] [apod_original.jpg ...]
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import image_derivatives  # noqa: E402
+
+
+def starfield(width, height, mode="RGB"):
+    """雜訊 + 漸層，接近長曝星空照的壓縮難度"""
+    from PIL import Image
+
+    noise = Image.effect_noise((width, height), 64)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    channels = [Image.blend(noise, gradient, 0.3 * i) for i in range(1, 4)]
+    img = Image.merge("RGB", channels)
+    return img.convert(mode)
+
+
+def white_noise(width, height):
+    """每個像素獨立的彩色雜訊：縮小後還是很難壓，會用到降品質 / 再縮小的路徑"""
+    from PIL import Image
+
+    return Image.merge("RGB", [Image.effect_noise((width, height), 128) for _ in range(3)])
+
+
+def encode(img, fmt, **kwargs):
+    buf = io.BytesIO()
+    img.save(buf, fmt, **kwargs)
+    return buf.getvalue()
+
+
+def samples():
+    return {
+        "starfield_6000x4000.jpg": lambda: encode(starfield(6000, 4000), "JPEG", quality=95),
+        "nebula_alpha_3000x3000.png": lambda: encode(starfield(3000, 3000, "RGBA"), "PNG"),
+        "grayscale_4000x2600.jpg": lambda: encode(starfield(4000, 2600, "L"), "JPEG", quality=92),
+        "panorama_12000x1500.jpg": lambda: encode(starfield(12000, 1500), "JPEG", quality=90),
+        "tall_1200x5000.jpg": lambda: encode(starfield(1200, 5000), "JPEG", quality=90),
+        "white_noise_1800x1800.png": lambda: encode(white_noise(1800, 1800), "PNG"),
+        "small_400x300.gif": lambda: encode(starfield(400, 300).convert("P"), "GIF"),
+    }
+
+
+def check(name, source, cache_dir, max_seconds):
+    from PIL import Image
+
+    src_w, src_h = Image.open(io.BytesIO(source)).size
+    t0 = time.perf_counter()
+    images = image_derivatives.build_derivatives(source, cache_dir)
+    first = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    again = image_derivatives.build_derivatives(source, cache_dir)
+    cached = time.perf_counter() - t0
+
+    problems = []
+    if first > max_seconds:
+        problems.append(f"處理 {first:.2f}s 超過 {max_seconds}s")
+    if again != images:
+        problems.append("快取結果不一致")
+    result = {"source": f"{src_w}x{src_h}", "source_kb": len(source) // 1024,
+              "process_s": round(first, 3), "cached_ms": round(cached * 1000, 2), "derivatives": {}}
+    for d in images.values():
+        max_edge, max_bytes = image_derivatives.DERIVATIVES[d.name]
+        size = os.path.getsize(d.path)
+        with Image.open(d.path) as img:
+            actual = img.size
+        result["derivatives"][d.name] = {"size": f"{d.width}x{d.height}", "kb": round(size / 1024, 1),
+                                         "aspectRatio": image_derivatives.aspect_ratio(d.width, d.height)}
+        if size > max_bytes or size != d.size:
+            problems.append(f"{d.name} {size} bytes 超過上限 {max_bytes}")
+        if max(actual) > max_edge or actual != (d.width, d.height):
+            problems.append(f"{d.name} 尺寸 {actual} 不符")
+        if max(actual) > max(src_w, src_h):
+            problems.append(f"{d.name} 被放大了")
+        if abs(d.width / d.height - src_w / src_h) / (src_w / src_h) > 0.02:
+            problems.append(f"{d.name} 長寬比偏離原圖")
+    result["problems"] = problems
+    print(f"{'✅' if not problems else '❌'} {name}: {first:.2f}s, 快取 {cached * 1000:.1f}ms"
+          + (f" — {'; '.join(problems)}" if problems else ""))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs="*", help="其他 APOD 原圖")
+    parser.add_argument("--max-seconds", type=float, default=5.0, help="單張原圖的處理時間上限")
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix="apod-images-")
+    results = {}
+    try:
+        for name, make in samples().items():
+            results[name] = check(name, make(), cache_dir, args.max_seconds)
+        for path in args.images:
+            with open(path, "rb") as f:
+                results[os.path.basename(path)] = check(os.path.basename(path), f.read(), cache_dir,
+                                                        args.max_seconds)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 1 if any(r["problems"] for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""LINE 發送效能測試
+
+在本機啟動一個假的 LINE API (每個請求固定延遲)，比較：
+- 舊做法：每個收件者一個 push，單執行緒依序送
+- 新做法：line_delivery 的 multicast 批次 + 平行 push
+
+用法：
+    python benchmarks/bench_line_delivery.py --recipients 10000 --latency-ms 50
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import http_client  # noqa: E402
+from line_delivery import deliver_line_messages  # noqa: E402
+
+
+def make_stub_handler(latency, counter):
+    class StubLineHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            to = json.loads(body)["to"]
+            with counter["lock"]:
+                counter["requests"] += 1
+                counter["recipients"] += len(to) if isinstance(to, list) else 1
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    return StubLineHandler
+
+
+def make_recipients(n, group_ratio):
+    n_groups = int(n * group_ratio)
+    users = [f"U{i:032x}" for i in range(n - n_groups)]
+    groups = [f"C{i:032x}" for i in range(n_groups)]
+    return users + groups
+
+
+def legacy_push(api_base, recipients, messages):
+    """舊版迴圈：一人一個 push，每次都開新連線"""
+    for uid in recipients:
+        requests.post(f"{api_base}/v2/bot/message/push",
+                      headers={"Authorization": "Bearer x"},
+                      json={"to": uid, "messages": messages})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipients", type=int, default=10000)
+    parser.add_argument("--group-ratio", type=float, default=0.1, help="群組/聊天室 ID 比例")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--legacy-sample", type=int, default=200,
+                        help="舊做法只實測這麼多人再線性外推 (0 = 不測)")
+    args = parser.parse_args()
+
+    counter = {"lock": threading.Lock(), "requests": 0, "recipients": 0}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_stub_handler(args.latency_ms / 1000, counter))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_base = f"http://127.0.0.1:{server.server_port}"
+
+    recipients = make_recipients(args.recipients, args.group_ratio)
+    messages = [{"type": "text", "text": "benchmark"}]
+
+    results = {"recipients": args.recipients, "latency_ms": args.latency_ms, "workers": args.workers}
+
+    if args.legacy_sample:
+        sample = recipients[:args.legacy_sample]
+        t0 = time.perf_counter()
+        legacy_push(api_base, sample, messages)
+        elapsed = time.perf_counter() - t0
+        results["legacy_estimated_s"] = round(elapsed / len(sample) * args.recipients, 2)
+
+    counter["requests"] = counter["recipients"] = 0
+    t0 = time.perf_counter()
+    report = deliver_line_messages(messages, recipients, "x", max_workers=args.workers, api_base=api_base)
+    results["engine_s"] = round(time.perf_counter() - t0, 2)
+    results["engine_requests"] = counter["requests"]
+    results["engine_delivered"] = sum(1 for r in report.values() if r["ok"])
+    results["engine_connections"] = http_client.stats()["127.0.0.1"]["connections"]
+
+    server.shutdown()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""速率限制效能測試
+
+在本機啟動兩個會真的執行限制的假伺服器：
+- Discord：每個 webhook 固定時間窗 (預設 2 秒 5 次)，回傳 X-RateLimit-* 標頭，超過回 429 + retry_after
+- LINE：每秒最多 N 個請求 (固定 1 秒時間窗)，超過只回 429，沒有任何標頭
+
+比較 rate_limit 開 / 關時的 429 次數、成功數、實際送出速率。
+
+限制器開啟時必須：伺服器沒有擋下任何請求 (沒有 429)，
+而且實際送出速率至少是學到 (或設定) 上限的 MIN_THROUGHPUT_RATIO，否則 exit code 為 1。
+
+用法：
+    python benchmarks/bench_rate_limit.py [--discord-posts 20] [--line-requests 600] [--line-limit 200]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import http_client  # noqa: E402
+import rate_limit  # noqa: E402
+
+# 限制器開啟時，實際速率至少要有上限的幾成 (太慢代表 bucket 卡在過低的速率)
+MIN_THROUGHPUT_RATIO = 0.8
+
+
+class FixedWindow:
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.start = None
+        self.count = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    def hit(self):
+        """回傳 (是否接受, 剩餘次數, 距離重置秒數)"""
+        with self.lock:
+            now = time.monotonic()
+            if self.start is None or now - self.start >= self.window:
+                self.start, self.count = now, 0
+            reset_after = self.window - (now - self.start)
+            if self.count >= self.limit:
+                self.rejected += 1
+                return False, 0, reset_after
+            self.count += 1
+            self.accepted += 1
+            return True, self.limit - self.count, reset_after
+
+
+def make_handler(discord, line, latency):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # 標頭和 body 分兩次寫，不關 Nagle 會被 delayed ACK 拖慢 40ms
+        disable_nagle_algorithm = True
+
+        def _reply(self, status, body, headers=()):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            if self.path.startswith("/api/webhooks/"):
+                ok, remaining, reset_after = discord.hit()
+                headers = [("X-RateLimit-Limit", str(discord.limit)),
+                           ("X-RateLimit-Remaining", str(remaining)),
+                           ("X-RateLimit-Reset-After", f"{reset_after:.3f}")]
+                if ok:
+                    self._reply(200, {}, headers)
+                else:
+                    self._reply(429, {"message": "You are being rate limited.", "retry_after": round(reset_after, 3)},
+                                headers)
+            else:
+                ok, _, _ = line.hit()
+                if ok:
+                    self._reply(200, {})
+                else:
+                    self._reply(429, {"message": "The API rate limit has been exceeded. Try again later."})
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def run(label, enabled, func):
+    rate_limit.ENABLED = enabled
+    rate_limit.reset()
+    t0 = time.perf_counter()
+    statuses = func()
+    elapsed = time.perf_counter() - t0
+    result = {
+        "limiter": "on" if enabled else "off",
+        "elapsed_s": round(elapsed, 2),
+        "ok": sum(1 for s in statuses if s == 200),
+        "final_429": sum(1 for s in statuses if s == 429),
+        "achieved_rps": round(len(statuses) / elapsed, 1),
+    }
+    buckets = rate_limit.stats()
+    if buckets:
+        (bucket,) = buckets.values()
+        result["server_429_seen"] = bucket["throttled_429"]
+        result["learned_limit_rps"] = bucket["limit_rps"]
+    print(f"{label}: {json.dumps(result, ensure_ascii=False)}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--discord-posts", type=int, default=20)
+    parser.add_argument("--discord-limit", type=int, default=5)
+    parser.add_argument("--discord-window", type=float, default=2.0)
+    parser.add_argument("--line-requests", type=int, default=600)
+    parser.add_argument("--line-limit", type=int, default=200, help="假 LINE 每秒上限")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for enabled in (False, True):
+        discord = FixedWindow(args.discord_limit, args.discord_window)
+        line = FixedWindow(args.line_limit, 1.0)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(discord, line, args.latency_ms / 1000))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        webhook = f"{base}/api/webhooks/123/{'x' * 68}"
+
+        def post_all(endpoint, url, n):
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                futs = [pool.submit(http_client.post, endpoint, url, data=b"{}", headers=http_client.JSON_HEADERS)
+                        for _ in range(n)]
+                return [f.result().status_code for f in futs]
+
+        mode = "on" if enabled else "off"
+        results[f"discord_{mode}"] = run(f"discord (limiter {mode})", enabled,
+                                         lambda: post_all("discord", webhook, args.discord_posts))
+        results[f"discord_{mode}"]["server_rejected"] = discord.rejected
+        results[f"line_{mode}"] = run(f"line (limiter {mode})", enabled,
+                                      lambda: post_all("line_push", f"{base}/v2/bot/message/push", args.line_requests))
+        results[f"line_{mode}"]["server_rejected"] = line.rejected
+        server.shutdown()
+        http_client.close()
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    failures = []
+    for name in ("discord", "line"):
+        r = results[f"{name}_on"]
+        if r["server_rejected"] or r["final_429"]:
+            failures.append(f"{name}: 限制器開啟仍被擋下 {r['server_rejected']} 次")
+        if r["achieved_rps"] < r["learned_limit_rps"] * MIN_THROUGHPUT_RATIO:
+            failures.append(f"{name}: 實際 {r['achieved_rps']}/s，不到上限 {r['learned_limit_rps']}/s 的 "
+                            f"{MIN_THROUGHPUT_RATIO:.0%}")
+    for message in failures:
+        print(f"❌ {message}")
+    if failures:
+        return 1
+    print("✅ 限制器開啟時沒有 429，速率接近上限")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
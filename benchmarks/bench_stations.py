@@ -0,0 +1,177 @@
+"""最近測站查詢效能測試 (合成的 O-A0001-001 資料，不需要任何金鑰)
+
+測站依縣市所在地附近隨機分布 (都會區密、山區疏，外加離島)，訂閱者座標大多在測站附近，
+少數在國外 (格子外，要和全部測站比)。量測：
+- 解析 O-A0001-001、建立格子索引、存檔 / 載入的時間
+- 10 萬個訂閱者座標的最近 3 個測站：格子索引 vs numpy 全部比對 vs 逐人掃描 (Python 迴圈，取樣後換算)
+- 測站清單小幅變動 (撤站、新增、搬遷) 時增量更新 vs 整個重建
+- nearest_readings (挑最近一個有回報氣溫的測站) 的總時間
+
+格子索引的結果必須和全部比對完全相同，不同時 exit code 為 1。
+
+用法：
+    python benchmarks/bench_stations.py [--subscribers 100000] [--stations 700]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import station_obs  # noqa: E402
+
+# 縣市所在地 (緯度, 經度, 相對密度)
+COUNTY_SEATS = {
+    "基隆市": (25.13, 121.74, 1), "臺北市": (25.04, 121.56, 4), "新北市": (25.01, 121.46, 4),
+    "桃園市": (24.99, 121.30, 3), "新竹市": (24.80, 120.97, 1), "新竹縣": (24.70, 121.10, 2),
+    "苗栗縣": (24.56, 120.82, 2), "臺中市": (24.15, 120.67, 4), "彰化縣": (24.08, 120.54, 2),
+    "南投縣": (23.90, 120.85, 3), "雲林縣": (23.71, 120.43, 2), "嘉義市": (23.48, 120.45, 1),
+    "嘉義縣": (23.45, 120.55, 2), "臺南市": (23.00, 120.21, 4), "高雄市": (22.63, 120.30, 4),
+    "屏東縣": (22.55, 120.55, 3), "宜蘭縣": (24.70, 121.74, 2), "花蓮縣": (23.98, 121.60, 3),
+    "臺東縣": (22.75, 121.15, 3), "澎湖縣": (23.57, 119.58, 1), "金門縣": (24.43, 118.32, 1),
+    "連江縣": (26.16, 119.95, 1),
+}
+ABROAD = [(35.68, 139.69), (1.35, 103.82), (37.77, -122.42), (22.32, 114.17)]
+
+
+def random_points(rnd, n, spread):
+    """依縣市密度抽樣，回傳 (緯度 array, 經度 array, 縣市 list)"""
+    names = list(COUNTY_SEATS)
+    weights = np.array([COUNTY_SEATS[c][2] for c in names], dtype=float)
+    picks = rnd.choice(len(names), n, p=weights / weights.sum())
+    centers = np.array([COUNTY_SEATS[names[i]][:2] for i in picks])
+    points = centers + rnd.normal(0, spread, (n, 2))
+    return points[:, 0], points[:, 1], [names[i] for i in picks]
+
+
+def make_payload(rnd, n):
+    """O-A0001-001 格式的合成資料 (約 5% 氣溫缺測)"""
+    lat, lon, counties = random_points(rnd, n, 0.12)
+    stations = []
+    for i in range(n):
+        temp = round(float(rnd.normal(26, 4)), 1) if rnd.random() > 0.05 else -99
+        stations.append({
+            "StationName": f"測站{i}", "StationId": f"C0X{i:03d}",
+            "ObsTime": {"DateTime": "2026-10-17T14:10:00+08:00"},
+            "GeoInfo": {
+                "Coordinates": [
+                    {"CoordinateName": "TWD67", "StationLatitude": lat[i] - 0.002, "StationLongitude": lon[i] - 0.008},
+                    {"CoordinateName": "WGS84", "StationLatitude": lat[i], "StationLongitude": lon[i]},
+                ],
+                "CountyName": counties[i], "TownName": "某某區",
+            },
+            "WeatherElement": {"AirTemperature": temp, "RelativeHumidity": 70, "Now": {"Precipitation": 0.0}},
+        })
+    return {"success": "true", "records": {"Station": stations}}
+
+
+def brute_force(index, lat, lon, k=station_obs.NEAREST_K):
+    """numpy 全部比對 (一次一批)"""
+    active = np.flatnonzero(index.active)
+    points = station_obs.unit_vectors(lat, lon)
+    result = np.empty((len(lat), k), dtype=np.int64)
+    for start in range(0, len(lat), 4096):
+        dist = station_obs._chords(points[start:start + 4096], index.vectors[active])
+        part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(dist, part, axis=1), axis=1)
+        result[start:start + 4096] = active[np.take_along_axis(part, order, axis=1)]
+    return result
+
+
+def python_scan(stations, lat, lon):
+    """逐人掃描所有測站 (沒有索引的寫法)，只回傳最近的 ID"""
+    result = []
+    for la, lo in zip(lat, lon):
+        best, best_d = None, math.inf
+        for s in stations:
+            d = (math.sin(math.radians(s["lat"] - la) / 2) ** 2 + math.cos(math.radians(la))
+                 * math.cos(math.radians(s["lat"])) * math.sin(math.radians(s["lon"] - lo) / 2) ** 2)
+            if d < best_d:
+                best, best_d = s["id"], d
+        result.append(best)
+    return result
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    value = func(*args)
+    return value, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=100000)
+    parser.add_argument("--stations", type=int, default=700)
+    parser.add_argument("--scan-sample", type=int, default=1000, help="逐人掃描取樣的人數")
+    args = parser.parse_args()
+
+    rnd = np.random.default_rng(0)
+    raw = json.dumps(make_payload(rnd, args.stations), ensure_ascii=False).encode()
+    stations, parse_s = timed(lambda: station_obs.parse_stations(json.loads(raw)))
+    index, build_s = timed(station_obs.StationIndex.build, stations)
+
+    lat, lon, _ = random_points(rnd, args.subscribers, 0.08)
+    abroad = rnd.random(args.subscribers) < 0.002
+    lat[abroad], lon[abroad] = np.array(ABROAD)[rnd.integers(0, len(ABROAD), abroad.sum())].T
+
+    failures = 0
+    (slots, _), index_s = timed(index.nearest, lat, lon)
+    expected, brute_s = timed(brute_force, index, lat, lon)
+    failures += int((slots != expected).any(axis=1).sum())
+
+    sample = min(args.scan_sample, args.subscribers)
+    scanned, scan_s = timed(python_scan, stations, lat[:sample], lon[:sample])
+    failures += sum(index.ids[s] != sid for s, sid in zip(slots[:sample, 0], scanned))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.npz")
+        _, save_s = timed(index.save, path)
+        index, load_s = timed(station_obs.StationIndex.load, path)
+
+    # 撤站 5 個、新增 5 個、搬遷 3 個
+    changed = [dict(s) for s in stations[5:]]
+    new_lat, new_lon, counties = random_points(rnd, 5, 0.12)
+    changed += [{"id": f"C1N{i:03d}", "name": f"新測站{i}", "county": counties[i], "town": "某某區",
+                 "lat": float(new_lat[i]), "lon": float(new_lon[i]), "temp": 25.0, "time": "14:10"} for i in range(5)]
+    for s in changed[100:103]:
+        s["lat"] += 0.01
+    stats, update_s = timed(index.update, changed)
+    _, rebuild_s = timed(station_obs.StationIndex.build, changed)
+    (slots, _), _ = timed(index.nearest, lat, lon)
+    failures += int((slots != brute_force(index, lat, lon)).any(axis=1).sum())
+
+    locations = {f"U{i:032x}": (float(a), float(b)) for i, (a, b) in enumerate(zip(lat, lon))}
+    readings, readings_s = timed(station_obs.nearest_readings, locations, changed, index)
+
+    results = {
+        "stations": len(stations),
+        "subscribers": args.subscribers,
+        "grid": {"cells": index.n_cells, "candidate_width": index.candidates.shape[1]},
+        "parse_ms": round(parse_s * 1000, 1),
+        "build_ms": round(build_s * 1000, 1),
+        "save_ms": round(save_s * 1000, 1),
+        "load_ms": round(load_s * 1000, 1),
+        "query_index_ms": round(index_s * 1000, 1),
+        "query_numpy_all_ms": round(brute_s * 1000, 1),
+        "query_python_scan_ms": round(scan_s / sample * args.subscribers * 1000, 1),
+        "update": dict(stats, ms=round(update_s * 1000, 1), full_rebuild_ms=round(rebuild_s * 1000, 1)),
+        "nearest_readings_ms": round(readings_s * 1000, 1),
+        "subscribers_with_reading": len(readings),
+        "mismatches": failures,
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if failures:
+        print(f"❌ 格子索引和全部比對的結果不同：{failures} 筆")
+        return 1
+    print(f"✅ {args.subscribers} 個座標的最近測站和全部比對完全相同")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""telemetry 成本測試
+
+- 每次 span() / count() / observe() 的成本 (停用 vs 啟用)
+- 對本機假伺服器發 HTTP 請求時，http_client 打開 telemetry 的額外成本
+- 啟用時寫出的 events.jsonl / taiwanbot.prom 內容是否合理
+
+用法：
+    python benchmarks/bench_telemetry.py [--calls 200000] [--requests 300]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import http_client  # noqa: E402
+import telemetry  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def per_call_ns(func, calls):
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return round((time.perf_counter() - t0) / calls * 1e9, 1)
+
+
+def primitives(calls):
+    def use_span():
+        with telemetry.span("bench"):
+            pass
+
+    return {
+        "span_ns": per_call_ns(use_span, calls),
+        "count_ns": per_call_ns(lambda: telemetry.count("bench_total", endpoint="line", status=200), calls),
+        "observe_ns": per_call_ns(lambda: telemetry.observe("bench_seconds", 0.03, endpoint="line"), calls),
+    }
+
+
+def http_round_trips(url, n):
+    body = b'{"to": "U0", "messages": []}'
+    http_client.post("bench", url, data=body, headers=http_client.JSON_HEADERS)  # 先建好連線
+    t0 = time.perf_counter()
+    for _ in range(n):
+        http_client.post("bench", url, data=body, headers=http_client.JSON_HEADERS)
+    return round((time.perf_counter() - t0) / n * 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v2/bot/message/push"
+    out_dir = tempfile.mkdtemp(prefix="telemetry-")
+
+    results = {}
+    try:
+        for enabled in (False, True):
+            telemetry.ENABLED = enabled
+            telemetry.reset()
+            mode = "on" if enabled else "off"
+            results[mode] = primitives(args.calls)
+            results[mode]["http_request_us"] = http_round_trips(url, args.requests)
+        telemetry.flush(out_dir)
+
+        with open(os.path.join(out_dir, "events.jsonl"), encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        with open(os.path.join(out_dir, "taiwanbot.prom"), encoding="utf-8") as f:
+            prom = f.read()
+        metrics = lines[-1]
+        key = "http_request_duration_seconds{endpoint=bench,method=POST,status=200}"
+        results["check"] = {
+            "spans_written": sum(1 for line in lines if line["type"] == "span"),
+            "http_count": metrics["histograms"][key]["count"],
+            "http_p95_ms": round(metrics["histograms"][key]["p95"] * 1000, 2),
+            "prom_lines": prom.count("\n"),
+        }
+    finally:
+        telemetry.ENABLED = False
+        server.shutdown()
+        http_client.close()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    expected = args.requests + 1
+    if results["check"]["http_count"] != expected:
+        print(f"❌ HTTP 請求數對不上 ({results['check']['http_count']} != {expected})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""訊息樣板效能測試 + 逐 byte 比對
+
+1. 黃金比對：隨機產生的天氣 / NASA 資料 (含引號、反斜線、換行、emoji、"{{x}}" 等)
+   經過 flex_templates 樣板的輸出，必須和 json.dumps(原本的 dict).encode() 完全相同
+2. 效能：每則訊息「建 dict + json.dumps」 vs 「樣板 render」
+
+用法：
+    python benchmarks/bench_templates.py [--cases 300] [--iterations 2000]
+比對不一致時 exit code 為 1。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import image_derivatives  # noqa: E402
+import nasa_bot  # noqa: E402
+import weather_bot  # noqa: E402
+from regions import COUNTY_TO_REGION, REGION_MAP  # noqa: E402
+
+TRICKY = ['"', "\\", "\n", "\t", "\u0001", "🌧️", "晴時多雲", "{{city}}", "{{!x}}", "</script>", " ", "é"]
+
+
+def random_text(rnd, max_len=40):
+    pieces = [rnd.choice(TRICKY) if rnd.random() < 0.3 else chr(rnd.randint(32, 126))
+              for _ in range(rnd.randint(0, max_len))]
+    return "".join(pieces)
+
+
+def random_weather(rnd):
+    weather_data = {}
+    for city in COUNTY_TO_REGION:
+        if rnd.random() < 0.05:
+            continue  # 偶爾缺資料
+        pop = rnd.randint(0, 100)
+        weather_data[city] = {
+            "display": f"**{city}** {random_text(rnd, 10)}",
+            "city": city,
+            "icon": rnd.choice(["☀️", "⛅", "🌧️", "☁️"]),
+            "min_t": str(rnd.randint(5, 25)),
+            "max_t": str(rnd.randint(20, 36)),
+            "pop": pop,
+            "pop_color": "#FF0000" if pop >= 50 else "#333333",
+        }
+        if rnd.random() < 0.05:
+            # 預報表缺值的因子 (forecast_table.BLANK)
+            weather_data[city][rnd.choice(["min_t", "max_t", "pop"])] = "--"
+        if rnd.random() < 0.7:
+            weather_data[city]["trend"] = rnd.choice(["", " ▲4", " ▼6", " 🔥", random_text(rnd, 4)])
+    return weather_data
+
+
+def random_cities(rnd):
+    if rnd.random() < 0.3:
+        return None
+    return frozenset(rnd.sample(sorted(COUNTY_TO_REGION), rnd.randint(1, 8)))
+
+
+def random_region_comments(rnd):
+    """AI 失敗時是空 dict；成功時偶爾也會少幾個區域"""
+    if rnd.random() < 0.3:
+        return {}
+    return {region: random_text(rnd, 30) for region in REGION_MAP if rnd.random() < 0.8}
+
+
+def random_nearby(rnd):
+    """沒填座標的訂閱者是 None；有的話是 station_obs.nearest_readings 的格式"""
+    if rnd.random() < 0.5:
+        return None
+    return {"id": "C0A9", "name": random_text(rnd, 8), "town": random_text(rnd, 6),
+            "time": rnd.choice(["14:10", ""]), "temp": f"{rnd.uniform(-5, 40):.1f}"}
+
+
+def random_apod(rnd):
+    data = {
+        "title": random_text(rnd),
+        "date": rnd.choice(["2026-10-16", "", "1995-06-20"]),
+        "url": rnd.choice(["https://apod.nasa.gov/a.jpg", "http://apod.nasa.gov/b.jpg", random_text(rnd)]),
+        "hdurl": random_text(rnd),
+    }
+    # 拿掉一些欄位，測試 None / 預設值的路徑
+    for key in ("title", "date", "url", "hdurl"):
+        if rnd.random() < 0.15:
+            del data[key]
+    return data
+
+
+def random_images(rnd):
+    """一半沒有衍生檔 (下載失敗 / 影片日)，一半有隨機尺寸的衍生檔，公開網址隨機開關"""
+    image_derivatives.PUBLIC_BASE_URL = rnd.choice(["", "https://img.example.org/apod"])
+    if rnd.random() < 0.5:
+        return None
+    return {name: image_derivatives.Derivative(name, f"/cache/abc-{name}.jpg", rnd.randint(1, 4000),
+                                               rnd.randint(1, 4000), rnd.randint(1, 10 ** 6))
+            for name in image_derivatives.DERIVATIVES}
+
+
+def dumps(obj):
+    # requests 的 json= 也是用預設參數序列化
+    return json.dumps(obj).encode("utf-8")
+
+
+def golden_check(cases):
+    rnd = random.Random(42)
+    failures = 0
+    for i in range(cases):
+        w = random_weather(rnd)
+        comment = random_text(rnd, 120)
+        t_range = random_text(rnd, 20)
+        cities = random_cities(rnd)
+        regions = random_region_comments(rnd)
+        nearby = random_nearby(rnd)
+        checks = [
+            ("weather flex",
+             dumps(weather_bot.generate_flex_message(w, comment, t_range, cities, region_comments=regions,
+                                                     nearby=nearby)),
+             weather_bot.render_flex_bytes(w, comment, t_range, cities, region_comments=regions, nearby=nearby)),
+            ("weather webhook",
+             dumps(weather_bot.build_webhook_payload(w, comment, t_range, regions)),
+             weather_bot.render_webhook_bytes(w, comment, t_range, regions)),
+        ]
+        apod = random_apod(rnd)
+        diary, knowledge = random_text(rnd, 200), random_text(rnd, 200)
+        images = random_images(rnd)
+        checks += [
+            ("nasa flex",
+             dumps(nasa_bot.generate_flex_message(apod, diary, knowledge, images)),
+             nasa_bot.render_flex_bytes(apod, diary, knowledge, images)),
+            ("nasa discord",
+             dumps(nasa_bot.build_discord_payload(apod, diary, knowledge, images)),
+             nasa_bot.render_discord_bytes(apod, diary, knowledge, images)),
+        ]
+        for name, expected, actual in checks:
+            if expected != actual:
+                failures += 1
+                if failures <= 5:
+                    print(f"❌ [{name}] 第 {i} 組不一致")
+    return failures
+
+
+def timed(func, iterations):
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - t0) / iterations * 1e6
+
+
+def benchmark(iterations):
+    rnd = random.Random(7)
+    w = random_weather(rnd)
+    comment = "今天北部有雨，出門記得帶傘！" * 4
+    t_range = "2026-10-16 06:00 ~ 2026-10-16 18:00"
+    apod = {"title": "The Horsehead Nebula", "date": "2026-10-16",
+            "url": "https://apod.nasa.gov/apod/image/2610/horse.jpg",
+            "hdurl": "https://apod.nasa.gov/apod/image/2610/horse_big.jpg"}
+    diary, knowledge = "船長日誌..." * 20, "小知識..." * 20
+    subset = frozenset(REGION_MAP["北部地區"])
+
+    cases = {
+        "weather flex (全台)": (
+            lambda: dumps(weather_bot.generate_flex_message(w, comment, t_range)),
+            lambda: weather_bot.render_flex_bytes(w, comment, t_range)),
+        "weather flex (北部)": (
+            lambda: dumps(weather_bot.generate_flex_message(w, comment, t_range, subset)),
+            lambda: weather_bot.render_flex_bytes(w, comment, t_range, subset)),
+        "weather webhook": (
+            lambda: dumps(weather_bot.build_webhook_payload(w, comment, t_range)),
+            lambda: weather_bot.render_webhook_bytes(w, comment, t_range)),
+        "nasa flex": (
+            lambda: dumps(nasa_bot.generate_flex_message(apod, diary, knowledge)),
+            lambda: nasa_bot.render_flex_bytes(apod, diary, knowledge)),
+        "nasa discord": (
+            lambda: dumps(nasa_bot.build_discord_payload(apod, diary, knowledge)),
+            lambda: nasa_bot.render_discord_bytes(apod, diary, knowledge)),
+    }
+    results = {}
+    for name, (dict_path, template_path) in cases.items():
+        template_path()  # 先編譯樣板，不算進計時
+        dict_us = timed(dict_path, iterations)
+        template_us = timed(template_path, iterations)
+        results[name] = {
+            "dict_us": round(dict_us, 1),
+            "template_us": round(template_us, 1),
+            "speedup": round(dict_us / template_us, 2),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=300, help="黃金比對的隨機資料組數")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    failures = golden_check(args.cases)
+    if failures:
+        print(f"❌ 樣板輸出與 dict 路徑不一致：{failures} 筆")
+        return 1
+    print(f"✅ {args.cases} 組隨機資料 × 4 種訊息，樣板輸出逐 byte 相同")
+
+    print(json.dumps(benchmark(args.iterations), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
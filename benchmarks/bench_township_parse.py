@@ -0,0 +1,142 @@
+"""鄉鎮預報解析效能測試 (解析時間 + 峰值 RSS)
+
+比較：
+- json：整包讀進來再 json.loads (舊做法 response.json())
+- stream：township_forecast.iter_townships 串流解析
+
+每種方式各開一個子行程量測，峰值 RSS 才不會互相影響。
+
+用法：
+    # 使用存下來的全台 F-D0047-089 回應
+    python benchmarks/bench_township_parse.py path/to/F-D0047-089.json
+    # 不給檔案就產生一份同結構的合成資料
+    python benchmarks/bench_township_parse.py
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+ELEMENT_FIELDS = [
+    ("溫度", "Temperature"),
+    ("露點溫度", "DewPoint"),
+    ("相對濕度", "RelativeHumidity"),
+    ("體感溫度", "ApparentTemperature"),
+    ("舒適度指數", "ComfortIndex"),
+    ("風速", "WindSpeed"),
+    ("風向", "WindDirection"),
+    ("3小時降雨機率", "ProbabilityOfPrecipitation"),
+    ("天氣現象", "Weather"),
+    ("天氣預報綜合描述", "WeatherDescription"),
+]
+
+
+def make_payload(path, townships_per_county=17, periods=24):
+    """產生與 F-D0047-089 同結構的合成資料 (22 縣市 × N 鄉鎮)"""
+    from regions import REGION_MAP
+
+    rnd = random.Random(0)
+    times = [f"2026-10-16T{h % 24:02d}:00:00+08:00" for h in range(0, periods * 3, 3)]
+    locations = []
+    for counties in REGION_MAP.values():
+        for county in counties:
+            towns = []
+            for t in range(townships_per_county):
+                elements = []
+                for name, field in ELEMENT_FIELDS:
+                    elements.append({
+                        "ElementName": name,
+                        "Time": [
+                            {"StartTime": ts, "EndTime": ts,
+                             "ElementValue": [{field: str(rnd.randint(0, 100)), "Measures": "x" * 8}]}
+                            for ts in times
+                        ],
+                    })
+                towns.append({
+                    "LocationName": f"{county}第{t}區",
+                    "Geocode": f"{rnd.randint(10000000, 99999999)}",
+                    "Latitude": f"{rnd.uniform(21.9, 25.3):.4f}",
+                    "Longitude": f"{rnd.uniform(119.3, 122.0):.4f}",
+                    "WeatherElement": elements,
+                })
+            locations.append({
+                "DatasetDescription": "臺灣各鄉鎮市區預報資料",
+                "LocationsName": county,
+                "Dataid": "D0047-089",
+                "Location": towns,
+            })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"success": "true", "records": {"Locations": locations}}, f, ensure_ascii=False)
+
+
+def run_mode(mode, path):
+    """在子行程裡執行，印出一行 JSON 結果"""
+    # 兩種方式都先載入同樣的模組，峰值 RSS 扣掉這個基準才公平
+    import township_forecast
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    t0 = time.perf_counter()
+    if mode == "json":
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+        count = sum(len(loc["Location"]) for loc in data["records"]["Locations"])
+    else:
+        def chunks():
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(64 * 1024)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        count = sum(1 for _ in township_forecast.iter_townships(chunks()))
+    elapsed = time.perf_counter() - t0
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "mode": mode,
+        "townships": count,
+        "parse_s": round(elapsed, 3),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "parse_rss_mb": round((peak_kb - base_kb) / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("payload", nargs="?", help="存下來的 F-D0047 回應 (JSON)")
+    parser.add_argument("--mode", choices=["json", "stream"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.payload)
+        return
+
+    path = args.payload
+    tmp = None
+    if not path:
+        tmp = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        tmp.close()
+        path = tmp.name
+        make_payload(path)
+
+    results = {"payload_mb": round(os.path.getsize(path) / 1024 / 1024, 1)}
+    try:
+        for mode in ("json", "stream"):
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__), path, "--mode", mode])
+            results[mode] = json.loads(out)
+    finally:
+        if tmp:
+            os.remove(path)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
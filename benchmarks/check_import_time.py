@@ -0,0 +1,73 @@
+"""啟動成本回歸檢查 (python -X importtime)
+
+確認：
+1. 載入 taiwanbot / weather_bot / nasa_bot / weather_alerts 的累計時間在預算內
+2. 單純 import 時不會載入 google.genai、bs4、requests、dotenv、asyncio、PIL、numpy 這些重量級套件
+
+用法：
+    python benchmarks/check_import_time.py [--budget-ms 60]
+超出預算或載入了不該載入的套件時 exit code 為 1。
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+TARGETS = ["taiwanbot", "weather_bot", "nasa_bot", "weather_alerts"]
+FORBIDDEN = ["google.genai", "bs4", "requests", "urllib3", "dotenv", "asyncio", "PIL", "numpy"]
+RUNS = 5
+
+
+def measure():
+    """回傳 ({模組: 累計微秒}, 這次載入的所有模組 set)"""
+    code = f"import {', '.join(TARGETS)}"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    cumulative = {}
+    loaded = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        loaded.add(name)
+        if name in TARGETS:
+            cumulative[name] = int(cum)
+    return cumulative, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_BUDGET_MS", 60)))
+    args = parser.parse_args()
+
+    best = None
+    loaded = set()
+    for _ in range(RUNS):
+        cumulative, loaded = measure()
+        total = sum(cumulative.values())
+        if best is None or total < sum(best.values()):
+            best = cumulative
+
+    total_ms = sum(best.values()) / 1000
+    for name in TARGETS:
+        print(f"⏱️ {name}: {best.get(name, 0) / 1000:.1f} ms")
+    print(f"⏱️ 合計 {total_ms:.1f} ms (預算 {args.budget_ms:.0f} ms)")
+
+    failed = False
+    heavy = [m for m in FORBIDDEN if m in loaded]
+    if heavy:
+        print(f"❌ import 時載入了重量級套件: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("❌ 超出 import 時間預算")
+        failed = True
+    if not failed:
+        print("✅ 啟動成本在預算內")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""LINE outbox 續傳回歸檢查 (本機假 LINE，不需要任何金鑰)
+
+同一個 broadcast_id 重新執行、但訊息內容不同 (AI 備援、測站氣溫更新、趨勢標示) 時：
+1. 上次已送達的收件者不會再收到任何東西
+2. 上次失敗的批次用「上次的內容」和同一個 X-Line-Retry-Key 重送
+3. 兩次執行之間新加入的訂閱者會收到這次的內容
+4. 再執行一次不會送出任何請求
+5. 被 LINE 以 4xx 拒絕的批次 (例如無效的 ID) 記成 rejected，之後不再重送
+
+用法：
+    python benchmarks/check_outbox_resume.py
+有任何一項不符時 exit code 為 1。
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import http_client  # noqa: E402
+from line_delivery import deliver_durable  # noqa: E402
+from outbox import Outbox  # noqa: E402
+
+
+class FakeLine:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fail_push = False
+        self.reject = {"C5"}  # push 給這些 ID 一律回 400
+        self.requests = []  # (channel, [收件者], 訊息文字, retry key)
+
+
+def make_handler(svc):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            channel = "push" if self.path.endswith("/push") else "multicast"
+            to = body["to"] if isinstance(body["to"], list) else [body["to"]]
+            with svc.lock:
+                svc.requests.append((channel, to, body["messages"][0]["text"], self.headers.get("X-Line-Retry-Key")))
+            if channel == "push" and to[0] in svc.reject:
+                status = 400
+            else:
+                status = 500 if channel == "push" and svc.fail_push else 200
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def text(content):
+    return [{"type": "text", "text": content}]
+
+
+def main():
+    svc = FakeLine()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(svc))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    failures = []
+
+    def check(ok, message):
+        print(f"{'✅' if ok else '❌'} {message}")
+        if not ok:
+            failures.append(message)
+
+    def run(content, recipients, outbox):
+        svc.requests.clear()
+        deliver_durable([(text(content), recipients)], "check", "weather:2026-10-17 06:00:00",
+                        outbox=outbox, api_base=base, retry_rounds=0)
+        return list(svc.requests)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = Outbox(os.path.join(tmp, "outbox.db"))
+        try:
+            # 第一次：群組的 push 失敗，使用者的 multicast 成功
+            svc.fail_push = True
+            first = run("內容 A", ["U1", "U2", "C3", "C5"], outbox)
+            push_key = next(key for channel, to, _, key in first if channel == "push" and to == ["C3"])
+            check(outbox.delivery_status("weather:2026-10-17 06:00:00", "C5") == "rejected", "4xx 的批次記成 rejected")
+
+            # 重新執行：內容變了，還多了一位新訂閱者
+            svc.fail_push = False
+            second = run("內容 B", ["U1", "U2", "C3", "C5", "U4"], outbox)
+            received = {rid: (content, key) for _, to, content, key in second for rid in to}
+            check("U1" not in received and "U2" not in received, "已送達的收件者沒有因為內容不同而收到第二份")
+            check("C5" not in received, "被拒絕 (4xx) 的批次不再重送")
+            check(received.get("C3") == ("內容 A", push_key), "失敗的批次用原本的內容與 retry key 重送")
+            check(received.get("U4", (None,))[0] == "內容 B", "新加入的訂閱者收到這次的內容")
+            check(len(second) == 2, f"重新執行只送出 2 個請求 (實際 {len(second)} 個)")
+
+            third = run("內容 C", ["U1", "U2", "C3", "C5", "U4"], outbox)
+            check(not third, "全部送達後再執行不會送出任何請求")
+            check(all(outbox.delivery_status("weather:2026-10-17 06:00:00", rid) == "sent"
+                      for rid in ("U1", "U2", "C3", "U4")), "outbox 裡每位收件者都是 sent")
+        finally:
+            outbox.close()
+            server.shutdown()
+            http_client.close()
+
+    if failures:
+        print(f"❌ {len(failures)} 項不符")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""氣象局 F-C0032-001 快照
+
+每次抓到的原始 JSON 與解析後的預報表 都存到 .cache/cwa/：
+- <dataset>.raw.json：原始回應 (除錯、重新解析用)
+- <dataset>.json：內容雜湊、預報時段、第一個時段的開始時間、抓取時間、ETag、解析後的預報表、上次廣播的雜湊
+
+氣象局大約每天 05/11/17/23 時 (台灣時間) 更新預報，每份預報的第一個時段從發布後的下一個整點附近開始，所以：
+1. 快照裡預報的第一個時段在最近一次發布時間之後才開始 → 已經是這一輪的預報，直接用快照，完全不連線
+2. 否則重新下載 (發布時間剛過、氣象局還在提供上一份時也會繼續問)；內容雜湊沒變 → 不重新解析，標記為「沒有變化」
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+SNAPSHOT_DIR = os.environ.get("CWA_SNAPSHOT_DIR", os.path.join(".cache", "cwa"))
+ISSUE_HOURS = [int(h) for h in os.environ.get("CWA_ISSUE_HOURS", "5,11,17,23").split(",")]
+
+TAIWAN_TZ = timezone(timedelta(hours=8))
+
+# 快照格式版本，格式改變時舊快照直接視為不存在
+SNAPSHOT_VERSION = 3
+
+
+def content_hash(raw_bytes):
+    return hashlib.sha256(raw_bytes).hexdigest()
+
+
+def _meta_path(dataset):
+    return os.path.join(SNAPSHOT_DIR, f"{dataset}.json")
+
+
+def _raw_path(dataset):
+    return os.path.join(SNAPSHOT_DIR, f"{dataset}.raw.json")
+
+
+def load(dataset):
+    """讀取快照，沒有或壞掉就回傳 None"""
+    try:
+        with open(_meta_path(dataset), encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def load_raw(dataset):
+    try:
+        with open(_raw_path(dataset), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _atomic_write(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save(dataset, snapshot, raw_bytes=None):
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        if raw_bytes is not None:
+            _atomic_write(_raw_path(dataset), raw_bytes)
+        _atomic_write(_meta_path(dataset), json.dumps(snapshot, ensure_ascii=False).encode("utf-8"))
+    except OSError as e:
+        print(f"⚠️ 氣象快照寫入失敗: {e}")
+
+
+def last_issue_before(now):
+    """now 之前最近一次的預報發布時間 (台灣時間)"""
+    local = now.astimezone(TAIWAN_TZ)
+    for days_back in range(2):
+        day = local - timedelta(days=days_back)
+        for hour in sorted(ISSUE_HOURS, reverse=True):
+            issue = day.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if issue <= local:
+                return issue
+    return local - timedelta(days=1)
+
+
+def parse_local_time(text):
+    """"2026-10-17 06:00:00" (台灣時間) → 有時區的 datetime"""
+    return datetime.strptime(text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=TAIWAN_TZ)
+
+
+def is_fresh(snapshot, now=None):
+    """
+    快照裡的預報是不是最近一次發布的那份：看資料本身 (第一個時段的開始時間)，不是看什麼時候抓的，
+    發布時間剛過就抓到的上一份預報不會被當成最新的
+    """
+    if not snapshot or not snapshot.get("period_start"):
+        return False
+    now = now or datetime.now(TAIWAN_TZ)
+    try:
+        period_start = parse_local_time(snapshot["period_start"])
+    except ValueError:
+        return False
+    return period_start >= last_issue_before(now)
+
+
+def conditional_headers(snapshot):
+    """有 ETag / Last-Modified 就帶上，伺服器支援的話會回 304"""
+    headers = {}
+    if snapshot:
+        if snapshot.get("etag"):
+            headers["If-None-Match"] = snapshot["etag"]
+        if snapshot.get("last_modified"):
+            headers["If-Modified-Since"] = snapshot["last_modified"]
+    return headers
+
+
+def touch(dataset, snapshot):
+    """內容沒變，只更新抓取時間"""
+    snapshot["fetched_at"] = time.time()
+    save(dataset, snapshot)
+
+
+def _broadcast_key(channel):
+    return f"{channel}_broadcast_hash" if channel else "broadcast_hash"
+
+
+def already_broadcast(snapshot, channel=None):
+    """這份預報是否已經廣播過；channel (例如 "discord") 只看單一通道"""
+    return bool(snapshot) and snapshot.get(_broadcast_key(channel)) == snapshot.get("content_hash")
+
+
+def mark_broadcast(dataset, snapshot, channel=None):
+    """記下這份預報已經廣播過 (所有通道都送達後才呼叫；channel 只記單一通道)"""
+    snapshot[_broadcast_key(channel)] = snapshot.get("content_hash")
+    save(dataset, snapshot)
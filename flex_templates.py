@@ -0,0 +1,64 @@
+"""預先編譯的訊息樣板
+
+Flex Message / Discord embed 大部分內容是固定的，每次都重建巢狀 dict
+再交給 requests 序列化很浪費。這裡把版面「編譯」一次：
+
+1. 用佔位字串 "{{name}}" 呼叫原本的版面函式，得到一份樣板 dict
+2. json.dumps 一次，依佔位字串切成預先編碼好的 bytes 片段
+3. render() 時只把跳脫過的動態值接進片段之間
+
+輸出和 json.dumps(原本的 dict).encode() 逐 byte 相同 (預設分隔符號、ensure_ascii)。
+
+佔位字串兩種用法：
+- 整個值就是佔位 ("text": "{{title}}")：接上 json.dumps(值)，
+  None 會變 null；傳入 bytes 則視為已序列化的 JSON 片段直接接上 (例如整個 list)
+- 嵌在字串裡 (f"📅 {{date}}")：接上 str(值) 跳脫後的內容，跟 f-string 的結果一致
+"""
+import json
+import re
+from json.encoder import encode_basestring_ascii
+
+_SLOT_RE = re.compile(r'"\{\{(\w+)\}\}"|\{\{(\w+)\}\}')
+
+
+def slots(*names):
+    """{name: "{{name}}"}，用來呼叫版面函式產生樣板"""
+    return {name: "{{%s}}" % name for name in names}
+
+
+def json_array(items):
+    """把已序列化的 bytes 片段組成 JSON list (跟 json.dumps 一樣用 ", " 分隔)"""
+    return b"[" + b", ".join(items) + b"]"
+
+
+class Template:
+    def __init__(self, layout):
+        text = json.dumps(layout)
+        # parts：[(前面的固定 bytes, 佔位名稱, 是否為整個值), ...]，最後一段固定內容另外存
+        self.parts = []
+        pos = 0
+        for m in _SLOT_RE.finditer(text):
+            whole = m.group(1) is not None
+            name = m.group(1) if whole else m.group(2)
+            self.parts.append((text[pos:m.start()].encode("ascii"), name, whole))
+            pos = m.end()
+        self.tail = text[pos:].encode("ascii")
+        self.names = {name for _, name, _ in self.parts}
+
+    def render(self, **values):
+        out = []
+        append = out.append
+        for literal, name, whole in self.parts:
+            append(literal)
+            value = values[name]
+            if whole:
+                if isinstance(value, bytes):
+                    append(value)
+                elif isinstance(value, str):
+                    append(encode_basestring_ascii(value).encode("ascii"))
+                else:
+                    append(json.dumps(value).encode("ascii"))
+            else:
+                append(encode_basestring_ascii(str(value))[1:-1].encode("ascii"))
+        append(self.tail)
+        return b"".join(out)
@@ -0,0 +1,237 @@
+"""預報歷史 (append-only、可 memory-map 的固定長度紀錄檔)
+
+每次抓到新的 F-C0032-001，就把每個時段、每個縣市的 MinT / MaxT / PoP / Wx 代碼附加到檔尾：
+    檔頭：magic "TWFH" | 版本 | 縣市數 | 縣市清單 (JSON，補齊到 8 bytes)
+    紀錄：start (int64，時段開始的 unix 秒) | issued (int64，寫入時間) | MinT[n] | MaxT[n] | PoP[n] | Wx[n] (int16)
+用 np.memmap 加上 structured dtype 打開，history.column("MaxT") 直接就是 (紀錄數 × 縣市) 的 int16 view，
+不會把檔案讀成 Python 物件；每年約 4 千筆、不到 1 MB，幾年的歷史幾毫秒內就能查完。
+
+同一個時段每 6 小時會重新發布一次，查詢時取最後附加的那筆 (最新的預報)。
+趨勢 (和昨天 / 上週比、近 7 日平均、歷史紀錄) 都是對所有縣市一次做的 numpy 運算。
+
+numpy 只有這個模組用到，呼叫端要用時才 import。
+"""
+import json
+import os
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from forecast_table import MISSING
+from regions import COUNTY_TO_REGION
+
+HISTORY_PATH = os.environ.get("FORECAST_HISTORY_FILE", os.path.join(".cache", "forecast_history.bin"))
+ELEMENTS = ("MinT", "MaxT", "PoP", "Wx")
+MAGIC = b"TWFH"
+FORMAT_VERSION = 1
+# magic、版本、縣市數、縣市清單長度
+_HEADER = struct.Struct("<4sHHI")
+# 歷史少於這麼多天時不算「紀錄」(剛開始累積時每天都會是新紀錄)
+RECORD_MIN_DAYS = 30
+DAY = 86400
+TAIWAN_TZ = timezone(timedelta(hours=8))
+
+
+def _record_dtype(n_cities):
+    return np.dtype([("start", "<i8"), ("issued", "<i8")] + [(name, "<i2", (n_cities,)) for name in ELEMENTS])
+
+
+def parse_time(text):
+    """"2026-10-17 06:00:00" (台灣時間) → unix 秒"""
+    return int(datetime.strptime(text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=TAIWAN_TZ).timestamp())
+
+
+def _as_float(values):
+    """int16 → float，MISSING 換成 NaN"""
+    values = np.asarray(values, dtype=float)
+    values[values == MISSING] = np.nan
+    return values
+
+
+def _nanmean(values, axis=0):
+    """不會對全部缺值的欄位發出警告的 nanmean"""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=axis)
+    total = np.where(valid, values, 0).sum(axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+class ForecastHistory:
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        self.cities, self.header_size = list(COUNTY_TO_REGION), None
+        self.records = np.empty(0, dtype=_record_dtype(len(self.cities)))
+        self._sorted = None
+        self._open()
+
+    def _open(self):
+        self._sorted = None
+        try:
+            with open(self.path, "rb") as f:
+                magic, version, n_cities, names_len = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != MAGIC or version != FORMAT_VERSION:
+                    raise ValueError(f"不是預報歷史檔或版本不同: {self.path}")
+                cities = json.loads(f.read(names_len).decode("utf-8"))
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        self.cities = cities
+        self.header_size = _HEADER.size + names_len
+        dtype = _record_dtype(n_cities)
+        # 寫到一半中斷的最後一筆不算
+        count = (size - self.header_size) // dtype.itemsize
+        if count:
+            self.records = np.memmap(self.path, dtype=dtype, mode="r", offset=self.header_size, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def city_index(self):
+        return {city: i for i, city in enumerate(self.cities)}
+
+    def column(self, element):
+        """(紀錄數 × 縣市) 的 int16 view"""
+        return self.records[element]
+
+    def _write_header(self, f):
+        names = json.dumps(self.cities, ensure_ascii=False).encode("utf-8")
+        names += b" " * (-(_HEADER.size + len(names)) % 8)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(self.cities), len(names)))
+        f.write(names)
+        self.header_size = _HEADER.size + len(names)
+
+    def append_records(self, records):
+        """把 structured array (同一個 dtype) 附加到檔尾，之後重新 memory-map"""
+        if not len(records):
+            return 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        itemsize = self.records.dtype.itemsize
+        with open(self.path, "ab") as f:
+            if self.header_size is None:
+                self._write_header(f)
+            else:
+                # 上次寫到一半的殘餘 bytes 先切掉，紀錄才不會錯位
+                f.truncate(self.header_size + len(self.records) * itemsize)
+            f.write(np.ascontiguousarray(records, dtype=self.records.dtype).tobytes())
+        self._open()
+        return len(records)
+
+    def from_table(self, table, issued=None):
+        """ForecastTable 的每個時段 → 一筆紀錄 (依這個檔案的縣市順序，沒有的縣市填 MISSING)"""
+        records = np.zeros(len(table.periods), dtype=self.records.dtype)
+        records["start"] = [parse_time(start) for start, _ in table.periods]
+        records["issued"] = int(issued or time.time())
+        columns = [table.city_index.get(city) for city in self.cities]
+        present = np.array([c is not None for c in columns])
+        take = np.array([c if c is not None else 0 for c in columns])
+        for name in ELEMENTS:
+            values = np.frombuffer(table.values[name], dtype=np.int16).reshape(len(table.periods), table.n_cities)
+            records[name] = np.where(present, values[:, take], MISSING)
+        return records
+
+    def append_table(self, table, issued=None):
+        """附加一份預報；和同時段最新一筆完全相同的時段略過 (沿用快照時重跑不會重複寫入)"""
+        records = self.from_table(table, issued)
+        latest = self.latest(records["start"])
+        keep = np.ones(len(records), dtype=bool)
+        for i, idx in enumerate(latest):
+            if idx >= 0:
+                keep[i] = any((self.records[name][idx] != records[name][i]).any() for name in ELEMENTS)
+        return self.append_records(records[keep])
+
+    def latest(self, starts):
+        """每個時段開始時間最後附加的那筆紀錄的位置 (沒有為 -1)"""
+        starts = np.asarray(starts, dtype=np.int64)
+        if not len(self.records):
+            return np.full(starts.shape, -1, dtype=np.int64)
+        if self._sorted is None:
+            # stable 排序：相同 start 的紀錄維持附加順序，最後一個就是最新的 (每次打開只排一次)
+            times = np.asarray(self.records["start"])
+            order = np.argsort(times, kind="stable")
+            self._sorted = order, times[order]
+        order, sorted_times = self._sorted
+        pos = np.searchsorted(sorted_times, starts, side="right") - 1
+        found = (pos >= 0) & (sorted_times[np.maximum(pos, 0)] == starts)
+        return np.where(found, order[np.maximum(pos, 0)], -1)
+
+    def values_at(self, element, starts):
+        """(len(starts) × 縣市) 的 float array，沒有紀錄或缺值為 NaN"""
+        idx = self.latest(starts)
+        values = np.full((len(idx), len(self.cities)), np.nan)
+        found = idx >= 0
+        values[found] = _as_float(self.records[element][idx[found]])
+        return values
+
+    def trends(self, start, current=None):
+        """
+        某個時段 (start 為 unix 秒) 對所有縣市的趨勢，回傳 Trends。
+        current 是 {因子: 這次的值 (依 self.cities 順序)}；沒給就用歷史裡這個時段最新的一筆。
+        """
+        if current is None:
+            current = {name: self.values_at(name, [start])[0] for name in ("MinT", "MaxT", "PoP")}
+        current = {name: _as_float(values) for name, values in current.items()}
+
+        t = Trends(self.cities, start, current)
+        for name in ("MinT", "MaxT", "PoP"):
+            yesterday, last_week = self.values_at(name, [start - DAY, start - 7 * DAY])
+            t.day_delta[name] = current[name] - yesterday
+            t.week_delta[name] = current[name] - last_week
+            t.avg7[name] = _nanmean(self.values_at(name, start - DAY * np.arange(1, 8)))
+
+        # 歷史紀錄：同一個時段類型 (開始的時刻相同，白天 / 晚上分開)、在這個時段之前的所有預報
+        if len(self.records):
+            times = np.asarray(self.records["start"])
+            past = (times < start) & (times % DAY == start % DAY)
+            t.days = len(np.unique(times[past] // DAY))
+            if t.days >= RECORD_MIN_DAYS:
+                highs = _as_float(self.records["MaxT"][past])
+                lows = _as_float(self.records["MinT"][past])
+                with np.errstate(invalid="ignore"):
+                    t.record_high = np.fmax.reduce(highs, axis=0)
+                    t.record_low = np.fmin.reduce(lows, axis=0)
+        return t
+
+
+class Trends:
+    """一個時段所有縣市的趨勢 (array 依 cities 順序，缺資料為 NaN)"""
+
+    def __init__(self, cities, start, current):
+        self.cities = cities
+        self.index = {city: i for i, city in enumerate(cities)}
+        self.start = start
+        self.current = current
+        self.day_delta = {}     # 因子 → 和昨天同時段的差
+        self.week_delta = {}    # 因子 → 和上週同一天的差
+        self.avg7 = {}          # 因子 → 前 7 天同時段的平均
+        self.days = 0           # 歷史涵蓋幾天
+        nan = np.full(len(cities), np.nan)
+        self.record_high, self.record_low = nan, nan.copy()
+
+    def _get(self, values, city):
+        i = self.index.get(city)
+        if i is None or np.isnan(values[i]):
+            return None
+        return float(values[i])
+
+    def for_city(self, city):
+        """{"max_day", "min_day", "max_week", "max_avg7", "record_high", "record_low"}，沒有資料的為 None"""
+        high, low = self._get(self.current["MaxT"], city), self._get(self.current["MinT"], city)
+        record_high, record_low = self._get(self.record_high, city), self._get(self.record_low, city)
+        return {
+            "max_day": self._get(self.day_delta["MaxT"], city),
+            "min_day": self._get(self.day_delta["MinT"], city),
+            "max_week": self._get(self.week_delta["MaxT"], city),
+            "max_avg7": self._get(self.avg7["MaxT"], city),
+            "record_high": high is not None and record_high is not None and high > record_high,
+            "record_low": low is not None and record_low is not None and low < record_low,
+        }
+
+
+def load(path=None):
+    return ForecastHistory(path or HISTORY_PATH)
@@ -0,0 +1,178 @@
+"""F-C0032-001 預報表 (縣市 × 時段 × 天氣因子)
+
+氣象局每個縣市有 3 個 12 小時時段，每個時段有 Wx / PoP / MinT / MaxT / CI 五個因子。
+這裡一次走完整份 JSON，依 elementName (不是位置) 把數值填進 array，
+版面是「時段優先」：第 p 個時段的所有縣市在 [p * n_cities, (p + 1) * n_cities) 連續排列。
+
+- 數值因子 (Wx 代碼、PoP、MinT、MaxT) 存在 array('h')，缺值為 MISSING
+- MISSING 只留在表裡面：get() / column() 缺值回傳 None，weather_data() / raw_data_list() 顯示成 BLANK 或略過，
+  -999 不會出現在卡片或給 AI 的文字裡
+- 文字 (Wx 敘述、CI 舒適度) 存在 list
+- 圖示與降雨顏色一次對整張表分類，之後各種版面 (今天 / 今晚 / 明天) 都直接查表
+"""
+from array import array
+from bisect import bisect_right
+
+NUMERIC_ELEMENTS = ("Wx", "PoP", "MinT", "MaxT")
+TEXT_ELEMENTS = ("Wx", "CI")
+MISSING = -999
+# 卡片上缺值的顯示方式
+BLANK = "--"
+
+# 降雨機率分級：< 30 看天氣現象、30~59 ☂️、>= 60 🌧️
+POP_ICON_THRESHOLDS = [30, 60]
+POP_ICONS = [None, "☂️", "🌧️"]
+# 降雨機率 >= 50 用紅字
+POP_COLOR_THRESHOLDS = [50]
+POP_COLORS = ["#666666", "#ff3333"]
+
+PERIOD_LABELS = ["今日", "今晚明晨", "明日"]
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING
+
+
+def _value(value):
+    return None if value == MISSING else value
+
+
+def _shown(value):
+    return BLANK if value == MISSING else value
+
+
+class ForecastTable:
+    def __init__(self, cities, periods):
+        self.cities = list(cities)
+        self.periods = [tuple(p) for p in periods]
+        self.city_index = {city: i for i, city in enumerate(self.cities)}
+        size = len(self.cities) * len(self.periods)
+        self.values = {name: array("h", [MISSING]) * size for name in NUMERIC_ELEMENTS}
+        self.texts = {name: [""] * size for name in TEXT_ELEMENTS}
+        self.icons = []
+        self.pop_colors = []
+
+    @property
+    def n_cities(self):
+        return len(self.cities)
+
+    def index(self, city, period=0):
+        return period * self.n_cities + self.city_index[city]
+
+    def get(self, element, city, period=0):
+        i = self.index(city, period)
+        if element in self.values:
+            return _value(self.values[element][i])
+        return self.texts[element][i]
+
+    def text(self, element, city, period=0):
+        return self.texts[element][self.index(city, period)]
+
+    def column(self, element, period=0):
+        """某個時段、某個因子的所有縣市 (依 self.cities 順序)，數值缺值為 None"""
+        start = period * self.n_cities
+        if element in self.values:
+            return [_value(v) for v in self.values[element][start:start + self.n_cities]]
+        return self.texts[element][start:start + self.n_cities]
+
+    def classify(self):
+        """對整張表一次算出圖示與降雨顏色"""
+        sunny = {text: "晴" in text for text in set(self.texts["Wx"])}
+        pops = self.values["PoP"]
+        wx_texts = self.texts["Wx"]
+        icons = [POP_ICONS[bisect_right(POP_ICON_THRESHOLDS, pop)] for pop in pops]
+        self.icons = [
+            icon or ("☀️" if sunny[wx] else "☁️")
+            for icon, wx in zip(icons, wx_texts)
+        ]
+        self.pop_colors = [POP_COLORS[bisect_right(POP_COLOR_THRESHOLDS, pop)] for pop in pops]
+        return self
+
+    def time_range(self, period=0):
+        start, end = self.periods[period]
+        return f"{start} ~ {end}"
+
+    def weather_data(self, period=0):
+        """某個時段的 {city: {...}}，欄位與舊版 get_taiwan_weather_data 相同；缺值的 min_t / max_t / pop 為 BLANK"""
+        data = {}
+        for city in self.cities:
+            i = self.index(city, period)
+            min_t, max_t, pop = (_shown(self.values[name][i]) for name in ("MinT", "MaxT", "PoP"))
+            icon = self.icons[i]
+            data[city] = {
+                # 給 Discord 吃這行 (保留 **粗體** 格式)
+                "display": f"**{city}**\n└ {icon} {min_t}-{max_t}°C | 降雨 {pop}%",
+                # 以下給 Line 吃
+                "city": city,
+                "icon": icon,
+                "min_t": str(min_t),
+                "max_t": str(max_t),
+                "pop": pop,
+                "pop_color": self.pop_colors[i],
+                # 和昨天的比較 (weather_bot.forecast_views 有預報歷史時才填)
+                "trend": ""
+            }
+        return data
+
+    def raw_data_list(self, period=0):
+        """給 AI 看的一城一行摘要 (缺值的因子直接略過，不讓 AI 看到 -999)"""
+        lines = []
+        for city in self.cities:
+            i = self.index(city, period)
+            min_t, max_t, pop = (_value(self.values[name][i]) for name in ("MinT", "MaxT", "PoP"))
+            parts = [self.texts["Wx"][i] or "天氣資料缺漏"]
+            if min_t is not None and max_t is not None:
+                parts.append(f"氣溫{min_t}-{max_t}")
+            if pop is not None:
+                parts.append(f"降雨{pop}%")
+            lines.append(f"{city}: {', '.join(parts)}")
+        return lines
+
+    def to_dict(self):
+        return {
+            "cities": self.cities,
+            "periods": self.periods,
+            "values": {name: arr.tolist() for name, arr in self.values.items()},
+            "texts": self.texts
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        table = cls(d["cities"], d["periods"])
+        for name, values in d["values"].items():
+            table.values[name] = array("h", values)
+        for name, texts in d["texts"].items():
+            table.texts[name] = list(texts)
+        return table.classify()
+
+
+def build_forecast_table(data):
+    """一次走完 F-C0032-001 的 records，建立 ForecastTable"""
+    locations = data["records"]["location"]
+    first_times = locations[0]["weatherElement"][0]["time"]
+    periods = [(t["startTime"], t["endTime"]) for t in first_times]
+    table = ForecastTable((loc["locationName"] for loc in locations), periods)
+
+    n_cities = table.n_cities
+    n_periods = len(periods)
+    values, texts = table.values, table.texts
+    for c, location in enumerate(locations):
+        for element in location["weatherElement"]:
+            name = element["elementName"]
+            numeric = values.get(name)
+            text = texts.get(name)
+            if numeric is None and text is None:
+                continue
+            for p, t in enumerate(element["time"][:n_periods]):
+                param = t["parameter"]
+                i = p * n_cities + c
+                if name == "Wx":
+                    numeric[i] = _to_int(param.get("parameterValue"))
+                elif numeric is not None:
+                    numeric[i] = _to_int(param.get("parameterName"))
+                if text is not None:
+                    text[i] = param.get("parameterName", "")
+    return table.classify()
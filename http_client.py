@@ -0,0 +1,274 @@
+"""共用 HTTP 連線層
+
+兩支機器人所有對外請求都走這裡：
+- 全程共用一個 requests.Session，每個 host 保留 keep-alive 連線池 (TLS 只握手一次)
+- 統一的 Retry 策略 (只重試 GET 這類冪等請求，POST 不自動重送避免重複發送)
+- request(..., deadline=) 帶呼叫端階段的截止時間 (time.perf_counter)：timeout 壓在剩餘預算內，
+  退避後會超過預算的重試直接放棄、Retry-After 也不會睡過頭，整個請求不會拖垮 pipeline 的 Deadline
+- 依 endpoint 設定 (connect, read) timeout，不會再有沒設 timeout 的請求
+- 統計每個 host 的請求數與新建連線數，算出連線重用率
+- LINE / Discord 這類有速率限制的 endpoint 先經過 rate_limit 的 token bucket，429 會等待後重送
+- 啟用 telemetry 時，每個請求記錄延遲 histogram、請求數 (依狀態碼) 與 request / response 大小
+
+requests / urllib3 在第一次發請求時才載入，只渲染卡片的指令不必付這個成本。
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import rate_limit
+import telemetry
+
+# (connect timeout, read timeout) 秒
+TIMEOUTS = {
+    "cwa": (5, 10),
+    "cwa_township": (5, 60),
+    "cwa_alerts": (3, 10),
+    "cwa_obs": (5, 20),
+    "nasa_api": (5, 10),
+    "nasa_web": (5, 30),
+    "nasa_archive": (5, 120),
+    "nasa_image": (5, 60),
+    "image_publish": (3, 5),
+    "gas": (5, 20),
+    "discord": (5, 10),
+    "line_push": (5, 10),
+    "line_multicast": (5, 10),
+    "default": (5, 15),
+}
+
+# 同一個 host 最多同時保留幾條連線 (要 >= LINE 發送的 worker 數)
+POOL_MAXSIZE = 16
+# 自動重試 (冪等請求)：次數、退避係數 (1, 2, 4 秒...)、會重試的狀態碼
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 1
+RETRY_STATUS = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"))
+# 有 deadline 時，timeout 至少留這麼多秒 (太短連線都建不起來)
+MIN_TIMEOUT = 0.5
+
+# 目前請求的截止時間，給 Retry 判斷還來不來得及退避重試 (每個執行緒各自的 context)
+_deadline = contextvars.ContextVar("http_deadline", default=None)
+
+# 送出已序列化好的 JSON body (data=bytes) 時用的標頭
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+_stats_lock = threading.Lock()
+_requests_by_host = defaultdict(int)
+_connects_by_host = defaultdict(int)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _record_connect(host):
+    with _stats_lock:
+        _connects_by_host[host] += 1
+
+
+def _count_request(response, *args, **kwargs):
+    host = urlsplit(response.url).hostname or ""
+    with _stats_lock:
+        _requests_by_host[host] += 1
+
+
+def _build_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.util.retry import Retry
+
+    class _CountingHTTPConnectionPool(HTTPConnectionPool):
+        def _new_conn(self):
+            _record_connect(self.host)
+            return super()._new_conn()
+
+    class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        def _new_conn(self):
+            _record_connect(self.host)
+            return super()._new_conn()
+
+    class _CountingAdapter(HTTPAdapter):
+        """HTTPAdapter，但連線池換成會記錄「新建連線」的版本"""
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _CountingHTTPConnectionPool,
+                "https": _CountingHTTPSConnectionPool,
+            }
+
+    class _BudgetRetry(Retry):
+        """呼叫端帶了 deadline 時不在 urllib3 裡重試，交給 request() 依剩餘預算重試"""
+
+        def is_retry(self, method, status_code, has_retry_after=False):
+            return _deadline.get() is None and super().is_retry(method, status_code, has_retry_after)
+
+        def is_exhausted(self):
+            return _deadline.get() is not None or super().is_exhausted()
+
+    retry = _BudgetRetry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF, status_forcelist=RETRY_STATUS)
+    adapter = _CountingAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(_count_request)
+    return session
+
+
+def get_session():
+    """取得全域共用的 Session (第一次呼叫時建立)"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _send(endpoint, method, url, kwargs):
+    if not telemetry.ENABLED:
+        return get_session().request(method, url, **kwargs)
+
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        resp = get_session().request(method, url, **kwargs)
+        status = resp.status_code
+        size = resp.headers.get("Content-Length")
+        if size and size.isdigit():
+            telemetry.observe("http_response_bytes", int(size), telemetry.SIZE_BUCKETS, endpoint=endpoint)
+        return resp
+    finally:
+        telemetry.observe("http_request_duration_seconds", time.perf_counter() - t0,
+                          endpoint=endpoint, method=method, status=status)
+        telemetry.count("http_requests_total", endpoint=endpoint, method=method, status=status)
+        body = kwargs.get("data")
+        if isinstance(body, (bytes, str)):
+            telemetry.observe("http_request_bytes", len(body), telemetry.SIZE_BUCKETS, endpoint=endpoint)
+
+
+def _buffer_files(files):
+    """
+    multipart 附件裡的檔案物件先讀成 bytes：429 重試會重用同一組參數，
+    串流第一次送出就讀完了，重試時附件會變成空的
+    """
+    def read(value):
+        if isinstance(value, tuple):
+            return (value[0], read(value[1])) + value[2:]
+        return value.read() if hasattr(value, "read") else value
+
+    items = files.items() if isinstance(files, dict) else files
+    buffered = [(name, read(value)) for name, value in items]
+    return dict(buffered) if isinstance(files, dict) else buffered
+
+
+def _clamp_timeout(timeout, left):
+    left = max(left, MIN_TIMEOUT)
+    if isinstance(timeout, tuple):
+        return tuple(min(t, left) for t in timeout)
+    return min(timeout, left)
+
+
+def _retry_after(resp):
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def request(endpoint, method, url, deadline=None, **kwargs):
+    """
+    deadline：呼叫端階段的截止時間 (time.perf_counter)。這時 urllib3 不自動重試，改在這裡重試：
+    每次嘗試的 timeout 都壓在剩餘預算內，退避 (或 Retry-After) 之後來不及再試一次就不重試，
+    整個請求最晚在 deadline (+ MIN_TIMEOUT) 結束。已經過了 deadline 直接丟 TimeoutError
+    """
+    kwargs.setdefault("timeout", TIMEOUTS.get(endpoint, TIMEOUTS["default"]))
+    if deadline is None:
+        return _request(endpoint, method, url, None, kwargs)
+
+    timeout = kwargs["timeout"]
+    retries = RETRY_TOTAL if method.upper() in IDEMPOTENT_METHODS else 0
+    token = _deadline.set(deadline)
+    try:
+        for attempt in range(retries + 1):
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                raise TimeoutError(f"{endpoint}: 時間預算用完，不送出請求")
+            kwargs["timeout"] = _clamp_timeout(timeout, left)
+            wait = RETRY_BACKOFF * 2 ** attempt
+            try:
+                resp = _request(endpoint, method, url, deadline, kwargs)
+            except Exception as e:
+                import requests
+
+                if not isinstance(e, requests.ConnectionError) or attempt == retries:
+                    raise
+                if time.perf_counter() + wait + MIN_TIMEOUT >= deadline:
+                    raise
+            else:
+                if resp.status_code not in RETRY_STATUS or attempt == retries:
+                    return resp
+                wait = _retry_after(resp) or wait
+                if time.perf_counter() + wait + MIN_TIMEOUT >= deadline:
+                    return resp  # 來不及重試，把錯誤的回應交回呼叫端
+                resp.close()
+            time.sleep(wait)
+    finally:
+        _deadline.reset(token)
+
+
+def _request(endpoint, method, url, deadline, kwargs):
+    bucket = rate_limit.bucket_for(endpoint, url)
+    if bucket is None:
+        return _send(endpoint, method, url, kwargs)
+    if kwargs.get("files"):
+        kwargs["files"] = _buffer_files(kwargs["files"])
+
+    for _ in range(rate_limit.MAX_429_RETRIES + 1):
+        bucket.acquire()
+        resp = _send(endpoint, method, url, kwargs)
+        if not bucket.observe(resp):
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break  # 預算用完，把 429 交回呼叫端
+    return resp
+
+
+def get(endpoint, url, **kwargs):
+    return request(endpoint, "GET", url, **kwargs)
+
+
+def post(endpoint, url, **kwargs):
+    return request(endpoint, "POST", url, **kwargs)
+
+
+def stats():
+    """回傳 {host: {"requests": n, "connections": n, "reused": n}}"""
+    with _stats_lock:
+        hosts = set(_requests_by_host) | set(_connects_by_host)
+        return {
+            host: {
+                "requests": _requests_by_host[host],
+                "connections": _connects_by_host[host],
+                "reused": max(_requests_by_host[host] - _connects_by_host[host], 0),
+            }
+            for host in sorted(hosts)
+        }
+
+
+def print_stats():
+    for host, s in stats().items():
+        print(f"🔌 {host}: {s['requests']} 個請求 / {s['connections']} 條連線 (重用 {s['reused']} 次)")
+    rate_limit.print_stats()
+
+
+def close():
+    """關閉所有連線 (長駐程式結束時呼叫)"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
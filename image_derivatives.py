@@ -0,0 +1,247 @@
+"""APOD 圖片衍生檔 (縮圖) 與本機快取 (IMAGE_CACHE_DIR 預設 .cache/images)
+
+APOD 的 url 常常是好幾 MB 的大圖，直接放進 Flex hero 會讓每支手機都下載原圖，
+有時還超過 LINE 的限制。這裡把原圖下載一次，產生限制尺寸 / 檔案大小的 JPEG：
+- hero：LINE Flex hero (長邊 1024px、1 MB 以內)
+- preview：Discord embed 附件 (長邊 1600px、3 MB 以內)
+- thumb：縮圖 (長邊 240px、64 KB 以內)
+
+快取以原圖內容的 sha256 命名，同一張圖不論來源 URL 只處理一次；index.json 記錄 URL → 雜湊，
+同一個 URL 重跑時連下載都省掉。Flex 的 aspectRatio 直接用衍生檔的實際寬高。
+
+LINE 只能用 HTTPS 網址，設定 IMAGE_PUBLIC_BASE_URL (快取目錄同步到的靜態網站) 才會改用 hero。
+這個模組不負責上傳：快取目錄要由外部 (例如 workflow 的部署步驟) 同步到那個網址。
+發送前會先 HEAD 一次 hero 的公開網址，沒有回 200 就不給 LINE 用 hero，沿用 APOD 原圖，
+避免卡片上出現破圖。沒設定 IMAGE_PUBLIC_BASE_URL 時 LINE 一律用原圖 (第一次執行時警告一次)。
+Discord 不需要網址，衍生檔以附件 (attachment://) 上傳。Pillow 用到才載入。
+
+prepare_images 可以傳入 cancel (threading.Event)：呼叫端的時間預算用完時 set()，
+下載的每個 chunk、每種衍生檔之間都會檢查，盡快結束執行緒，不拖住行程結束。
+"""
+import hashlib
+import io
+import json
+import math
+import os
+import time
+from collections import namedtuple
+
+import http_client
+
+CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join(".cache", "images"))
+PUBLIC_BASE_URL = os.environ.get("IMAGE_PUBLIC_BASE_URL", "").rstrip("/")
+
+# 名稱 → (長邊上限 px, 檔案大小上限 bytes)
+DERIVATIVES = {
+    "hero": (1024, 1024 * 1024),
+    "preview": (1600, 3 * 1024 * 1024),
+    "thumb": (240, 64 * 1024),
+}
+# 各通道用哪一種衍生檔
+CHANNEL_DERIVATIVE = {"line": "hero", "discord": "preview"}
+
+# 原圖下載上限 (APOD 偶爾有幾十 MB 的全景圖)
+MAX_SOURCE_BYTES = 64 * 1024 * 1024
+# 超過大小上限時依序降低的 JPEG 品質，還是太大就再縮小尺寸
+QUALITY_STEPS = (85, 75, 65, 55)
+SHRINK_FACTOR = 0.8
+
+Derivative = namedtuple("Derivative", "name path width height size")
+
+_warned_unpublished = False
+
+
+class Cancelled(Exception):
+    """呼叫端的時間預算用完，停止產生衍生檔"""
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("時間預算用完")
+
+
+def warn_if_unpublished():
+    """沒設定 IMAGE_PUBLIC_BASE_URL 時提醒一次：LINE hero 會沿用 APOD 原圖 (常常好幾 MB)"""
+    global _warned_unpublished
+    if PUBLIC_BASE_URL or _warned_unpublished:
+        return
+    _warned_unpublished = True
+    print("⚠️ 未設定 IMAGE_PUBLIC_BASE_URL，LINE 卡片沿用 APOD 原圖；"
+          "把 IMAGE_CACHE_DIR 同步到 HTTPS 靜態網站並設定這個變數，才會改用 1024px 的衍生檔")
+
+
+def aspect_ratio(width, height):
+    """Flex 的 aspectRatio 字串 ("寬:高"，LINE 限制高度不能超過寬度的 3 倍)"""
+    height = min(height, width * 3)
+    g = math.gcd(width, height) or 1
+    return f"{width // g}:{height // g}"
+
+
+def public_url(derivative):
+    """衍生檔的公開網址；沒有設定 IMAGE_PUBLIC_BASE_URL 時回傳 None"""
+    if not PUBLIC_BASE_URL or derivative is None:
+        return None
+    return f"{PUBLIC_BASE_URL}/{os.path.basename(derivative.path)}"
+
+
+def _check_published(images):
+    """
+    IMAGE_PUBLIC_BASE_URL 上找不到 hero 時，回傳拿掉 hero 的 images (LINE 沿用原圖網址)。
+    沒設定 IMAGE_PUBLIC_BASE_URL 時原樣回傳。
+    """
+    url = public_url(images.get("hero"))
+    if not url:
+        return images
+    try:
+        resp = http_client.request("image_publish", "HEAD", url, allow_redirects=True)
+        status = resp.status_code
+    except Exception as e:
+        status = e
+    if status == 200:
+        return images
+    print(f"⚠️ hero 衍生檔還沒發布到 {url} ({status})，LINE 沿用原圖網址")
+    return {name: d for name, d in images.items() if name != "hero"}
+
+
+def for_channel(images, channel):
+    """依通道挑衍生檔 (images 可以是 None)"""
+    if not images:
+        return None
+    return images.get(CHANNEL_DERIVATIVE[channel])
+
+
+def _encode(img, max_edge, max_bytes):
+    """縮到 max_edge 以內並壓成 JPEG，超過 max_bytes 先降品質再縮小。回傳 (bytes, 寬, 高)"""
+    from PIL import Image
+
+    edge = max_edge
+    while True:
+        resized = img.copy()
+        resized.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for quality in QUALITY_STEPS:
+            buf = io.BytesIO()
+            resized.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+            if buf.tell() <= max_bytes:
+                return buf.getvalue(), resized.width, resized.height
+        if edge <= 64:
+            return buf.getvalue(), resized.width, resized.height
+        edge = int(edge * SHRINK_FACTOR)
+
+
+def _open(source):
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(source))
+    largest = max(DERIVATIVES.values())[0]
+    # JPEG 可以在解碼時就縮小 (DCT scaling)，大圖快很多
+    img.draft("RGB", (largest, largest))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        # 透明背景貼到黑底 (太空圖的背景本來就是黑的)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (0, 0, 0))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+    return img
+
+
+def build_derivatives(source, cache_dir=CACHE_DIR, cancel=None):
+    """由原圖 bytes 產生 (或從快取讀出) 所有衍生檔，回傳 {名稱: Derivative}"""
+    digest = hashlib.sha256(source).hexdigest()[:24]
+    meta_path = os.path.join(cache_dir, f"{digest}.json")
+    cached = _load_meta(meta_path)
+    if cached:
+        return cached
+
+    os.makedirs(cache_dir, exist_ok=True)
+    img = _open(source)
+    meta = {}
+    for name, (max_edge, max_bytes) in DERIVATIVES.items():
+        _check_cancel(cancel)
+        data, width, height = _encode(img, max_edge, max_bytes)
+        path = os.path.join(cache_dir, f"{digest}-{name}.jpg")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        meta[name] = {"file": os.path.basename(path), "width": width, "height": height, "size": len(data)}
+    _write_json(meta_path, meta)
+    return _load_meta(meta_path)
+
+
+def _load_meta(meta_path):
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    cache_dir = os.path.dirname(meta_path)
+    images = {}
+    for name, m in meta.items():
+        path = os.path.join(cache_dir, m["file"])
+        if not os.path.exists(path):
+            return None
+        images[name] = Derivative(name, path, m["width"], m["height"], m["size"])
+    return images
+
+
+def _write_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def _download(url, cancel=None):
+    chunks = []
+    total = 0
+    with http_client.get("nasa_image", url, stream=True) as resp:
+        if resp.status_code != 200:
+            raise ValueError(f"HTTP {resp.status_code}")
+        for chunk in resp.iter_content(256 * 1024):
+            _check_cancel(cancel)
+            total += len(chunk)
+            if total > MAX_SOURCE_BYTES:
+                raise ValueError(f"原圖超過 {MAX_SOURCE_BYTES // 1024 // 1024} MB")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def prepare_images(url, cache_dir=CACHE_DIR, cancel=None):
+    """
+    下載 (或從快取取得) APOD 圖片並產生衍生檔；失敗或 cancel 被 set() 時回傳 None，呼叫端沿用原圖網址
+    """
+    if not url:
+        return None
+    t0 = time.perf_counter()
+    index_path = os.path.join(cache_dir, "index.json")
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    try:
+        digest = index.get(url)
+        images = _load_meta(os.path.join(cache_dir, f"{digest}.json")) if digest else None
+        if images:
+            print(f"🖼️ 圖片衍生檔已在快取 ({digest[:8]})")
+            return _check_published(images)
+
+        source = _download(url, cancel)
+        images = build_derivatives(source, cache_dir, cancel)
+        index[url] = os.path.basename(images["hero"].path).split("-")[0]
+        _write_json(index_path, index)
+    except Cancelled:
+        print("⏳ 圖片衍生檔超過時間預算，停止處理")
+        return None
+    except Exception as e:
+        print(f"⚠️ 圖片衍生檔產生失敗，沿用原圖網址: {e}")
+        return None
+
+    sizes = ", ".join(f"{d.name} {d.width}x{d.height} {d.size // 1024}KB" for d in images.values())
+    print(f"🖼️ 原圖 {len(source) // 1024}KB → {sizes} ({time.perf_counter() - t0:.2f}s)")
+    return _check_published(images)
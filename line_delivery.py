@@ -0,0 +1,237 @@
+"""LINE 批次發送引擎
+
+把訂閱者分成兩條路徑同時發送：
+- 使用者 ID (U 開頭)：每 500 個一批，走 /v2/bot/message/multicast
+- 群組 / 聊天室 ID (C / R 開頭)：multicast 不支援，改走 /v2/bot/message/push
+
+所有請求丟進同一個有上限的 thread pool 平行處理，最後回報每個收件者的結果。
+
+deliver_durable 另外把每個批次的狀態記在 outbox (見 outbox.py)，中途失敗後重新執行只會重送沒送達的批次。
+"""
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+import telemetry
+
+LINE_API_BASE = os.environ.get("LINE_API_BASE", "https://api.line.me")
+
+# LINE multicast 單次最多 500 個 user ID
+MULTICAST_LIMIT = 500
+DEFAULT_WORKERS = 8
+# deliver_durable 在同一次執行內，對暫時性錯誤 (429 / 5xx / 連線失敗) 最多重試幾輪
+RETRY_ROUNDS = int(os.environ.get("LINE_RETRY_ROUNDS", 3))
+RETRY_BACKOFF = 1.0
+
+
+def split_recipients(recipient_ids):
+    """分成 (可 multicast 的 user ID, 只能 push 的群組/聊天室 ID)"""
+    users, targets = [], []
+    for rid in recipient_ids:
+        if rid.startswith("U"):
+            users.append(rid)
+        else:
+            targets.append(rid)
+    return users, targets
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _build_body(to, messages_json):
+    # messages 只序列化一次，每個請求只換 "to"
+    return b'{"to": ' + json.dumps(to).encode("ascii") + b', "messages": ' + messages_json + b'}'
+
+
+def _encode_messages(messages):
+    """messages 可以是 dict 的 list，或已經序列化好的 JSON list (bytes，例如 flex_templates 的輸出)"""
+    if isinstance(messages, bytes):
+        return messages
+    return json.dumps(messages).encode("ascii")
+
+
+def _send(channel, url, headers, to, messages_json):
+    """送出一個請求 (channel 為 multicast / push，各自是一個 endpoint 標籤)，回傳 (status_code, error_text)"""
+    recipients = len(to) if isinstance(to, list) else 1
+    with telemetry.span("LINE 請求", channel=channel, recipients=recipients) as sp:
+        try:
+            resp = http_client.post(f"line_{channel}", url, headers=headers, data=_build_body(to, messages_json))
+        except Exception as e:
+            sp.set(status="error")
+            return None, str(e)
+        sp.set(status=resp.status_code)
+        if resp.status_code == 200:
+            return resp.status_code, None
+        return resp.status_code, resp.text
+
+
+def _submit(pool, func, *args):
+    """
+    ThreadPoolExecutor 不會帶上 contextvars：每個工作各複製一份呼叫端的 context，
+    LINE 請求的 span 才會掛在呼叫端的階段底下
+    """
+    return pool.submit(contextvars.copy_context().run, func, *args)
+
+
+def plan_batches(recipient_ids):
+    """把收件者切成 [(channel, [recipient, ...]), ...]：user 每 500 個一批 multicast，其餘逐一 push"""
+    users, targets = split_recipients(sorted(set(recipient_ids)))
+    batches = [("multicast", batch) for batch in chunked(users, MULTICAST_LIMIT)]
+    batches.extend(("push", [target]) for target in targets)
+    return batches
+
+
+def retryable(status):
+    """429 / 5xx / 連線失敗 (status 為 None) 是暫時性錯誤，值得重試"""
+    return status is None or status == 429 or status >= 500
+
+
+def deliver_line_messages(messages, recipient_ids, token, max_workers=DEFAULT_WORKERS, api_base=None):
+    """
+    發送 messages (Flex Message 等 dict 的 list，或已序列化的 JSON bytes) 給所有收件者。
+
+    回傳 {recipient_id: {"ok": bool, "status": int|None, "error": str|None, "via": "multicast"|"push"}}
+    """
+    return deliver_line_groups([(messages, recipient_ids)], token, max_workers, api_base)
+
+
+def deliver_line_groups(groups, token, max_workers=DEFAULT_WORKERS, api_base=None):
+    """
+    一次發送多組不同內容：groups 是 [(messages, recipient_ids), ...]。
+    每組的 messages 只序列化一次，所有組的請求共用同一個 thread pool。
+    回傳格式同 deliver_line_messages。
+    """
+    api_base = api_base or LINE_API_BASE
+    multicast_url = f"{api_base}/v2/bot/message/multicast"
+    push_url = f"{api_base}/v2/bot/message/push"
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {token}"
+    }
+
+    # worker 數不超過連線池大小，才不會有連線被丟掉重建
+    max_workers = min(max_workers, http_client.POOL_MAXSIZE)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        jobs = []
+        for messages, recipient_ids in groups:
+            messages_json = _encode_messages(messages)
+            users, targets = split_recipients(sorted(set(recipient_ids)))
+            for batch in chunked(users, MULTICAST_LIMIT):
+                fut = _submit(pool, _send, "multicast", multicast_url, headers, batch, messages_json)
+                jobs.append((fut, batch, "multicast"))
+            for target in targets:
+                fut = _submit(pool, _send, "push", push_url, headers, target, messages_json)
+                jobs.append((fut, [target], "push"))
+
+        for fut, batch, via in jobs:
+            status, error = fut.result()
+            for rid in batch:
+                results[rid] = {"ok": status == 200, "status": status, "error": error, "via": via}
+
+    return results
+
+
+def print_delivery_report(results):
+    """印出發送摘要，失敗的收件者逐一列出"""
+    ok_count = sum(1 for r in results.values() if r["ok"])
+    fail_count = len(results) - ok_count
+    print(f"✅ Line 發送完成：成功 {ok_count} / 失敗 {fail_count}")
+    for rid, r in results.items():
+        if not r["ok"]:
+            print(f"❌ Line 發送失敗 (Target: {rid}, via {r['via']}): {r['status']} {r['error']}")
+
+
+def deliver_durable(groups, token, broadcast_id, outbox=None, max_workers=DEFAULT_WORKERS, api_base=None,
+                    retry_rounds=RETRY_ROUNDS, deadline=None):
+    """
+    和 deliver_line_groups 一樣發送多組訊息，但每個批次的狀態都記在 outbox：
+    - broadcast_id 用來區分不同次廣播；同一次廣播重新執行時，每個收件者最多排程一次，
+      未完成的批次用原本的內容續傳，這次的內容只發給之前沒排程過的收件者
+    - 每個批次帶固定的 X-Line-Retry-Key，重送時 LINE 回 409 代表已送達
+    - 暫時性錯誤在這次執行內以指數退避重試 retry_rounds 輪，剩下的留給下次執行
+    - deadline (time.perf_counter 的截止時間)：退避後會超過就不再重試，同樣留給下次執行
+
+    回傳這次實際嘗試的收件者結果 (格式同 deliver_line_messages)；之前已送達的不會出現在結果裡。
+    """
+    from outbox import Outbox
+
+    api_base = api_base or LINE_API_BASE
+    urls = {
+        "multicast": f"{api_base}/v2/bot/message/multicast",
+        "push": f"{api_base}/v2/bot/message/push",
+    }
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {token}"
+    }
+    max_workers = min(max_workers, http_client.POOL_MAXSIZE)
+
+    own_outbox = outbox is None
+    outbox = outbox or Outbox()
+    results = {}
+    try:
+        planned = outbox.planned(broadcast_id)
+        resumed, added = bool(planned), 0
+        for messages, recipient_ids in groups:
+            fresh = [rid for rid in set(recipient_ids) if rid not in planned]
+            if fresh:
+                outbox.enqueue(broadcast_id, _encode_messages(messages), plan_batches(fresh))
+                planned.update(fresh)
+                added += len(fresh)
+
+        due = outbox.due_batches(broadcast_id)
+        bodies = {key: outbox.body(key) for key in {batch.message_key for batch in due}}
+        if resumed:
+            summary = outbox.summary(broadcast_id)
+            rejected = f"，{summary['rejected']} 位被 LINE 拒絕不再重送" if summary.get("rejected") else ""
+            print(f"♻️ 續傳這次廣播：{summary.get('sent', 0)} 位已送達略過{rejected}，"
+                  f"{len(due)} 個未完成的批次 (含新加入的 {added} 位) 待送")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for round_no in range(retry_rounds + 1):
+                if not due:
+                    break
+                if round_no:
+                    wait = RETRY_BACKOFF * 2 ** (round_no - 1)
+                    if deadline is not None and time.perf_counter() + wait >= deadline:
+                        print(f"⏳ 發送時間預算用完，{len(due)} 個暫時失敗的批次留給下次執行")
+                        break
+                    print(f"🔁 {len(due)} 個批次暫時失敗，{wait:.0f} 秒後重試 (第 {round_no} 輪)")
+                    time.sleep(wait)
+
+                jobs = []
+                for batch in due:
+                    to = batch.recipients if batch.channel == "multicast" else batch.recipients[0]
+                    batch_headers = dict(headers, **{"X-Line-Retry-Key": batch.retry_key})
+                    fut = _submit(pool, _send, batch.channel, urls[batch.channel], batch_headers, to,
+                                  bodies[batch.message_key])
+                    jobs.append((fut, batch))
+
+                retry = []
+                for fut, batch in jobs:
+                    status, error = fut.result()
+                    # 409：這個 retry key 的請求 LINE 已經收過了
+                    ok = status in (200, 409)
+                    outbox.mark(batch.id, ok, status, error)
+                    telemetry.count("line_batches_total", channel=batch.channel, status=status or "error")
+                    telemetry.count("line_recipients_total", len(batch.recipients), channel=batch.channel,
+                                    result="sent" if ok else "failed")
+                    for rid in batch.recipients:
+                        results[rid] = {"ok": ok, "status": status, "error": error, "via": batch.channel}
+                    if not ok and retryable(status):
+                        retry.append(batch)
+                due = retry
+        outbox.prune()
+    finally:
+        if own_outbox:
+            outbox.close()
+
+    return results
@@ -1,22 +1,36 @@
-import requests
-from google import genai
+import functools
 import os
+import queue
 import sys
+import threading
 import time
 from datetime import datetime
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
-
-# 載入 .env 檔案
-load_dotenv()
+import http_client
+import ai_cache
+import ai_json
+import telemetry
+import apod_archive
+import image_derivatives
+from subscribers import get_subscriber_ids
+from line_delivery import deliver_durable, print_delivery_report
+from flex_templates import Template, json_array, slots
+from pipeline import Deadline, StageTimer
 
 # ================= 設定區 =================
 # 從 GitHub Secrets 讀取金鑰，安全又方便
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 NASA_API_KEY = os.environ.get("NASA_API_KEY", "DEMO_KEY")
+# API / 官網位址可以換成代理或本機假伺服器 (benchmarks/bench_e2e.py)；APOD API 位址在 apod_archive.APOD_API_URL
+APOD_WEB_URL = os.environ.get("APOD_WEB_URL", "https://apod.nasa.gov/apod/astropix.html")
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE")
+AI_MODEL = "gemini-3-flash-preview"
+# 主要模型逾時 / 失敗時改用的輕量模型
+AI_FALLBACK_MODEL = os.environ.get("GEMINI_FALLBACK_MODEL", "gemini-2.5-flash-lite")
+# API 幾秒內沒回來就同時啟動爬蟲 (hedged request)
+NASA_HEDGE_DELAY = float(os.environ.get("NASA_HEDGE_DELAY", 3))
+# 爬蟲先拿到結果時，再等 API 幾秒 (API 有真正的 explanation，優先採用)
+NASA_API_GRACE = float(os.environ.get("NASA_API_GRACE", 2))
 
 # Line Bot 設定
 LINE_TOKEN = os.environ.get("LINE_TOKEN")
@@ -26,62 +40,118 @@ LINE_USER_ID = os.environ.get("LINE_USER_ID")
 # --- 功能 1: 嘗試從 API 抓取 (正門) ---
 def get_nasa_from_api():
     print("🚀 嘗試連線 NASA API (正門)...")
-    url = f"https://api.nasa.gov/planetary/apod?api_key={NASA_API_KEY}"
-    
-    # 設定重試策略 (避免網路瞬斷)
-    retry_strategy = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session = requests.Session()
-    session.mount("https://", adapter)
-    
+    url = f"{apod_archive.APOD_API_URL}?api_key={NASA_API_KEY}"
+
+    # 重試策略 (避免網路瞬斷) 由 http_client 統一設定
     try:
-        resp = session.get(url, timeout=10)
+        resp = http_client.get("nasa_api", url)
         if resp.status_code == 200:
             print("✅ API 連線成功！")
-            return resp.json()
+            data = resp.json()
+            data["source"] = "api"  # 只有 API 的資料會寫進典藏
+            return data
     except Exception as e:
         print(f"⚠️ API 連線失敗: {e}")
     return None
 
 # --- 功能 2: 嘗試從網頁爬取 (窗戶 - B計畫) ---
-def get_nasa_from_website():
-    print("🪟 API 失敗，改由爬蟲抓取 NASA 官網 (B計畫)...")
-    url = "https://apod.nasa.gov/apod/astropix.html"
+def get_nasa_from_website(cancel=None):
+    """cancel 是 threading.Event：API 先成功時會被設定，爬蟲就提早放棄"""
+    print("🪟 啟動爬蟲抓取 NASA 官網 (B計畫)...")
+    url = APOD_WEB_URL
     
     try:
-        resp = requests.get(url, timeout=30)
+        resp = http_client.get("nasa_web", url, stream=True)
         if resp.status_code != 200: return None
-        
-        soup = BeautifulSoup(resp.text, "html.parser")
-        
-        # 抓圖片 (通常在 IMG 標籤裡)
-        img_tag = soup.find("img")
-        if not img_tag: return None
-        img_url = "https://apod.nasa.gov/apod/" + img_tag["src"]
-        
-        # 抓標題 (通常在 center > b 裡)
-        title = "NASA Unknown Star"
-        center_tags = soup.find_all("center")
-        if len(center_tags) >= 2:
-            title_tag = center_tags[1].find("b")
-            if title_tag: title = title_tag.text.strip()
+
+        import apod_page  # 只有走 B 計畫才需要 (html.parser)
+
+        # 邊下載邊解析，拿到圖片 / 標題 / 解說就不再讀剩下的頁面；途中被取消就放棄
+        def chunks():
+            for chunk in resp.iter_content(16 * 1024):
+                if cancel is not None and cancel.is_set():
+                    raise InterruptedError
+                yield chunk
+
+        try:
+            data, _ = apod_page.extract(chunks(), resp.encoding or "utf-8", url)
+        except InterruptedError:
+            print("🛑 API 已經先拿到資料，停止爬蟲")
+            return None
+        finally:
+            resp.close()
+        if not data:
+            return None
 
         print("✅ 網頁爬取成功！")
         return {
-            "title": title,
-            "url": img_url,
-            "hdurl": img_url,
-            "explanation": "（從網頁抓取，無原文解釋，請 AI 自由發揮）",
-            "date": time.strftime("%Y-%m-%d"),
-            "media_type": "image"
+            "title": data["title"] or "NASA Unknown Star",
+            "url": data["url"],
+            "hdurl": data["hdurl"],
+            "explanation": data["explanation"] or "（從網頁抓取，無原文解釋，請 AI 自由發揮）",
+            "date": data["date"] or apod_archive.apod_today().isoformat(),
+            "media_type": data["media_type"],
+            "source": "web",
         }
     except Exception as e:
         print(f"❌ 爬蟲也失敗: {e}")
         return None
 
 # --- 功能 3: 呼叫 Gemini (含寬鬆解析) ---
-def get_ai_content_v2(title, explanation):
-    print("🧠 呼叫 gemini-3-flash-preview...")
+_genai_client = None
+
+def _get_genai_client():
+    # Gemini client 只建一次 (長駐模式下跨次重用)
+    global _genai_client
+    if _genai_client is None:
+        from google import genai  # 用到才載入
+        http_options = {"base_url": GEMINI_API_BASE} if GEMINI_API_BASE else None
+        _genai_client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+    return _genai_client
+
+def _generate(model, prompt, schema=None, timeout=None):
+    client = _get_genai_client()
+    # 有 schema 時要求模型直接輸出符合 schema 的 JSON；timeout (秒) 由時間預算決定
+    config = {"response_mime_type": "application/json", "response_schema": schema} if schema else {}
+    if timeout:
+        config["http_options"] = {"timeout": int(timeout * 1000)}
+    with telemetry.span("Gemini", model=model, prompt_chars=len(prompt)) as sp:
+        response = client.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=config or None
+        )
+        sp.set(response_chars=len(response.text or ""))
+    return response.text
+
+CONTENT_SCHEMA = ai_json.obj({
+    "diary": ai_json.string("宇宙日記：第一人稱、50 字內", 50),
+    "knowledge": ai_json.string("天文科普：白話解釋、100 字內", 100),
+})
+
+def template_content(explanation):
+    """AI 時間預算用完時的日記 / 科普：固定的日記 + NASA 原文解說的前幾句"""
+    diary = "今晚的星空很安靜，我把這張照片收進了航行日誌。"
+    if not explanation or "無原文解釋" in explanation:
+        return diary, "暫無資料"
+    excerpt = ""
+    for sentence in explanation.replace("\n", " ").split(". "):
+        if excerpt and len(excerpt) + len(sentence) > 280:
+            break
+        excerpt += sentence.strip() + ". "
+    return diary, f"(AI 暫時離線，以下節錄 NASA 原文解說) {excerpt.strip()}"
+
+def get_ai_content_v2(title, explanation, budget=None):
+    """
+    在 budget (AI 階段的時間預算) 內依序降級：主要模型 → 輕量模型 → 樣板 (節錄原文解說)。
+    上一則內容是別張照片的，不拿來代打。
+    """
+    budget = budget or Deadline().stage("ai")
+    print(f"🧠 呼叫 {AI_MODEL}...")
+    try:
+        _get_genai_client()  # SDK 載入也算在預算裡，先做完再分配各模型的 timeout
+    except Exception as e:
+        print(f"⚠️ Gemini client 建立失敗: {e}")
     
     prompt_context = f"原文解說：{explanation}"
     if "無原文解釋" in explanation:
@@ -91,52 +161,32 @@ def get_ai_content_v2(title, explanation):
     標題：{title}
     {prompt_context}
 
-    請產出兩段內容 (繁體中文)：
-    1. 【宇宙日記】：用第一人稱寫一段短日記(50字內)，描述看到這景象的感性心情，帶點孤獨或浪漫。
-    2. 【天文科普】：用「白話文」簡單解釋這張照片是什麼(星雲?黑洞?彗星?)，以及它有什麼特別之處(100字內)。
-
-    格式：
-    日記：(內容)
-    科普：(內容)
+    請用繁體中文輸出 JSON：
+    - diary【宇宙日記】：用第一人稱寫一段短日記(50字內)，描述看到這景象的感性心情，帶點孤獨或浪漫。
+    - knowledge【天文科普】：用「白話文」簡單解釋這張照片是什麼(星雲?黑洞?彗星?)，以及它有什麼特別之處(100字內)。
     """
     
     try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        response = client.models.generate_content(
-            model="gemini-3-flash-preview", 
-            contents=prompt
-        )
-        text = response.text
-        # print(f"🤖 AI 原始回覆 (Debug):\n{text}")
-        # print("======== (End of AI Response) ========")
-
-        # === 🟢 超強段落解析邏輯 (State Machine) ===
-        diary_lines = []
-        knowledge_lines = []
-        current_mode = None # 目前正在讀取哪個區塊 (diary / knowledge)
-
-        # === 🟢 超強段落解析邏輯 (Regex Version) ===
-        import re
-        
-        # 移除可能的 Markdown 標記 (如 **日記：**, ### 日記)
-        clean_text = re.sub(r'[\*\#]', '', text)
-        
-        diary_match = re.search(r'日記[:：](.*?)(?=科普[:：]|$)', clean_text, re.DOTALL)
-        knowledge_match = re.search(r'科普[:：](.*?)(?=$)', clean_text, re.DOTALL)
-
-        diary = diary_match.group(1).strip() if diary_match else "（AI 正在看著星空發呆...）"
-        knowledge = knowledge_match.group(1).strip() if knowledge_match else "（數據訊號干擾...）"
-        
-        return diary, knowledge
-
+        # 結構化輸出直接 json.loads，格式不符時 ai_json 會請模型修正一次；相同輸入讀快取
+        result, model = ai_json.generate_within([AI_MODEL, AI_FALLBACK_MODEL], prompt, CONTENT_SCHEMA,
+                                                _generate, budget)
+        diary, knowledge = result["diary"].strip(), result["knowledge"].strip()
+        tier = "primary" if model == AI_MODEL else "lighter"
     except Exception as e:
         print(f"⚠️ AI 生成失敗: {e}")
-        return "AI 休息中...", "暫無資料"
+        diary, knowledge = template_content(explanation)
+        tier = "template"
+
+    label = {"primary": f"主要模型 {AI_MODEL}", "lighter": f"輕量模型 {AI_FALLBACK_MODEL}",
+             "template": "樣板 (原文節錄)"}[tier]
+    left = budget.finish(label)
+    telemetry.count("ai_fallback_total", bot="nasa", tier=tier)
+    print(f"🪜 AI 內容來源：{label} (預算剩 {left:.1f}s)")
+    return diary, knowledge
 
 # --- 功能 4: 發送 Discord 卡片 ---
-def send_discord(data, diary, knowledge):
-    print("📡 發送 Discord...")
-    
+def _discord_values(data, diary, knowledge, images=None):
+    """整理 Discord 卡片要用的動態值；有衍生檔時圖片改用附件"""
     date_str = data.get('date', '')
     if len(date_str) >= 10:
         short_date = date_str.replace("-", "")[2:] 
@@ -144,8 +194,25 @@ def send_discord(data, diary, knowledge):
     else:
         perm_link = "https://apod.nasa.gov/apod/astropix.html"
 
+    return {
+        "title": data.get('title'),
+        "perm_link": perm_link,
+        "diary": diary,
+        "knowledge": knowledge,
+        "hd_link": data.get('hdurl', data.get('url')),
+        "image_url": _discord_image_url(data, images),
+        "date": data.get('date'),
+    }
+
+def _discord_image_url(data, images):
+    preview = image_derivatives.for_channel(images, "discord")
+    if preview:
+        return f"attachment://{os.path.basename(preview.path)}"
+    return data.get('url')
+
+def _discord_layout(title, perm_link, diary, knowledge, hd_link, image_url, date):
     embed = {
-        "title": f"🌌 {data.get('title')}",
+        "title": f"🌌 {title}",
         "url": perm_link,
         "description": f"**📖 航行日誌**\n> {diary}", # 使用引用符號
         "color": 3447003, # 深藍色
@@ -157,37 +224,66 @@ def send_discord(data, diary, knowledge):
             },
             {
                 "name": "🔗 相關連結",
-                "value": f"[前往 NASA 官網]({perm_link}) | [下載高畫質原圖]({data.get('hdurl', data.get('url'))})",
+                "value": f"[前往 NASA 官網]({perm_link}) | [下載高畫質原圖]({hd_link})",
                 "inline": False
             }
         ],
         "image": {
-            "url": data.get('url')
+            "url": image_url
         },
         "footer": {
-            "text": f"📅 {data.get('date')} • Powered by NASA & Gemini"
+            "text": f"📅 {date} • Powered by NASA & Gemini"
         }
     }
+    return {"embeds": [embed]}
+
+def build_discord_payload(data, diary, knowledge, images=None):
+    """Discord 卡片的 dict 版本 (預覽、比對用)"""
+    return _discord_layout(**_discord_values(data, diary, knowledge, images))
+
+def render_discord_bytes(data, diary, knowledge, images=None):
+    """用預先編譯的樣板產生 Discord body (和 build_discord_payload 逐 byte 相同)"""
+    return _templates()["discord"].render(**_discord_values(data, diary, knowledge, images))
+
+def send_discord(data, diary, knowledge, images=None):
+    print("📡 發送 Discord...")
+
+    body = render_discord_bytes(data, diary, knowledge, images)
+    preview = image_derivatives.for_channel(images, "discord")
 
     try:
-        requests.post(WEBHOOK_URL, json={"embeds": [embed]})
+        if preview:
+            # 衍生檔當附件一起上傳，embed 用 attachment:// 引用，不必另外架圖床
+            # 先讀成 bytes (不是檔案物件)：遇到 429 重試時才會再送一次完整的附件
+            with open(preview.path, "rb") as f:
+                image = f.read()
+            files = {"files[0]": (os.path.basename(preview.path), image, "image/jpeg")}
+            http_client.post("discord", WEBHOOK_URL, data={"payload_json": body}, files=files)
+        else:
+            http_client.post("discord", WEBHOOK_URL, data=body, headers=http_client.JSON_HEADERS)
         print("✅ Discord 發送成功！")
     except Exception as e:
         print(f"❌ Discord 發送失敗: {e}")
 
-def generate_flex_message(data, diary, knowledge):
-    """產生 NASA 宇宙日報 Flex Message JSON"""
-    
-    # 0. 準備資料
+def _flex_values(data, diary, knowledge, images=None):
+    """整理 Flex Message 要用的動態值；有衍生檔時 hero 用它的網址和實際長寬比"""
     title = data.get('title', 'NASA Unknown Star')
     date = data.get('date', 'Unknown Date')
     image_url = data.get('url')
     hd_url = data.get('hdurl', image_url)
+    hero = image_derivatives.for_channel(images, "line")
+    aspect_ratio = image_derivatives.aspect_ratio(hero.width, hero.height) if hero else "20:13"
+    image_url = image_derivatives.public_url(hero) or image_url
     
     # 確保圖片 URL 是 HTTPS (Flex Message Hero 圖片必須是 HTTPS)
     if not image_url or not image_url.startswith("https"):
         image_url = "https://apod.nasa.gov/apod/calendar/allyears/2024/0101.jpg" # 預設圖
-    
+
+    return {"title": title, "date": date, "image_url": image_url, "aspect_ratio": aspect_ratio,
+            "hd_url": hd_url, "diary": diary, "knowledge": knowledge}
+
+def _flex_layout(title, date, image_url, aspect_ratio, hd_url, diary, knowledge):
+    """Flex Message 版面，固定的部分會被 _templates() 預先編譯"""
     # 1. 標題區塊 (Header)
     header = {
         "type": "box",
@@ -205,7 +301,7 @@ def generate_flex_message(data, diary, knowledge):
         "type": "image",
         "url": image_url,
         "size": "full",
-        "aspectRatio": "20:13",
+        "aspectRatio": aspect_ratio,
         "aspectMode": "cover",
         "action": {
             "type": "uri",
@@ -286,94 +382,247 @@ def generate_flex_message(data, diary, knowledge):
     }
     return flex_message
 
-def send_line_message(data, diary, knowledge):
+def generate_flex_message(data, diary, knowledge, images=None):
+    """產生 NASA 宇宙日報 Flex Message JSON (dict 版本，預覽與比對用)"""
+    return _flex_layout(**_flex_values(data, diary, knowledge, images))
+
+@functools.lru_cache(maxsize=None)
+def _templates():
+    """第一次用到時才編譯樣板，之後整個行程共用"""
+    return {
+        "flex": Template(_flex_layout(**slots("title", "date", "image_url", "aspect_ratio", "hd_url",
+                                                 "diary", "knowledge"))),
+        "discord": Template(_discord_layout(**slots("title", "perm_link", "diary", "knowledge",
+                                                    "hd_link", "image_url", "date"))),
+    }
+
+def render_flex_bytes(data, diary, knowledge, images=None):
+    """用預先編譯的樣板產生 Flex Message JSON bytes (和 generate_flex_message 逐 byte 相同)"""
+    return _templates()["flex"].render(**_flex_values(data, diary, knowledge, images))
+
+def load_line_subscribers():
+    """檢查 LINE 設定並取得訂閱者 (合併 .env 與 GAS API)；不需要發送時回傳空 set"""
     # 檢查 Token 是否存在
     if not LINE_TOKEN:
         print("⚠️ 未設定 LINE_TOKEN，跳過 LINE 發送。")
-        return
+        return set()
 
     # 檢查是否有 User ID 或 API URL
     subscriber_api_url = os.getenv("SUBSCRIBER_API_URL")
     if not LINE_USER_ID and not subscriber_api_url:
         print("⚠️ 未設定 LINE_USER_ID 且無 SUBSCRIBER_API_URL，跳過 LINE 發送。")
-        return
+        return set()
+
+    user_ids = get_subscriber_ids(LINE_USER_ID, subscriber_api_url)
+    if not user_ids:
+        print("⚠️ 無任何訂閱者 ID (LINE_USER_ID 未設定且 API 無回傳)")
+    return user_ids
 
+def deliver_line_message(data, diary, knowledge, user_ids, images=None, deadline=None):
     print("🚀 正在發送 Line Flex Message...")
+    deadline = deadline or Deadline()
     
-    # 產生 Flex Message payload
-    flex_payload = generate_flex_message(data, diary, knowledge)
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_TOKEN}"
-    }
-
-    payload = {
-        "to": "", # 會在迴圈中設定
-        "messages": [flex_payload]
-    }
+    # 產生 Flex Message payload (只序列化一次)
+    render_budget = deadline.stage("render")
+    with telemetry.span("渲染卡片") as sp:
+        flex_payload = render_flex_bytes(data, diary, knowledge, images)
+        sp.set(bytes=len(flex_payload))
+    render_budget.finish()
+
+    # 使用者走 multicast 批次、群組/聊天室走 push，平行發送
+    # 狀態記在 outbox：同一天重新執行只會補送上次沒送達的批次；超過發送預算的重試也留到下次
+    deliver_budget = deadline.stage("deliver")
+    results = deliver_durable([(json_array([flex_payload]), user_ids)], LINE_TOKEN, f"nasa:{data.get('date')}",
+                              deadline=deliver_budget.expires_at())
+    deliver_budget.finish()
+    print_delivery_report(results)
 
-    # 支援發送給多個使用者或群組 (以逗號分隔)
-    # 取得訂閱者列表 (合併 .env 與 GAS API)
-    user_ids = set()
-    
-    # 1. 從 .env 讀取
-    if LINE_USER_ID:
-        for uid in LINE_USER_ID.split(","):
-            if uid.strip():
-                user_ids.add(uid.strip())
+def send_line_message(data, diary, knowledge):
+    user_ids = load_line_subscribers()
+    if user_ids:
+        deliver_line_message(data, diary, knowledge, user_ids)
 
-    # 2. 從 GAS API 讀取 (自動訂閱)
-    subscriber_api_url = os.getenv("SUBSCRIBER_API_URL")
-    if subscriber_api_url:
+def hedged_fetch(api_fn, web_fn, delay=None, grace=None, budget=None):
+    """
+    先打 API，delay 秒內沒有結果就同時啟動爬蟲：
+    - API 先拿到有效資料 → 採用 API，通知爬蟲取消
+    - 爬蟲先拿到 → 再等 API 最多 grace 秒 (API 有原文 explanation)，等不到才採用爬蟲
+    - budget (抓資料階段的時間預算) 用完就不再等，有什麼用什麼
+    回傳 (資料或 None, {"winner": ..., "api_s": ..., "web_s": ..., "web_started": bool})
+
+    用 daemon thread 而不是 ThreadPoolExecutor：輸掉的 API 請求可能還卡在重試，
+    不能讓它拖住行程結束。
+    """
+    delay = NASA_HEDGE_DELAY if delay is None else delay
+    grace = NASA_API_GRACE if grace is None else grace
+    results = queue.Queue()
+    cancel = threading.Event()
+    t0 = time.perf_counter()
+    report = {"winner": None, "api_s": None, "web_s": None}
+
+    def worker(name, fn, *args):
         try:
-            print(f"📡 正在從 GAS API 取得訂閱者列表...")
-            resp = requests.get(subscriber_api_url)
-            if resp.status_code == 200:
-                api_ids = resp.json()
-                print(f"✅ 取得 {len(api_ids)} 個訂閱者: {api_ids}")
-                for uid in api_ids:
-                    user_ids.add(uid)
-            else:
-                print(f"⚠️ GAS API 回傳錯誤: {resp.status_code}")
+            data = fn(*args)
         except Exception as e:
-            print(f"⚠️ 讀取訂閱者 API 失敗: {e}")
-    
-    if not user_ids:
-        print("⚠️ 無任何訂閱者 ID (LINE_USER_ID 未設定且 API 無回傳)")
-        return
-
-    for uid in user_ids:
-        payload["to"] = uid
+            print(f"⚠️ {name} 例外: {e}")
+            data = None
+        results.put((name, data, time.perf_counter() - t0))
+
+    def start(name, fn, *args):
+        threading.Thread(target=worker, args=(name, fn) + args, name=f"nasa-{name}", daemon=True).start()
+
+    start("api", api_fn)
+    started, finished, got = {"api"}, set(), {}
+    deadline = None  # 爬蟲先到時，等 API 的截止時間
+
+    while started - finished:
+        if deadline is not None:
+            timeout = max(deadline - time.perf_counter(), 0)
+        elif "web" not in started:
+            timeout = max(delay - (time.perf_counter() - t0), 0)
+        else:
+            timeout = None
+        if budget is not None:
+            left = budget.remaining()
+            timeout = left if timeout is None else min(timeout, left)
         try:
-            response = requests.post("https://api.line.me/v2/bot/message/push", headers=headers, json=payload)
-            if response.status_code == 200:
-                print(f"✅ Line 發送成功！(Target: {uid})")
-            else:
-                print(f"❌ Line 發送失敗 (Target: {uid}): {response.status_code} {response.text}")
-        except Exception as e:
-            print(f"❌ Line 發送例外 (Target: {uid}): {e}")
+            name, data, elapsed = results.get(timeout=timeout)
+        except queue.Empty:
+            if budget is not None and budget.expired():
+                print("⏳ 抓資料的時間預算用完，不再等待")
+                break
+            if deadline is not None:
+                break  # API 等不到了，用爬蟲的結果
+            print(f"⏳ API {delay:g} 秒內沒有回應，同時啟動爬蟲")
+            start("web", web_fn, cancel)
+            started.add("web")
+            continue
+
+        finished.add(name)
+        report[f"{name}_s"] = round(elapsed, 3)
+        if data:
+            got[name] = data
+            if name == "api":
+                break
+            deadline = time.perf_counter() + grace
+        elif name == "api" and "web" not in started:
+            # API 直接失敗，不用等 delay，馬上啟動爬蟲
+            start("web", web_fn, cancel)
+            started.add("web")
+
+    cancel.set()
+    report["winner"] = "api" if "api" in got else ("web" if "web" in got else None)
+    report["web_started"] = "web" in started
+    return got.get(report["winner"]), report
+
+def fetch_nasa_data(budget=None):
+    data, report = hedged_fetch(get_nasa_from_api, get_nasa_from_website, budget=budget)
+
+    def latency(name):
+        if name == "web" and not report["web_started"]:
+            return "未啟動"
+        if report[name + "_s"] is None:
+            return "已取消" if name == "web" else "未完成"
+        return f"{report[name + '_s']:.2f}s"
+
+    winner = {"api": "API", "web": "爬蟲"}.get(report["winner"], "無")
+    print(f"🏁 NASA 資料來源：{winner} (API {latency('api')} / 爬蟲 {latency('web')})")
+    return data
+
+def find_substitute(nasa_data):
+    """影片日從本機典藏找往年同一天的圖片代打 (典藏沒建就回傳 None)"""
+    try:
+        with apod_archive.ApodArchive() as archive:
+            sub = archive.substitute_for(nasa_data["date"])
+    except Exception as e:
+        print(f"⚠️ 讀取 APOD 典藏失敗: {e}")
+        return None
+    if sub:
+        print(f"🗂️ 今天是影片，改用典藏裡 {sub['date']} 的「{sub['title']}」")
+    return sub
 
-if __name__ == "__main__":
-    if not WEBHOOK_URL or not GEMINI_API_KEY:
-        print("❌ 錯誤：請檢查 GitHub Secrets 是否設定正確")
-        sys.exit(1)
+def update_archive(nasa_data, budget=None):
+    """把今天的資料寫進典藏，漏掉的日子順便補抓 (budget 用完就留給下次)；失敗不影響發送"""
+    try:
+        apod_archive.update_from_today(NASA_API_KEY, nasa_data, deadline=budget.expires_at() if budget else None)
+    except Exception as e:
+        print(f"⚠️ 更新 APOD 典藏失敗: {e}")
+    if budget:
+        budget.finish()
 
-    # 1. 先試 API，不行就試爬蟲
-    nasa_data = get_nasa_from_api()
+async def run_pipeline(timer, deadline):
+    """
+    訂閱者同步和 NASA 資料、AI 寫作重疊；Discord 與 LINE 同時發送。回傳 exit code
+    抓資料、AI 寫作受 deadline 的時間預算限制 (逾時就降級)，發送一定會準時開始。
+    """
+    import asyncio  # 延遲載入，只 render 卡片的指令不必付這個成本
+
+    subscribers_task = asyncio.create_task(timer.run("訂閱者同步", load_line_subscribers))
+
+    # 1. 先試 API，太慢或失敗就同時跑爬蟲
+    fetch_budget = deadline.stage("fetch")
+    nasa_data = await timer.run("NASA 資料", fetch_nasa_data, fetch_budget)
+    fetch_budget.finish()
     if not nasa_data:
-        nasa_data = get_nasa_from_website()
-    
-    # 2. 如果有拿到資料，就叫 AI寫作並發送
-    if nasa_data:
-        # 檢查是不是圖片 (影片無法顯示在 Embed image)
-        if "image" in nasa_data.get('media_type', 'image'):
-            d, k = get_ai_content_v2(nasa_data['title'], nasa_data.get('explanation', '無原文解釋'))
-            if WEBHOOK_URL:
-                send_discord(nasa_data, d, k)
-            send_line_message(nasa_data, d, k)
-        else:
-            print(f"⚠️ 今天 NASA 給的是影片，跳過不發圖。")
-    else:
         print("❌ 最終嘗試失敗：NASA API 和 官網都無法讀取。")
-        sys.exit(1)
+        await subscribers_task
+        return 1
+
+    # 典藏更新 (寫今天的資料、補漏掉的日子) 和後面的階段重疊
+    archive_task = asyncio.create_task(timer.run("APOD 典藏", update_archive, nasa_data, deadline.stage("archive")))
+
+    # 2. 檢查是不是圖片 (影片無法顯示在 Embed image)，是影片就從典藏找代打
+    if "image" not in nasa_data.get('media_type', 'image'):
+        substitute = find_substitute(nasa_data)
+        if not substitute:
+            print(f"⚠️ 今天 NASA 給的是影片，典藏裡也沒有可代打的圖片，跳過不發圖。")
+            await asyncio.gather(subscribers_task, archive_task)
+            return 0
+        nasa_data = substitute
+
+    # 3. 圖片衍生檔和 AI 寫作同時進行，都好了再發送
+    cancel_images = threading.Event()
+    images_task = asyncio.create_task(timer.run(
+        "圖片處理", functools.partial(image_derivatives.prepare_images, cancel=cancel_images), nasa_data.get('url')))
+    d, k = await timer.run("AI 寫作", get_ai_content_v2, nasa_data['title'],
+                           nasa_data.get('explanation', '無原文解釋'), deadline.stage("ai"))
+    # 衍生檔最多等到渲染預算用完，來不及就先用原圖網址發送，並叫執行緒停下 (不拖住行程結束)
+    done, _ = await asyncio.wait({images_task}, timeout=deadline.stage("render").remaining())
+    images = images_task.result() if done else None
+    if not done:
+        cancel_images.set()
+        print("⏳ 圖片衍生檔來不及，這次先用原圖")
+    deliveries = []
+    if WEBHOOK_URL:
+        # Discord 不用等訂閱者同步，先開始送
+        deliveries.append(asyncio.create_task(timer.run("Discord", send_discord, nasa_data, d, k, images)))
+    user_ids = await subscribers_task
+    if user_ids:
+        deliveries.append(timer.run("LINE", deliver_line_message, nasa_data, d, k, user_ids, images, deadline))
+    await asyncio.gather(*deliveries, archive_task)
+    return 0
+
+def main():
+    # 設定 (WEBHOOK_URL、GEMINI_API_KEY) 由 taiwanbot.py 在執行前檢查
+    import asyncio
+
+    if LINE_TOKEN:
+        image_derivatives.warn_if_unpublished()
+    timer = StageTimer()
+    deadline = Deadline()
+    with telemetry.span("nasa") as sp:
+        code = asyncio.run(run_pipeline(timer, deadline))
+        sp.set(exit_code=code)
+    timer.print_report()
+    deadline.print_report()
+    telemetry.flush()
+    if code:
+        return code
+    http_client.print_stats()
+    ai_cache.print_stats()
+    return 0
+
+if __name__ == "__main__":
+    # 相容舊的 `python nasa_bot.py`，實際交給統一指令處理 (.env 載入、設定檢查)
+    from taiwanbot import main as cli_main
+    sys.exit(cli_main(["nasa"]))
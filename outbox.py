@@ -0,0 +1,187 @@
+"""LINE 發送 outbox (SQLite，OUTBOX_DB 預設 .cache/outbox.db)
+
+每次廣播 (broadcast_id，例如 weather:<時段>) 第一次發給某個收件者前，先把收件者切好批次寫進資料庫：
+- messages：訊息內容 (message_key = 廣播 ID + 內容的雜湊)，續傳時重送的是這裡存的內容
+- batches：一個 multicast (最多 500 人) 或一個 push 請求，各自有固定的 X-Line-Retry-Key
+- deliveries：(broadcast_id, recipient) → 所屬批次，送達狀態看批次
+
+收件者是否已排程只看 broadcast_id，和內容無關：重新執行時內容就算不同
+(AI 改用備援模型、測站氣溫更新、趨勢標示)，已排程的人也不會再收到第二份；
+行程中途掛掉或 LINE 回 5xx 時，重新執行只會撈出還沒送達的批次，用原本的內容和同一個 retry key 重送，
+LINE 若已經收過會回 409，視為已送達。兩次執行之間新加入的訂閱者另外切成新批次。
+
+批次狀態：pending (還沒送) → sent / failed (429、5xx、連線失敗，下次再送) /
+rejected (409、429 以外的 4xx，例如無效的 ID、被封鎖；重送也不會成功，不再重試)。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import namedtuple
+
+DB_PATH = os.environ.get("OUTBOX_DB", os.path.join(".cache", "outbox.db"))
+# 超過這個天數的訊息紀錄會被清掉 (LINE 的 retry key 也只保證 24 小時內有效)
+RETENTION_DAYS = 7
+# 資料表結構版本 (PRAGMA user_version)；舊版 (deliveries 以訊息內容區分) 的紀錄直接捨棄
+SCHEMA_VERSION = 2
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+REJECTED = "rejected"
+
+Batch = namedtuple("Batch", "id message_key channel recipients retry_key attempts")
+
+
+def message_key(broadcast_id, messages_json):
+    """同一次廣播、同樣內容的訊息 → 同一個 key"""
+    digest = hashlib.sha256(broadcast_id.encode("utf-8") + b"\0" + messages_json)
+    return digest.hexdigest()[:32]
+
+
+class Outbox:
+    def __init__(self, path=DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        # 每個批次送完就 commit 一次 (特報一次可能上千則不同內容)：
+        # WAL + synchronous=NORMAL 讓 commit 不必每次 fsync，斷電最多遺失最後幾筆狀態，
+        # 重送時靠 retry key 得到 409，不會重複發送
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS deliveries;
+                DROP TABLE IF EXISTS batches;
+                DROP TABLE IF EXISTS messages;
+            """)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                key TEXT PRIMARY KEY,
+                broadcast_id TEXT NOT NULL,
+                body BLOB NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY,
+                broadcast_id TEXT NOT NULL,
+                message_key TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                recipients TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                retry_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_status INTEGER,
+                last_error TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS batches_by_status ON batches (broadcast_id, status);
+            CREATE TABLE IF NOT EXISTS deliveries (
+                broadcast_id TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                batch_id INTEGER NOT NULL,
+                PRIMARY KEY (broadcast_id, recipient)
+            ) WITHOUT ROWID;
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def planned(self, broadcast_id):
+        """這次廣播已經排進批次的收件者 (不管當時的內容)"""
+        rows = self.conn.execute("SELECT recipient FROM deliveries WHERE broadcast_id = ?", (broadcast_id,))
+        return {r[0] for r in rows}
+
+    def enqueue(self, broadcast_id, messages_json, batches):
+        """
+        batches 是 [(channel, [recipient, ...]), ...]，收件者應該是 planned() 以外的人
+        (已經排程的收件者會被略過，不會換成新內容)。回傳 message_key。
+        """
+        key = message_key(broadcast_id, messages_json)
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO messages (key, broadcast_id, body, created_at) VALUES (?, ?, ?, ?)",
+                (key, broadcast_id, messages_json, now),
+            )
+            for channel, recipients in batches:
+                cur = self.conn.execute(
+                    "INSERT INTO batches (broadcast_id, message_key, channel, recipients, size, retry_key, status,"
+                    " updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (broadcast_id, key, channel, json.dumps(recipients), len(recipients), str(uuid.uuid4()),
+                     PENDING, now),
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO deliveries (broadcast_id, recipient, batch_id) VALUES (?, ?, ?)",
+                    ((broadcast_id, rid, cur.lastrowid) for rid in recipients),
+                )
+        return key
+
+    def body(self, key):
+        return self.conn.execute("SELECT body FROM messages WHERE key = ?", (key,)).fetchone()[0]
+
+    def due_batches(self, broadcast_id):
+        """
+        這次廣播還要送的批次：pending，以及暫時失敗 (429 / 5xx / 連線失敗) 的 failed。
+        舊版把 4xx 也記成 failed，這裡一併依 last_status 排除
+        """
+        rows = self.conn.execute(
+            "SELECT id, message_key, channel, recipients, retry_key, attempts FROM batches"
+            " WHERE broadcast_id = ? AND (status = ? OR (status = ? AND"
+            " (last_status IS NULL OR last_status = 429 OR last_status >= 500))) ORDER BY id",
+            (broadcast_id, PENDING, FAILED),
+        )
+        return [Batch(r[0], r[1], r[2], json.loads(r[3]), r[4], r[5]) for r in rows]
+
+    def mark(self, batch_id, ok, status=None, error=None):
+        """記下一次發送的結果；失敗時依 HTTP 狀態碼分成 failed (會重試) 和 rejected (不再重試)"""
+        if ok:
+            state = SENT
+        elif status is not None and 400 <= status < 500 and status != 429:
+            state = REJECTED
+        else:
+            state = FAILED
+        with self.conn:
+            self.conn.execute(
+                "UPDATE batches SET status = ?, attempts = attempts + 1, last_status = ?, last_error = ?,"
+                " updated_at = ? WHERE id = ?",
+                (state, status, error, time.time(), batch_id),
+            )
+
+    def delivery_status(self, broadcast_id, recipient):
+        """某個收件者在這次廣播的送達狀態 (pending / sent / failed / rejected，沒有紀錄回傳 None)"""
+        row = self.conn.execute(
+            "SELECT b.status FROM deliveries d JOIN batches b ON b.id = d.batch_id"
+            " WHERE d.broadcast_id = ? AND d.recipient = ?",
+            (broadcast_id, recipient),
+        ).fetchone()
+        return row[0] if row else None
+
+    def summary(self, broadcast_id):
+        """{狀態: 收件者數}"""
+        return dict(self.conn.execute(
+            "SELECT status, SUM(size) FROM batches WHERE broadcast_id = ? GROUP BY status", (broadcast_id,)
+        ).fetchall())
+
+    def prune(self, retention_days=RETENTION_DAYS):
+        """清掉太舊的廣播紀錄"""
+        cutoff = time.time() - retention_days * 86400
+        old = [r[0] for r in self.conn.execute(
+            "SELECT broadcast_id FROM messages GROUP BY broadcast_id HAVING MAX(created_at) < ?", (cutoff,)
+        )]
+        if not old:
+            return 0
+        with self.conn:
+            for table in ("deliveries", "batches", "messages"):
+                self.conn.executemany(f"DELETE FROM {table} WHERE broadcast_id = ?", ((b,) for b in old))
+        return len(old)
@@ -0,0 +1,128 @@
+"""兩支機器人共用的非同步流程工具
+
+各階段本身還是同步程式 (requests、google-genai、sqlite3)，用 asyncio.to_thread 丟到執行緒，
+彼此沒有相依的階段就能重疊：訂閱者同步和抓資料 / AI 一起跑、Discord 和 LINE 同時發送。
+StageTimer 記錄每個階段的開始 / 結束時間，最後印出關鍵路徑縮短了多少；
+每個階段同時是一個 telemetry span，階段裡的 HTTP 請求會掛在它底下。
+asyncio 載入要幾十毫秒，等真的執行流程時才載入。
+
+Deadline 是整次執行的時間預算：抓資料 / AI / 渲染 / 發送各有上限 (從該階段開始算)，
+RUN_DEADLINE 再限制整次執行。執行緒沒辦法從外面中斷，所以預算是「協作式」的：
+各階段把 Budget.remaining() 換成 HTTP / Gemini 的 timeout、退避前先檢查，
+時間到就走備援 (AI 降級、重試留給下次)，後面的階段就能準時開始。
+"""
+import math
+import os
+import time
+
+import telemetry
+
+# 各階段的時間預算 (秒)
+STAGE_BUDGETS = {
+    "fetch": float(os.environ.get("BUDGET_FETCH", 30)),
+    "ai": float(os.environ.get("BUDGET_AI", 40)),
+    "render": float(os.environ.get("BUDGET_RENDER", 10)),
+    "deliver": float(os.environ.get("BUDGET_DELIVER", 300)),
+    # NASA 機器人補抓漏掉的典藏 (和 AI / 發送重疊，用完就留給下次)
+    "archive": float(os.environ.get("BUDGET_ARCHIVE", 60)),
+}
+# 整次執行的上限 (秒)，0 代表只看各階段預算
+RUN_DEADLINE = float(os.environ.get("RUN_DEADLINE", 0))
+
+
+class StageTimer:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages = {}  # 名稱 → (開始秒數, 結束秒數)，都相對於 t0
+
+    async def run(self, name, func, *args):
+        """在執行緒裡執行 func(*args)，記錄這個階段的時間"""
+        import asyncio
+
+        def traced():
+            with telemetry.span(name):
+                return func(*args)
+
+        start = time.perf_counter() - self.t0
+        try:
+            return await asyncio.to_thread(traced)
+        finally:
+            self.stages[name] = (start, time.perf_counter() - self.t0)
+
+    def wall_time(self):
+        return time.perf_counter() - self.t0
+
+    def summary(self):
+        """{"wall_s": 實際總時間, "serial_s": 各階段依序執行的總和, "stages": {名稱: {...}}}"""
+        stages = {
+            name: {"start_s": round(start, 3), "end_s": round(end, 3), "duration_s": round(end - start, 3)}
+            for name, (start, end) in sorted(self.stages.items(), key=lambda item: item[1][0])
+        }
+        return {
+            "wall_s": round(self.wall_time(), 3),
+            "serial_s": round(sum(end - start for start, end in self.stages.values()), 3),
+            "stages": stages,
+        }
+
+    def print_report(self):
+        s = self.summary()
+        print("⏱️ 各階段耗時：")
+        for name, st in s["stages"].items():
+            print(f"   {name}: {st['start_s']:.2f}s → {st['end_s']:.2f}s ({st['duration_s']:.2f}s)")
+        print(f"⏱️ 總時間 {s['wall_s']:.2f}s (各階段依序執行需 {s['serial_s']:.2f}s)")
+
+
+class Budget:
+    """一個階段的時間預算，建立時開始計時 (在階段開始前才用 Deadline.stage() 取得)"""
+
+    def __init__(self, deadline, stage, seconds):
+        self.deadline = deadline
+        self.stage = stage
+        self.seconds = seconds
+        self.start = time.perf_counter()
+        self.end = None
+        self.note = None
+
+    def expires_at(self):
+        """perf_counter 的截止時間 (階段上限和整次執行上限取較早者)"""
+        return min(self.start + self.seconds, self.deadline.run_expires_at)
+
+    def remaining(self):
+        return max(self.expires_at() - time.perf_counter(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def finish(self, note=None):
+        """階段結束，回傳剩餘秒數；note 記錄這個階段怎麼完成的 (例如 AI 用了哪一層備援)"""
+        self.end = time.perf_counter()
+        if note:
+            self.note = note
+        left = self.start + self.seconds - self.end
+        telemetry.gauge("stage_budget_remaining_seconds", round(left, 3), stage=self.stage)
+        return left
+
+
+class Deadline:
+    def __init__(self, budgets=None, run_deadline=None):
+        self.t0 = time.perf_counter()
+        self.budgets = dict(STAGE_BUDGETS, **(budgets or {}))
+        run_deadline = RUN_DEADLINE if run_deadline is None else run_deadline
+        self.run_expires_at = self.t0 + run_deadline if run_deadline else math.inf
+        self.stages = {}
+
+    def stage(self, name):
+        """取得 (或建立) 某個階段的 Budget"""
+        if name not in self.stages:
+            self.stages[name] = Budget(self, name, self.budgets[name])
+        return self.stages[name]
+
+    def print_report(self):
+        print("⏳ 時間預算：")
+        for name, b in self.stages.items():
+            used = (b.end or time.perf_counter()) - b.start
+            status = "✅" if used <= b.seconds else "⚠️ 超時"
+            note = f"，{b.note}" if b.note else ""
+            print(f"   {name}: 用了 {used:.2f}s / {b.seconds:g}s (剩 {b.seconds - used:.2f}s) {status}{note}")
+        if self.run_expires_at != math.inf:
+            print(f"   整次執行剩 {self.run_expires_at - time.perf_counter():.2f}s")
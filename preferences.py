@@ -0,0 +1,78 @@
+"""訂閱者的縣市偏好
+
+偏好檔 (SUBSCRIBER_PREFS_FILE，預設 subscriber_prefs.json) 格式：
+    {
+        "Cxxxxxxxx": ["北部地區"],
+        "Uyyyyyyyy": ["臺北市", "花蓮縣"]
+    }
+可以填縣市名或 REGION_MAP 的區域名 (會展開成該區所有縣市)。
+沒有設定、或全部填錯的訂閱者視為「全部縣市」。
+
+想在卡片上看到「附近測站的即時氣溫」的訂閱者，改用物件並加上座標 (WGS84 緯度, 經度)：
+    "Uzzzzzzzz": {"cities": ["臺北市"], "location": [25.0375, 121.5637]}
+"""
+import json
+import os
+
+from regions import COUNTY_TO_REGION, REGION_MAP
+
+PREFS_FILE = os.environ.get("SUBSCRIBER_PREFS_FILE", "subscriber_prefs.json")
+
+# 「全部縣市」用 None 表示，渲染時不做篩選 (跟原本的全台卡片一模一樣)
+ALL_CITIES = None
+
+
+def normalize_selection(items):
+    """把縣市 / 區域名稱整理成 frozenset；空的或無效的回傳 ALL_CITIES"""
+    cities = set()
+    for item in items or []:
+        item = item.strip()
+        if item in REGION_MAP:
+            cities.update(REGION_MAP[item])
+        elif item in COUNTY_TO_REGION:
+            cities.add(item)
+    if not cities or len(cities) == len(COUNTY_TO_REGION):
+        return ALL_CITIES
+    return frozenset(cities)
+
+
+def _read(path):
+    try:
+        with open(path or PREFS_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 偏好檔讀取失敗，全部訂閱者改收全台卡片: {e}")
+        return {}
+
+
+def load_preferences(path=None):
+    """讀取偏好檔，回傳 {subscriber_id: frozenset(縣市) 或 ALL_CITIES}"""
+    return {
+        sid: normalize_selection(entry.get("cities") if isinstance(entry, dict) else entry)
+        for sid, entry in _read(path).items()
+    }
+
+
+def load_locations(path=None):
+    """讀取偏好檔裡有填座標的訂閱者，回傳 {subscriber_id: (緯度, 經度)}；格式不對的略過"""
+    locations = {}
+    for sid, entry in _read(path).items():
+        if not isinstance(entry, dict):
+            continue
+        try:
+            lat, lon = (float(v) for v in entry["location"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            locations[sid] = (lat, lon)
+    return locations
+
+
+def group_by_preference(subscriber_ids, prefs):
+    """依偏好分組：{frozenset(縣市) 或 ALL_CITIES: [subscriber_id, ...]}"""
+    groups = {}
+    for sid in subscriber_ids:
+        groups.setdefault(prefs.get(sid, ALL_CITIES), []).append(sid)
+    return groups
@@ -0,0 +1,231 @@
+"""發送端的速率限制 (LINE / Discord 共用)
+
+http_client 對有設定限制的 endpoint，每個 (endpoint, URL path) 各用一個 token bucket：
+- 送出前先拿 token，拿不到就等 (等待中的請求數 = queue depth)
+- 從回應學習限制：Discord 的 X-RateLimit-Limit / Remaining / Reset-After。
+  學到之後改用時間窗計數：token 就是最新時間窗的 Remaining，Reset-After 到了一次補滿
+  (不必等到有人看到 Remaining=0)；比目前時間窗舊的回應 (並行請求晚到的) 不會拿來扣 token
+- 429：依 Retry-After (或 Discord JSON 的 retry_after) 暫停整個 bucket；
+  沒有標頭可學的 (LINE) 則下修上限、速率減半，之後每次成功慢慢加回上限 (AIMD)
+- stats() 回報每個 bucket 的等待數、實際送出速率、429 次數
+
+RATE_LIMIT=0 可以關掉 (效能測試比較用)。
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+ENABLED = os.environ.get("RATE_LIMIT", "1") != "0"
+
+# endpoint → (每秒請求數, 突發上限)
+# 伺服器多半用固定時間窗計數，任一秒內最多可能送出「速率 + 突發」個，兩者加起來不超過上限才不會被擋
+# LINE：multicast 200 req/s (push 較寬鬆，統一用較嚴格的值)
+# Discord webhook：每個 webhook 約 2 秒 5 次，實際值會從回應標頭學習
+RATE_LIMITS = {
+    "line_push": (180.0, 10),
+    "line_multicast": (180.0, 10),
+    "discord": (2.5, 5),
+}
+
+# 被 429 擋下時，同一個請求最多重送幾次 (429 代表請求沒被處理，重送是安全的)
+MAX_429_RETRIES = 5
+# 沒有 Retry-After 時的預設暫停秒數
+DEFAULT_RETRY_AFTER = 1.0
+
+
+def _float_header(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.configured = rate
+        self.ceiling = rate        # 設定 (或學到) 的上限
+        self.rate = rate           # 目前使用的速率 (429 後會暫時降低)
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.window = None         # 從 Reset-After 學到的時間窗
+        self.window_end = None     # 最新時間窗重置的時間 (monotonic)；有值代表改用時間窗計數
+        self.refilled = False      # 這個時間窗重置後是否已經補滿
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        # 統計
+        self.waiting = 0
+        self.sent = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.first_sent = None
+        self.last_sent = None
+
+    def _refill(self, now):
+        if self.window_end is not None:
+            # 時間窗計數：窗內不補充，重置時一次補滿
+            if not self.refilled and now >= self.window_end:
+                self.tokens = float(self.capacity)
+                self.refilled = True
+            self.updated = now
+            return
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def acquire(self):
+        """拿一個 token，拿不到就等；暫停、補滿、速率改變時會叫醒等待中的請求重新計算"""
+        start = time.monotonic()
+        with self.cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now >= self.blocked_until and self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    if self.window_end is not None and not self.refilled:
+                        wait = max(self.blocked_until, self.window_end) - now
+                    else:
+                        wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+                    self.cond.wait(wait)
+            finally:
+                self.waiting -= 1
+            now = time.monotonic()
+            self.sent += 1
+            self.wait_seconds += now - start
+            if self.first_sent is None:
+                self.first_sent = now
+            self.last_sent = now
+
+    def pause(self, seconds):
+        """暫停整個 bucket (429)，暫停期間不累積 token"""
+        with self.cond:
+            until = time.monotonic() + seconds
+            if until > self.blocked_until:
+                self.blocked_until = until
+            self.tokens = 0.0
+            self.updated = max(self.updated, self.blocked_until)
+            self.cond.notify_all()
+
+    def observe(self, response):
+        """從回應學習限制；回傳 True 代表被 429 擋下、應該重送"""
+        headers = response.headers
+        limit = _float_header(headers, "X-RateLimit-Limit")
+        remaining = _float_header(headers, "X-RateLimit-Remaining")
+        reset_after = _float_header(headers, "X-RateLimit-Reset-After")
+
+        if limit and reset_after is not None:
+            with self.lock:
+                if remaining is not None and remaining >= limit - 1:
+                    # 時間窗的第一個請求：Reset-After 就是完整的時間窗長度
+                    self.window = reset_after
+                if self.window:
+                    self.ceiling = self.rate = limit / self.window
+                self.capacity = limit
+                self._observe_window(time.monotonic() + reset_after, remaining)
+                self.cond.notify_all()
+
+        if response.status_code != 429:
+            if limit is None:
+                with self.lock:
+                    # 沒有標頭可學：慢慢把速率加回上限
+                    self.rate = min(self.ceiling, self.rate + self.ceiling / 1000)
+            return False
+
+        with self.lock:
+            self.throttled += 1
+        retry_after = _float_header(headers, "Retry-After")
+        if retry_after is None:
+            try:
+                retry_after = float(response.json().get("retry_after"))
+            except Exception:
+                retry_after = None
+        if limit is None:
+            with self.lock:
+                # 沒有標頭：在這個速率被擋，上限往下修，目前速率減半後再慢慢加回去
+                floor = self.configured / 50
+                self.ceiling = max(self.rate * 0.9, floor)
+                self.rate = max(self.rate / 2, floor)
+        self.pause(retry_after if retry_after is not None else DEFAULT_RETRY_AFTER)
+        return True
+
+    def _observe_window(self, end, remaining):
+        """
+        依回應的重置時間 end 判斷它屬於哪個時間窗 (呼叫端持有 lock)：
+        - 比目前的晚超過半個時間窗：新的時間窗，之後以它為準
+        - 同一個時間窗、而且還沒重置：Remaining 可以往下修 token
+        - 其他 (舊時間窗晚到的回應)：忽略
+        """
+        tolerance = (self.window or max(end - time.monotonic(), 0.0)) / 2
+        if self.window_end is None or end > self.window_end + tolerance:
+            self.window_end = end
+            self.refilled = False
+        elif self.refilled or end < self.window_end - tolerance:
+            return
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining)
+
+    def stats(self):
+        with self.lock:
+            span = (self.last_sent - self.first_sent) if self.sent > 1 else 0
+            return {
+                "limit_rps": round(self.ceiling, 2),
+                "configured_rps": round(self.configured, 2),
+                "current_rps": round(self.rate, 2),
+                "queue_depth": self.waiting,
+                "sent": self.sent,
+                "achieved_rps": round((self.sent - 1) / span, 2) if span > 0 else None,
+                "throttled_429": self.throttled,
+                "wait_s": round(self.wait_seconds, 2),
+            }
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _display_name(endpoint, path):
+    # Discord webhook 的 path 含 token，印出來前遮掉長的片段
+    parts = ["***" if len(part) > 24 else part for part in path.split("/")]
+    return f"{endpoint}:{'/'.join(parts)}"
+
+
+def bucket_for(endpoint, url):
+    """沒有設定限制 (或已關閉) 的 endpoint 回傳 None"""
+    if not ENABLED or endpoint not in RATE_LIMITS:
+        return None
+    key = (endpoint, urlsplit(url).path)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                rate, burst = RATE_LIMITS[endpoint]
+                bucket = _buckets[key] = TokenBucket(_display_name(*key), rate, burst)
+    return bucket
+
+
+def stats():
+    """{bucket 名稱: 統計}"""
+    with _buckets_lock:
+        buckets = list(_buckets.values())
+    return {b.name: b.stats() for b in buckets}
+
+
+def print_stats():
+    for name, s in stats().items():
+        achieved = f"{s['achieved_rps']}/s" if s["achieved_rps"] is not None else "-"
+        print(f"🚦 {name}: 送出 {s['sent']} (實際 {achieved}，上限 {s['limit_rps']}/s)，"
+              f"429 {s['throttled_429']} 次，累計等待 {s['wait_s']}s")
+
+
+def reset():
+    """清掉所有 bucket (效能測試用)"""
+    with _buckets_lock:
+        _buckets.clear()
@@ -0,0 +1,13 @@
+"""縣市 / 區域對照表 (氣象與鄉鎮預報共用)"""
+
+# 📍 定義區域與縣市對照表
+REGION_MAP = {
+    "北部地區": ["基隆市", "臺北市", "新北市", "桃園市", "新竹市", "新竹縣", "苗栗縣"],
+    "中部地區": ["臺中市", "彰化縣", "南投縣", "雲林縣", "嘉義市", "嘉義縣"],
+    "南部地區": ["臺南市", "高雄市", "屏東縣"],
+    "東部地區": ["宜蘭縣", "花蓮縣", "臺東縣"],
+    "外島地區": ["澎湖縣", "金門縣", "連江縣"]
+}
+
+# 反查：縣市 → 區域
+COUNTY_TO_REGION = {county: region for region, counties in REGION_MAP.items() for county in counties}
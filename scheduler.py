@@ -0,0 +1,239 @@
+"""長駐排程器：同一個行程裡依 cron 執行氣象與 NASA 機器人
+
+和 GitHub Actions 每次冷啟動不同，這裡模組、HTTP 連線池、Gemini client、
+AI 快取都只載入一次，之後每次排程只剩真正的工作。
+
+- WEATHER_CRON / NASA_CRON：標準 5 欄 cron (分 時 日 月 週)，以台灣時間計算
+- ALERT_CRON：有設定才啟用天氣警特報輪詢 (例如 "* * * * *" 每分鐘)
+- 同一個工作上一次還沒跑完就不會再啟動 (不重疊)
+- 排程時間錯過 (重開機、休眠) 時，在 SCHEDULER_CATCHUP 秒內會補跑一次
+- SIGTERM / SIGINT：不再啟動新工作，等執行中的工作結束後離開
+
+用法：
+    python taiwanbot.py daemon
+"""
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import http_client
+
+TAIWAN_TZ = timezone(timedelta(hours=8))
+
+WEATHER_CRON = os.environ.get("WEATHER_CRON", "0 6 * * *")
+NASA_CRON = os.environ.get("NASA_CRON", "0 22 * * *")
+ALERT_CRON = os.environ.get("ALERT_CRON")
+CATCHUP_SECONDS = int(os.environ.get("SCHEDULER_CATCHUP", 6 * 60 * 60))
+STATE_PATH = os.environ.get("SCHEDULER_STATE", os.path.join(".cache", "scheduler.json"))
+# 收到停止訊號後，最多等執行中的工作幾秒
+SHUTDOWN_TIMEOUT = 300
+
+
+def _parse_field(field, low, high):
+    """解析單一 cron 欄位，回傳允許值的 set"""
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/")
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-"))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron 欄位超出範圍: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    def __init__(self, expr):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 必須是 5 個欄位: {expr!r}")
+        self.expr = expr
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        # cron 的星期：0 和 7 都是星期日；datetime.weekday() 星期一是 0
+        self.weekdays = {(d - 1) % 7 for d in _parse_field(fields[4], 0, 7)}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt):
+        if dt.month not in self.months:
+            return False
+        day_ok = dt.day in self.days
+        weekday_ok = dt.weekday() in self.weekdays
+        # 跟 cron 一樣：日與週都有限制時，符合其一即可
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, dt):
+        """dt 之後 (不含) 的下一個排程時間"""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if not self._day_matches(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"cron 永遠不會觸發: {self.expr!r}")
+
+    def last_at_or_before(self, dt):
+        """dt 以前 (含) 最近一次排程時間，一天內找不到就回傳 None"""
+        t = dt.replace(second=0, microsecond=0)
+        for _ in range(24 * 60):
+            if self._day_matches(t) and t.hour in self.hours and t.minute in self.minutes:
+                return t
+            t -= timedelta(minutes=1)
+        return None
+
+
+class Job:
+    def __init__(self, name, cron, func):
+        self.name = name
+        self.schedule = CronSchedule(cron)
+        self.func = func
+        self.lock = threading.Lock()
+        self.thread = None
+        self.next_run = None
+
+
+class Scheduler:
+    def __init__(self, jobs, state_path=STATE_PATH, catchup_seconds=CATCHUP_SECONDS):
+        self.jobs = jobs
+        self.state_path = state_path
+        self.catchup = timedelta(seconds=catchup_seconds)
+        self.stop_event = threading.Event()
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.state, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"⚠️ 排程狀態寫入失敗: {e}")
+
+    def _run(self, job, scheduled):
+        started = time.perf_counter()
+        print(f"⏰ [{job.name}] 開始執行 (排程時間 {scheduled:%Y-%m-%d %H:%M})")
+        try:
+            code = job.func()
+            status = "完成" if not code else f"結束 (code {code})"
+        except SystemExit as e:
+            status = f"結束 (code {e.code})"
+        except Exception as e:
+            status = f"例外: {e}"
+        finally:
+            job.lock.release()
+        print(f"⏰ [{job.name}] {status}，耗時 {time.perf_counter() - started:.1f}s")
+
+    def _start(self, job, scheduled):
+        if not job.lock.acquire(blocking=False):
+            print(f"⚠️ [{job.name}] 上一次還在執行，略過 {scheduled:%H:%M} 這一次")
+            return
+        self.state[job.name] = scheduled.isoformat()
+        self._save_state()
+        job.thread = threading.Thread(target=self._run, args=(job, scheduled), name=job.name, daemon=True)
+        job.thread.start()
+
+    def _catch_up(self, now):
+        """啟動時補跑錯過的排程 (只補最近一次)"""
+        for job in self.jobs:
+            last_due = job.schedule.last_at_or_before(now)
+            if not last_due or now - last_due > self.catchup:
+                continue
+            last_run = self.state.get(job.name)
+            if last_run and datetime.fromisoformat(last_run) >= last_due:
+                continue
+            print(f"⏪ [{job.name}] 補跑錯過的 {last_due:%Y-%m-%d %H:%M} 排程")
+            self._start(job, last_due)
+
+    def run_forever(self):
+        now = datetime.now(TAIWAN_TZ)
+        self._catch_up(now)
+        for job in self.jobs:
+            job.next_run = job.schedule.next_after(now)
+            print(f"📅 [{job.name}] {job.schedule.expr} → 下次 {job.next_run:%Y-%m-%d %H:%M}")
+
+        while not self.stop_event.is_set():
+            now = datetime.now(TAIWAN_TZ)
+            for job in self.jobs:
+                if now >= job.next_run:
+                    # 睡過頭 (例如主機休眠) 錯過多次時只跑一次
+                    self._start(job, job.next_run)
+                    job.next_run = job.schedule.next_after(now)
+            wake = min(job.next_run for job in self.jobs)
+            self.stop_event.wait(max((wake - datetime.now(TAIWAN_TZ)).total_seconds(), 0.5))
+
+        self._shutdown()
+
+    def stop(self, *args):
+        print("🛑 收到停止訊號，等待執行中的工作結束...")
+        self.stop_event.set()
+
+    def _shutdown(self):
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for job in self.jobs:
+            if job.thread and job.thread.is_alive():
+                job.thread.join(max(deadline - time.monotonic(), 0))
+        http_client.close()
+        print("👋 排程器已停止")
+
+
+def build_jobs():
+    # 啟動時就把兩支機器人與延遲載入的重量級套件 (requests、google.genai) 都準備好
+    import nasa_bot
+    import weather_bot
+
+    http_client.get_session()
+    weather_bot._get_genai_client()
+    nasa_bot._get_genai_client()
+
+    jobs = [
+        Job("weather", WEATHER_CRON, weather_bot.main),
+        Job("nasa", NASA_CRON, nasa_bot.main),
+    ]
+    if ALERT_CRON:
+        import weather_alerts
+
+        jobs.append(Job("alerts", ALERT_CRON, weather_alerts.poll_once))
+    return jobs
+
+
+def main():
+    scheduler = Scheduler(build_jobs())
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    scheduler.run_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    from taiwanbot import main as cli_main
+    sys.exit(cli_main(["daemon"]))
@@ -0,0 +1,400 @@
+"""自動氣象站即時觀測 (O-A0001-001) 與最近測站查詢
+
+全台幾百個測站，訂閱者 (偏好檔裡有座標的) 可能有上萬人，逐人掃過所有測站太慢。
+這裡把測站放進經緯度格子 (預設 0.025 度，約 2.5 公里) 建立空間索引：
+- 每個格子預先算好「格子內任何一點的前 k 個最近測站一定在裡面」的候選清單
+  (格子中心的第 k 近距離 + 2 × 格子半對角線 以內的測站)，補齊成一個 (格子數 × 寬度) 的 numpy array
+- 查詢時整批算出每個座標所在的格子，一次取出候選、算距離、argpartition 取前 k 個，
+  每位訂閱者只碰到附近幾十個測站；格子外的座標 (例如國外) 才和全部測站比
+- 距離用單位球上的弦長 (和大圓距離單調一致，結果是精確的最近測站，不是近似)
+
+測站清單變動 (新增、撤站、搬遷) 時只重算受影響的格子：
+候選清單含有被移除 / 搬遷測站的格子，以及新測站落在候選半徑內的格子。
+索引存在 .cache/cwa/O-A0001-001.index.npz，下次執行載入後用新的清單增量更新。
+
+numpy 只有這個模組用到，呼叫端要用時才 import (不影響其他指令的啟動時間)。
+"""
+import os
+
+import numpy as np
+
+import cwa_snapshot
+import http_client
+import telemetry
+
+CWA_API_KEY = os.environ.get("CWA_API_KEY")
+CWA_API_BASE = os.environ.get("CWA_API_BASE", "https://opendata.cwa.gov.tw")
+OBS_DATASET = os.environ.get("OBS_DATASET", "O-A0001-001")
+# 最近的測站超過這個距離 (公里) 就不顯示
+MAX_DISTANCE_KM = float(os.environ.get("STATION_MAX_DISTANCE_KM", 20))
+
+CELL_DEG = 0.025
+NEAREST_K = 3
+# 氣象局用 -99 / -999 代表儀器故障或沒有觀測
+MISSING = -99
+EARTH_RADIUS_KM = 6371.0
+# 一次查詢多少個座標 (控制候選距離矩陣的記憶體)
+QUERY_CHUNK = 16384
+# 一次重算多少個格子
+CELL_CHUNK = 1024
+INDEX_FORMAT = 1
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value <= MISSING else value
+
+
+def parse_stations(payload):
+    """
+    O-A0001-001 → [{"id", "name", "county", "town", "lat", "lon", "temp", "humidity", "rain", "time"}]
+    優先用 WGS84 座標；沒有座標的測站略過，缺測的數值是 None
+    """
+    stations = []
+    for st in payload.get("records", {}).get("Station", []):
+        geo = st.get("GeoInfo") or {}
+        coords = {c.get("CoordinateName"): c for c in geo.get("Coordinates") or []}
+        coord = coords.get("WGS84") or next(iter(coords.values()), None)
+        if not coord or not st.get("StationId"):
+            continue
+        lat, lon = _number(coord.get("StationLatitude")), _number(coord.get("StationLongitude"))
+        if lat is None or lon is None:
+            continue
+        element = st.get("WeatherElement") or {}
+        stations.append({
+            "id": st["StationId"],
+            "name": st.get("StationName") or st["StationId"],
+            "county": (geo.get("CountyName") or "").replace("台", "臺"),
+            "town": geo.get("TownName") or "",
+            "lat": lat,
+            "lon": lon,
+            "temp": _number(element.get("AirTemperature")),
+            "humidity": _number(element.get("RelativeHumidity")),
+            "rain": _number((element.get("Now") or {}).get("Precipitation")),
+            # "2026-10-17T14:10:00+08:00" → "14:10"
+            "time": ((st.get("ObsTime") or {}).get("DateTime") or "")[11:16],
+        })
+    return stations
+
+
+def unit_vectors(lat, lon):
+    """經緯度 (度) → 單位球上的 (x, y, z)"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def _chords(points, vectors):
+    """(m×3) 與 (n×3) 單位向量兩兩之間的弦長 (m×n)"""
+    return np.sqrt(np.maximum(2 - 2 * (points @ vectors.T), 0))
+
+
+class StationIndex:
+    """
+    測站的格子索引。測站放在 slot 裡：撤站的 slot 標成不啟用，之後新增的測站優先填空位，
+    所以其他格子的候選清單 (存的是 slot 編號) 不必因為別的測站變動而重算。
+    """
+
+    def __init__(self, cell_deg=CELL_DEG, k=NEAREST_K):
+        self.cell_deg = cell_deg
+        self.k = k
+        self.ids = []                     # slot → 測站 ID (空位為 None)
+        self.slot_of = {}                 # 測站 ID → slot
+        self.latlon = np.empty((0, 2))
+        self.vectors = np.empty((0, 3))
+        self.active = np.zeros(0, dtype=bool)
+        self.origin = (0.0, 0.0)          # 格子左下角 (緯度, 經度)
+        self.shape = (0, 0)               # (列數, 欄數)
+        self.candidates = np.empty((0, 0), dtype=np.int32)  # 格子 → 候選 slot，-1 補齊
+        self.radius = np.empty(0)         # 格子 → 候選半徑 (弦長)
+
+    @classmethod
+    def build(cls, stations, cell_deg=CELL_DEG, k=NEAREST_K):
+        index = cls(cell_deg, k)
+        index._reset(stations)
+        return index
+
+    def __len__(self):
+        return int(self.active.sum())
+
+    # ---------- 建立 / 增量更新 ----------
+
+    def _reset(self, stations):
+        latest = {s["id"]: (s["lat"], s["lon"]) for s in stations}
+        self.ids = list(latest)
+        self.slot_of = {sid: i for i, sid in enumerate(self.ids)}
+        self.latlon = np.array(list(latest.values()), dtype=float).reshape(-1, 2)
+        self.vectors = unit_vectors(self.latlon[:, 0], self.latlon[:, 1])
+        self.active = np.ones(len(self.ids), dtype=bool)
+        self._init_grid()
+        self.candidates = np.empty((self.n_cells, 0), dtype=np.int32)
+        self.radius = np.zeros(self.n_cells)
+        self._rebuild_cells(np.arange(self.n_cells))
+
+    def _init_grid(self):
+        """格子範圍 = 目前所有測站的外框再往外一格"""
+        cell = self.cell_deg
+        if len(self.latlon):
+            low = np.floor(self.latlon.min(axis=0) / cell) * cell - cell
+            high = self.latlon.max(axis=0) + cell
+        else:
+            low, high = np.zeros(2), np.zeros(2)
+        self.origin = (float(low[0]), float(low[1]))
+        self.shape = tuple(int(n) for n in np.ceil((high - low) / cell).astype(int) + 1)
+        self._init_cell_geometry()
+
+    def _init_cell_geometry(self):
+        rows, cols = self.shape
+        cell = self.cell_deg
+        r, c = np.divmod(np.arange(rows * cols), cols)
+        lat = self.origin[0] + (r + 0.5) * cell
+        lon = self.origin[1] + (c + 0.5) * cell
+        self.centers = unit_vectors(lat, lon)
+        # 格子內任何一點到中心的最大弦長 (取四個角的最大值)
+        corners = [unit_vectors(lat + dy * cell / 2, lon + dx * cell / 2) for dy in (-1, 1) for dx in (-1, 1)]
+        self.half_diag = np.max([np.linalg.norm(self.centers - v, axis=1) for v in corners], axis=0)
+
+    @property
+    def n_cells(self):
+        return self.shape[0] * self.shape[1]
+
+    def _rebuild_cells(self, cells):
+        """重算這些格子的候選清單；寬度不夠時整個 array 往右補 -1"""
+        active = np.flatnonzero(self.active)
+        if not len(cells):
+            return
+        if not len(active):
+            self.candidates[cells] = -1
+            self.radius[cells] = 0
+            return
+        k = min(self.k, len(active))
+        for start in range(0, len(cells), CELL_CHUNK):
+            chunk = cells[start:start + CELL_CHUNK]
+            dist = _chords(self.centers[chunk], self.vectors[active])
+            kth = np.partition(dist, k - 1, axis=1)[:, k - 1]
+            radius = kth + 2 * self.half_diag[chunk] + 1e-12
+            inside = dist <= radius[:, None]
+            counts = inside.sum(axis=1)
+            width = int(counts.max())
+            if width > self.candidates.shape[1]:
+                pad = np.full((self.n_cells, width - self.candidates.shape[1]), -1, dtype=np.int32)
+                self.candidates = np.hstack([self.candidates, pad])
+            # 候選依距離排序，前面的欄位就是最近的測站
+            order = np.argsort(np.where(inside, dist, np.inf), axis=1, kind="stable")[:, :width]
+            rows = np.full((len(chunk), self.candidates.shape[1]), -1, dtype=np.int32)
+            rows[:, :width] = np.where(np.arange(width) < counts[:, None], active[order], -1)
+            self.candidates[chunk] = rows
+            self.radius[chunk] = radius
+
+    def _in_grid(self, lat, lon):
+        rows, cols = self.shape
+        r = np.floor((np.asarray(lat) - self.origin[0]) / self.cell_deg).astype(np.int64)
+        c = np.floor((np.asarray(lon) - self.origin[1]) / self.cell_deg).astype(np.int64)
+        inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+        return r * cols + c, inside
+
+    def update(self, stations):
+        """
+        用最新的測站清單更新索引，只重算受影響的格子。
+        回傳 {"added", "removed", "moved", "cells"} (cells 是重算的格子數)；有測站超出格子範圍時整個重建。
+        """
+        latest = {s["id"]: (s["lat"], s["lon"]) for s in stations}
+        removed = [sid for sid in self.slot_of if sid not in latest]
+        added = [sid for sid in latest if sid not in self.slot_of]
+        moved = [sid for sid in latest if sid in self.slot_of
+                 and tuple(self.latlon[self.slot_of[sid]]) != latest[sid]]
+        stats = {"added": len(added), "removed": len(removed), "moved": len(moved), "cells": 0}
+        if not (added or removed or moved):
+            return stats
+
+        new_points = np.array([latest[sid] for sid in added + moved], dtype=float).reshape(-1, 2)
+        _, inside = self._in_grid(new_points[:, 0], new_points[:, 1])
+        free_after = self.active.size - self.active.sum() + len(removed) - len(added)
+        if not inside.all() or free_after > max(len(latest), 16):
+            # 範圍變大要重新劃格子；空位太多就順便整理
+            self._reset(stations)
+            stats["cells"] = self.n_cells
+            return stats
+
+        # 1. 候選清單含有被移除 / 搬遷測站的格子
+        gone = [self.slot_of[sid] for sid in removed + moved]
+        dirty = np.isin(self.candidates, gone).any(axis=1)
+        for sid in removed:
+            slot = self.slot_of.pop(sid)
+            self.ids[slot] = None
+            self.active[slot] = False
+
+        # 2. 新測站填空位 (不夠再加在後面)，搬遷的測站原地更新座標
+        free = [slot for slot, sid in enumerate(self.ids) if sid is None]
+        for sid in added:
+            if free:
+                slot = free.pop(0)
+                self.ids[slot] = sid
+            else:
+                slot = len(self.ids)
+                self.ids.append(sid)
+                self.latlon = np.vstack([self.latlon, np.zeros((1, 2))])
+                self.vectors = np.vstack([self.vectors, np.zeros((1, 3))])
+                self.active = np.append(self.active, False)
+            self.slot_of[sid] = slot
+        for sid in added + moved:
+            slot = self.slot_of[sid]
+            self.latlon[slot] = latest[sid]
+            self.vectors[slot] = unit_vectors(*latest[sid])
+            self.active[slot] = True
+
+        # 3. 新位置落在候選半徑內的格子
+        for start in range(0, len(new_points), 256):
+            vec = unit_vectors(new_points[start:start + 256, 0], new_points[start:start + 256, 1])
+            dirty |= (_chords(self.centers, vec) <= self.radius[:, None]).any(axis=1)
+
+        cells = np.flatnonzero(dirty)
+        self._rebuild_cells(cells)
+        stats["cells"] = len(cells)
+        return stats
+
+    # ---------- 查詢 ----------
+
+    def nearest(self, lat, lon, k=None):
+        """
+        整批查詢最近的 k 個測站：lat / lon 是同長度的 array，
+        回傳 (slots, 公里)，都是 (N × k)，依距離排序；測站不足 k 個時 slot 為 -1、距離為 inf
+        """
+        k = k or self.k
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        n = len(lat)
+        slots = np.full((n, k), -1, dtype=np.int64)
+        chords = np.full((n, k), np.inf)
+        if not n or not self.active.any():
+            return slots, chords
+
+        cells, inside = self._in_grid(lat, lon)
+        points = unit_vectors(lat, lon)
+        everyone = np.flatnonzero(self.active)
+        for where, in_grid in ((np.flatnonzero(inside), True), (np.flatnonzero(~inside), False)):
+            # 格子外的座標要和全部測站比，每批少一點
+            step = QUERY_CHUNK if in_grid else max(QUERY_CHUNK * 16 // len(everyone), 1)
+            for start in range(0, len(where), step):
+                rows = where[start:start + step]
+                if in_grid:
+                    cand = self.candidates[cells[rows]]
+                    dist = np.sqrt(np.maximum(
+                        2 - 2 * np.einsum("mwd,md->mw", self.vectors[np.maximum(cand, 0)], points[rows]), 0))
+                    dist[cand < 0] = np.inf
+                else:
+                    cand = np.broadcast_to(everyone, (len(rows), len(everyone)))
+                    dist = _chords(points[rows], self.vectors[everyone])
+                take = min(k, dist.shape[1])
+                part = np.argpartition(dist, take - 1, axis=1)[:, :take]
+                part_dist = np.take_along_axis(dist, part, axis=1)
+                order = np.argsort(part_dist, axis=1, kind="stable")
+                chords[rows, :take] = np.take_along_axis(part_dist, order, axis=1)
+                slots[rows, :take] = np.take_along_axis(cand, np.take_along_axis(part, order, axis=1), axis=1)
+        slots[np.isinf(chords)] = -1
+        return slots, chord_to_km(chords)
+
+    # ---------- 存檔 ----------
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, format=INDEX_FORMAT, ids=np.array([sid or "" for sid in self.ids], dtype=str),
+                 latlon=self.latlon, active=self.active, origin=np.array(self.origin),
+                 shape=np.array(self.shape), cell_deg=self.cell_deg, k=self.k,
+                 candidates=self.candidates, radius=self.radius)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["format"]) != INDEX_FORMAT:
+                raise ValueError("索引格式版本不同")
+            index = cls(float(data["cell_deg"]), int(data["k"]))
+            index.ids = [sid or None for sid in data["ids"].tolist()]
+            index.latlon = data["latlon"]
+            index.active = data["active"]
+            index.origin = tuple(data["origin"].tolist())
+            index.shape = tuple(data["shape"].tolist())
+            index.candidates = data["candidates"]
+            index.radius = data["radius"]
+        index.slot_of = {sid: i for i, sid in enumerate(index.ids) if sid is not None}
+        index.vectors = unit_vectors(index.latlon[:, 0], index.latlon[:, 1])
+        index._init_cell_geometry()
+        return index
+
+
+def index_path(dataset=OBS_DATASET):
+    return os.path.join(cwa_snapshot.SNAPSHOT_DIR, f"{dataset}.index.npz")
+
+
+def fetch_stations(deadline=None):
+    """下載並解析全台自動氣象站的最新觀測；deadline 為呼叫端階段的截止時間 (time.perf_counter)"""
+    url = f"{CWA_API_BASE}/api/v1/rest/datastore/{OBS_DATASET}"
+    resp = http_client.get("cwa_obs", url, params={"Authorization": CWA_API_KEY, "format": "JSON"}, deadline=deadline)
+    resp.raise_for_status()
+    return parse_stations(resp.json())
+
+
+def load_index(stations, path=None):
+    """載入上次的索引並用這次的測站清單增量更新 (清單沒變就直接用)；沒有或讀不了就重建"""
+    path = path or index_path()
+    try:
+        index = StationIndex.load(path)
+    except (OSError, ValueError, KeyError):
+        index = None
+
+    with telemetry.span("測站索引", stations=len(stations)) as sp:
+        if index is None or index.cell_deg != CELL_DEG or index.k != NEAREST_K:
+            index = StationIndex.build(stations)
+            stats = {"rebuilt": True, "cells": index.n_cells}
+        else:
+            stats = index.update(stations)
+        sp.set(**stats)
+    if stats.get("rebuilt") or stats["cells"]:
+        print(f"🗺️ 測站索引更新：{stats}")
+        try:
+            index.save(path)
+        except OSError as e:
+            print(f"⚠️ 測站索引寫入失敗: {e}")
+    return index
+
+
+def nearest_readings(locations, stations, index=None, max_km=MAX_DISTANCE_KM):
+    """
+    locations 是 {訂閱者: (緯度, 經度)}；回傳 {訂閱者: 觀測}，
+    觀測取最近 NEAREST_K 個測站中、max_km 內第一個有回報氣溫的。同一個測站的訂閱者共用同一個 dict，
+    格式：{"id", "name", "town", "time", "temp" (字串，一位小數)}
+    """
+    if not locations or not stations:
+        return {}
+    index = index or load_index(stations)
+    by_id = {s["id"]: s for s in stations}
+
+    sids = list(locations)
+    points = np.array([locations[sid] for sid in sids], dtype=float)
+    with telemetry.span("最近測站", subscribers=len(sids), stations=len(by_id)) as sp:
+        slots, km = index.nearest(points[:, 0], points[:, 1])
+        has_temp = np.array([by_id.get(sid, {}).get("temp") is not None if sid else False for sid in index.ids],
+                            dtype=bool)
+        usable = (slots >= 0) & has_temp[np.maximum(slots, 0)] & (km <= max_km)
+        first = usable.argmax(axis=1)
+        found = usable[np.arange(len(sids)), first]
+        chosen = slots[np.arange(len(sids)), first]
+
+        readings, result = {}, {}
+        for i in np.flatnonzero(found):
+            slot = int(chosen[i])
+            if slot not in readings:
+                s = by_id[index.ids[slot]]
+                readings[slot] = {"id": s["id"], "name": s["name"], "town": s["town"], "time": s["time"],
+                                  "temp": f"{s['temp']:.1f}"}
+            result[sids[i]] = readings[slot]
+        sp.set(matched=len(result), stations_used=len(readings))
+    return result
@@ -0,0 +1,166 @@
+"""訂閱者名單 (合併 .env 的 LINE_USER_ID 與 GAS 自動訂閱 API)
+
+GAS 的名單存在本機 SQLite (SUBSCRIBER_DB，預設 .cache/subscribers.db)，每次執行只做增量同步：
+- GET {SUBSCRIBER_API_URL}?since=<cursor> 只回傳上次同步之後新增 / 移除的 ID
+  (回應格式見 walkthrough_gas.md 的 doGet)
+- 舊版 GAS 只會回傳完整 ID list，這時改成和本機名單比對差異
+- GAS 很慢或掛掉時沿用本機上一次成功同步的名單
+
+ID 的來源類型由開頭字母決定：U 使用者 / C 群組 / R 聊天室。
+"""
+import os
+import sqlite3
+import time
+
+import http_client
+
+DB_PATH = os.environ.get("SUBSCRIBER_DB", os.path.join(".cache", "subscribers.db"))
+
+SOURCE_TYPES = {"U": "user", "C": "group", "R": "room"}
+TYPE_LABELS = {"user": "使用者", "group": "群組", "room": "聊天室", "unknown": "未知"}
+
+
+def source_type(subscriber_id):
+    """依 ID 開頭判斷 user / group / room (無法判斷的回傳 unknown)"""
+    return SOURCE_TYPES.get(subscriber_id[:1], "unknown")
+
+
+def parse_env_ids(line_user_id):
+    """LINE_USER_ID 可以用逗號分隔多個 ID"""
+    return {uid.strip() for uid in (line_user_id or "").split(",") if uid.strip()}
+
+
+class SubscriberStore:
+    def __init__(self, path=DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS subscribers (
+                id TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                added_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+
+    def __contains__(self, subscriber_id):
+        row = self.conn.execute("SELECT 1 FROM subscribers WHERE id = ?", (subscriber_id,)).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        return (row[0] for row in self.conn.execute("SELECT id FROM subscribers"))
+
+    def ids(self):
+        return set(self)
+
+    def count_by_type(self):
+        return dict(self.conn.execute("SELECT type, COUNT(*) FROM subscribers GROUP BY type"))
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def apply_changes(self, added, removed, cursor=None):
+        """在同一個 transaction 裡套用增量變化，回傳實際 (新增數, 移除數)"""
+        now = time.time()
+        before = len(self)
+        with self.conn:
+            self.conn.executemany("DELETE FROM subscribers WHERE id = ?", ((sid,) for sid in removed))
+            after_remove = len(self)
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO subscribers (id, type, added_at) VALUES (?, ?, ?)",
+                ((sid, source_type(sid), now) for sid in added),
+            )
+            if cursor is not None:
+                self._set_meta("cursor", cursor)
+            self._set_meta("synced_at", now)
+        return len(self) - after_remove, before - after_remove
+
+    def replace_all(self, ids, cursor=None):
+        """用完整名單取代本機名單 (只寫入差異)"""
+        ids = set(ids)
+        current = self.ids()
+        return self.apply_changes(ids - current, current - ids, cursor)
+
+
+def _ids_from(items):
+    """GAS 回傳的 ID 可以是字串或 {"id": ...}"""
+    for item in items or []:
+        sid = item.get("id") if isinstance(item, dict) else item
+        if isinstance(sid, str) and sid.strip():
+            yield sid.strip()
+
+
+def sync_from_gas(store, subscriber_api_url):
+    """從 GAS 增量同步到 store，成功回傳 True；失敗時 store 保持上一次的名單"""
+    cursor = store.get_meta("cursor", "0")
+    try:
+        print("📡 正在從 GAS API 同步訂閱者...")
+        resp = http_client.get("gas", subscriber_api_url, params={"since": cursor})
+        if resp.status_code != 200:
+            print(f"⚠️ GAS API 回傳錯誤: {resp.status_code}，沿用本機名單")
+            return False
+        payload = resp.json()
+    except Exception as e:
+        print(f"⚠️ 讀取訂閱者 API 失敗，沿用本機名單: {e}")
+        return False
+
+    if isinstance(payload, list):
+        # 舊版 GAS：完整名單，和本機比對差異
+        added, removed = store.replace_all(_ids_from(payload))
+        mode = "完整比對"
+    elif isinstance(payload, dict) and "full" in payload:
+        # since=0 或 GAS 判斷 cursor 失效時回傳完整名單
+        added, removed = store.replace_all(_ids_from(payload["full"]), payload.get("cursor"))
+        mode = "完整同步"
+    elif isinstance(payload, dict):
+        added, removed = store.apply_changes(
+            _ids_from(payload.get("added")), _ids_from(payload.get("removed")), payload.get("cursor")
+        )
+        mode = "增量同步"
+    else:
+        print("⚠️ GAS API 回應格式無法辨識，沿用本機名單")
+        return False
+
+    print(f"✅ 訂閱者{mode}：+{added} / -{removed}，共 {len(store)} 位")
+    return True
+
+
+def get_subscriber_ids(line_user_id=None, subscriber_api_url=None, db_path=None):
+    """回傳不重複的訂閱者 ID set (.env 的 LINE_USER_ID + 本機同步的 GAS 名單)"""
+    # 1. 從 .env 讀取
+    user_ids = parse_env_ids(line_user_id)
+
+    # 2. 從 GAS API 增量同步 (自動訂閱)
+    if subscriber_api_url:
+        try:
+            with SubscriberStore(db_path or DB_PATH) as store:
+                sync_from_gas(store, subscriber_api_url)
+                user_ids.update(store)
+                counts = store.count_by_type()
+        except (sqlite3.Error, OSError) as e:
+            print(f"⚠️ 本機訂閱者資料庫錯誤: {e}")
+            return user_ids
+        summary = " / ".join(f"{TYPE_LABELS.get(kind, kind)} {n}" for kind, n in sorted(counts.items()))
+        print(f"👥 GAS 訂閱者 {summary}")
+
+    return user_ids
@@ -0,0 +1,243 @@
+"""TaiwanWeatherBot 統一指令
+
+    python taiwanbot.py weather [--period N] [--force]   # 氣象播報 (抓資料 → AI → Discord / LINE)
+    python taiwanbot.py nasa                             # NASA 每日一圖
+    python taiwanbot.py render weather|nasa [-o FILE]    # 只產生 Flex Message JSON，不呼叫 AI、不發送
+    python taiwanbot.py deliver FILE                     # 把 Flex Message JSON 發給所有 LINE 訂閱者
+    python taiwanbot.py daemon                           # 長駐排程器
+    python taiwanbot.py alerts [--interval 60] [--once]  # 天氣警特報輪詢，只推給受影響縣市的訂閱者
+    python taiwanbot.py archive [--start D] [--end D]    # 批次匯入 APOD 歷史典藏 (可中斷續傳)
+    python taiwanbot.py archive --on-this-day | --search 關鍵字   # 查詢本機典藏
+    python taiwanbot.py township [--county 臺北市 ...] [-o FILE]  # 鄉鎮預報 (預設只取訂閱者選的縣市)
+
+每個子指令只載入自己需要的模組：render 不會載入 google.genai，
+NASA 爬蟲備援用標準函式庫的 HTMLParser 串流擷取，不需要 bs4。設定 (環境變數) 在這裡檢查，不在 import 時。
+"""
+import argparse
+import json
+import os
+import sys
+
+# 子指令 → 必要的環境變數 (list 裡的 tuple 代表「其中一個有設即可」)
+# 依目標不同的子指令用 "子指令 目標" 當 key (例如 render weather 要抓氣象局資料)
+REQUIRED_ENV = {
+    "weather": ["CWA_API_KEY"],
+    "nasa": ["WEBHOOK_URL", "GEMINI_API_KEY"],
+    "render weather": ["CWA_API_KEY"],
+    "render nasa": [],
+    "deliver": ["LINE_TOKEN", ("LINE_USER_ID", "SUBSCRIBER_API_URL")],
+    "daemon": ["CWA_API_KEY", "WEBHOOK_URL", "GEMINI_API_KEY"],
+    "alerts": ["CWA_API_KEY"],
+    "archive": [],
+    "township": ["CWA_API_KEY"],
+}
+
+
+def validate_config(command, target=None):
+    """回傳缺少的環境變數 list (空的代表設定正確)；target 是 render 的 weather / nasa"""
+    missing = []
+    for name in REQUIRED_ENV[f"{command} {target}" if target else command]:
+        names = name if isinstance(name, tuple) else (name,)
+        if not any(os.environ.get(n) for n in names):
+            missing.append(" 或 ".join(names))
+    return missing
+
+
+def cmd_weather(args):
+    import weather_bot
+
+    if args.period is not None:
+        weather_bot.FORECAST_PERIOD = args.period
+    if args.force:
+        weather_bot.CWA_FORCE_REFRESH = True
+    return weather_bot.main()
+
+
+def cmd_nasa(args):
+    import nasa_bot
+
+    return nasa_bot.main()
+
+
+def cmd_render(args):
+    if args.bot == "weather":
+        import weather_bot
+
+        w_data, _, t_range = weather_bot.get_taiwan_weather_data(args.period or 0)
+        if not w_data:
+            return 1
+        message = weather_bot.generate_flex_message(w_data, args.comment, t_range)
+    else:
+        import nasa_bot
+
+        nasa_data = nasa_bot.fetch_nasa_data()
+        if not nasa_data:
+            return 1
+        message = nasa_bot.generate_flex_message(nasa_data, args.comment, args.comment)
+
+    text = json.dumps(message, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"✅ 已輸出到 {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+def cmd_deliver(args):
+    from line_delivery import deliver_line_messages, print_delivery_report
+    from subscribers import get_subscriber_ids
+
+    with open(args.file, encoding="utf-8") as f:
+        messages = json.load(f)
+    if isinstance(messages, dict):
+        messages = [messages]
+
+    user_ids = get_subscriber_ids(os.environ.get("LINE_USER_ID"), os.environ.get("SUBSCRIBER_API_URL"))
+    if not user_ids:
+        print("⚠️ 無任何訂閱者 ID")
+        return 1
+    results = deliver_line_messages(messages, user_ids, os.environ["LINE_TOKEN"])
+    print_delivery_report(results)
+    return 0 if all(r["ok"] for r in results.values()) else 1
+
+
+def cmd_daemon(args):
+    import scheduler
+
+    return scheduler.main()
+
+
+def cmd_alerts(args):
+    import weather_alerts
+
+    return weather_alerts.run(args.interval or weather_alerts.ALERT_INTERVAL, args.once)
+
+
+def cmd_archive(args):
+    from datetime import date
+
+    import apod_archive
+
+    if args.search or args.on_this_day:
+        with apod_archive.ApodArchive() as archive:
+            if args.search:
+                entries = archive.search(args.search, limit=args.limit)
+            else:
+                today = date.today()
+                entries = archive.on_this_day(today.month, today.day)[:args.limit]
+        for e in entries:
+            print(f"{e['date']}  [{e['media_type']}]  {e['title']}")
+        return 0 if entries else 1
+
+    start = date.fromisoformat(args.start) if args.start else None
+    end = date.fromisoformat(args.end) if args.end else None
+    apod_archive.load_archive(os.environ.get("NASA_API_KEY", "DEMO_KEY"), start, end,
+                              args.batch_days or apod_archive.BATCH_DAYS)
+    return 0
+
+
+def township_counties(names):
+    """--county 指定的縣市 / 區域；沒指定就用偏好檔裡訂閱者選的縣市 (有人選全台或沒有偏好檔時回傳 None = 全部)"""
+    from preferences import ALL_CITIES, load_preferences, normalize_selection
+
+    if names:
+        return normalize_selection(names)
+    prefs = load_preferences()
+    if not prefs or any(cities is ALL_CITIES for cities in prefs.values()):
+        return None
+    return frozenset().union(*prefs.values())
+
+
+def cmd_township(args):
+    import township_forecast
+
+    counties = township_counties(args.county)
+    townships = township_forecast.fetch_townships(os.environ["CWA_API_KEY"],
+                                                  args.dataset or township_forecast.DEFAULT_DATASET,
+                                                  counties=counties)
+    if not townships:
+        return 1
+    tree = township_forecast.group_by_region(townships)
+    tree = {region: {county: towns for county, towns in by_county.items() if towns}
+            for region, by_county in tree.items()}
+    tree = {region: by_county for region, by_county in tree.items() if by_county}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(tree, f, ensure_ascii=False, indent=2)
+        print(f"✅ 已輸出 {len(townships)} 個鄉鎮到 {args.output}")
+    else:
+        for region, by_county in tree.items():
+            print(f"【{region}】")
+            for towns in by_county.values():
+                for t in towns:
+                    print(f"  {township_forecast.describe(t)}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="taiwanbot", description="台灣氣象 & NASA 天文機器人")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("weather", help="氣象播報")
+    p.add_argument("--period", type=int, choices=[0, 1, 2], help="0 今日 / 1 今晚明晨 / 2 明日")
+    p.add_argument("--force", action="store_true", help="忽略快照，強制重新下載")
+    p.set_defaults(func=cmd_weather)
+
+    p = sub.add_parser("nasa", help="NASA 每日一圖")
+    p.set_defaults(func=cmd_nasa)
+
+    p = sub.add_parser("render", help="只產生 Flex Message JSON")
+    p.add_argument("bot", choices=["weather", "nasa"])
+    p.add_argument("--period", type=int, choices=[0, 1, 2])
+    p.add_argument("--comment", default="（預覽模式，未產生 AI 內容）", help="放在 AI 點評位置的文字")
+    p.add_argument("-o", "--output", help="輸出檔案 (預設印到螢幕)")
+    p.set_defaults(func=cmd_render)
+
+    p = sub.add_parser("deliver", help="發送 Flex Message JSON 給 LINE 訂閱者")
+    p.add_argument("file")
+    p.set_defaults(func=cmd_deliver)
+
+    p = sub.add_parser("daemon", help="長駐排程器")
+    p.set_defaults(func=cmd_daemon)
+
+    p = sub.add_parser("alerts", help="天氣警特報輪詢與推播")
+    p.add_argument("--interval", type=float, help="輪詢間隔秒數 (預設 ALERT_INTERVAL 或 60)")
+    p.add_argument("--once", action="store_true", help="只輪詢一次 (給外部 cron 用)")
+    p.set_defaults(func=cmd_alerts)
+
+    p = sub.add_parser("archive", help="APOD 歷史典藏 (匯入 / 查詢)")
+    p.add_argument("--start", help="起始日期 YYYY-MM-DD (預設從上次進度接著抓)")
+    p.add_argument("--end", help="結束日期 YYYY-MM-DD (預設今天)")
+    p.add_argument("--batch-days", type=int, help="每個 API 請求涵蓋幾天 (預設 ARCHIVE_BATCH_DAYS 或 365)")
+    p.add_argument("--on-this-day", action="store_true", help="列出歷年的今天")
+    p.add_argument("--search", help="用標題關鍵字查詢")
+    p.add_argument("--limit", type=int, default=20)
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("township", help="鄉鎮預報 (串流解析 F-D0047)")
+    p.add_argument("--county", action="append", help="縣市或區域名稱，可重複 (預設為偏好檔裡訂閱者選的縣市)")
+    p.add_argument("--dataset", help="資料集 (預設 F-D0047-089 全台鄉鎮 3 天)")
+    p.add_argument("-o", "--output", help="輸出 JSON 檔 ({區域: {縣市: [鄉鎮...]}})，預設印出摘要")
+    p.set_defaults(func=cmd_township)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # 載入 .env 檔案 (要在載入機器人模組之前，它們會讀環境變數)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    missing = validate_config(args.command, getattr(args, "bot", None))
+    if missing:
+        print(f"❌ 設定錯誤：找不到 {', '.join(missing)}！")
+        print("請檢查 .env 或 .github/workflows/xxx.yml 的 env: 區塊")
+        return 2
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""追蹤 (span) 與指標 (counter / gauge / histogram)
+
+設定 TELEMETRY_DIR 才會啟用，執行結束 (flush) 時寫出：
+- events.jsonl：每個 span 一行 (名稱、trace / parent、開始時間、耗時、狀態、屬性)，最後一行是指標摘要 (含 p50 / p95)
+- taiwanbot.prom：Prometheus textfile 格式 (給 node_exporter 的 textfile collector 讀)
+
+沒設定時 span() 回傳共用的空物件、count() / observe() 直接 return，幾乎沒有成本。
+span 的父子關係用 contextvars 記錄，asyncio.to_thread 會把 context 帶進執行緒，
+所以流程階段 → HTTP 請求的巢狀關係會自動接起來 (自己開 ThreadPoolExecutor 的地方要用
+contextvars.copy_context().run 送出工作，見 line_delivery._submit)。
+"""
+import contextvars
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+TELEMETRY_DIR = os.environ.get("TELEMETRY_DIR")
+ENABLED = bool(TELEMETRY_DIR)
+PREFIX = "taiwanbot_"
+
+# 延遲類 histogram 的 bucket 上界 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# bytes 類 histogram 的 bucket 上界
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_current = contextvars.ContextVar("telemetry_span", default=None)
+_spans = []        # 已結束、還沒寫出的 span
+_counters = {}     # (名稱, labels) → 值
+_gauges = {}
+_histograms = {}   # (名稱, labels) → [各 bucket 次數..., +Inf 次數, 總和, 次數]
+_bucket_bounds = {}
+_help = {}
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "span_id", "trace_id", "parent_id", "start", "wall_start", "_token")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        parent = _current.get()
+        self.span_id = next(_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else os.urandom(8).hex()
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def set(self, **attrs):
+        """執行中補上屬性 (例如回應大小、筆數)"""
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current.reset(self._token)
+        record = {
+            "type": "span",
+            "name": self.name,
+            "trace": self.trace_id,
+            "span": self.span_id,
+            "parent": self.parent_id,
+            "start": round(self.wall_start, 6),
+            "duration_ms": round(duration * 1000, 3),
+            "status": "error" if exc_type else "ok",
+        }
+        if exc_type:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        if self.attrs:
+            record["attrs"] = self.attrs
+        with _lock:
+            _spans.append(record)
+        observe("span_duration_seconds", duration, span=self.name)
+        return False
+
+
+def span(name, **attrs):
+    """with telemetry.span("CWA 解析", rows=...): ...；停用時回傳空物件"""
+    if not ENABLED:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def count(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge(name, value, **labels):
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[(name, _labels(labels))] = value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """記錄一筆 histogram 觀測值 (延遲用 LATENCY_BUCKETS，bytes 用 SIZE_BUCKETS)"""
+    if not ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            _bucket_bounds.setdefault(name, buckets)
+            h = _histograms[key] = [0] * (len(_bucket_bounds[name]) + 3)
+        bounds = _bucket_bounds[name]
+        i = 0
+        while i < len(bounds) and value > bounds[i]:
+            i += 1
+        h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+def describe(name, text):
+    """Prometheus 的 # HELP 說明"""
+    _help[name] = text
+
+
+def quantile(name, q, **labels):
+    """從 histogram bucket 內插估計分位數 (同 PromQL histogram_quantile)；沒有資料回傳 None"""
+    with _lock:
+        h = _histograms.get((name, _labels(labels)))
+        return _quantile(_bucket_bounds.get(name, ()), h, q) if h else None
+
+
+def _quantile(bounds, h, q):
+    total = h[-1]
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(h[:-2]):
+        if seen + n >= rank and n:
+            if i >= len(bounds):
+                return bounds[-1] if bounds else None
+            lower = bounds[i - 1] if i else 0.0
+            return lower + (bounds[i] - lower) * (rank - seen) / n
+        seen += n
+    return None
+
+
+def snapshot():
+    """目前所有指標 (JSON 友善的格式)"""
+    def key_str(name, labels):
+        return name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+
+    with _lock:
+        result = {
+            "counters": {key_str(*k): v for k, v in sorted(_counters.items())},
+            "gauges": {key_str(*k): v for k, v in sorted(_gauges.items())},
+            "histograms": {},
+        }
+        for (name, labels), h in sorted(_histograms.items()):
+            bounds = _bucket_bounds[name]
+            p50, p95 = _quantile(bounds, h, 0.5), _quantile(bounds, h, 0.95)
+            result["histograms"][key_str(name, labels)] = {
+                "count": h[-1],
+                "sum": round(h[-2], 6),
+                "p50": round(p50, 6) if p50 is not None else None,
+                "p95": round(p95, 6) if p95 is not None else None,
+            }
+    return result
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name, labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return PREFIX + name
+    return PREFIX + name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for kind, store in (("counter", _counters), ("gauge", _gauges)):
+            names = sorted({name for name, _ in store})
+            for name in names:
+                if name in _help:
+                    lines.append(f"# HELP {PREFIX}{name} {_help[name]}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                for (n, labels), value in sorted(store.items()):
+                    if n == name:
+                        lines.append(f"{_series(name, labels)} {_fmt(value)}")
+        for name in sorted({name for name, _ in _histograms}):
+            bounds = _bucket_bounds[name]
+            if name in _help:
+                lines.append(f"# HELP {PREFIX}{name} {_help[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for (n, labels), h in sorted(_histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(tuple(bounds) + (math.inf,), h[:-2]):
+                    cumulative += c
+                    lines.append(f"{_series(name + '_bucket', labels, [('le', _fmt(bound))])} {cumulative}")
+                lines.append(f"{_series(name + '_sum', labels)} {_fmt(float(h[-2]))}")
+                lines.append(f"{_series(name + '_count', labels)} {h[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def flush(directory=None):
+    """把累積的 span 附加到 events.jsonl，並覆寫 Prometheus textfile；停用時什麼都不做"""
+    if not ENABLED:
+        return
+    directory = directory or TELEMETRY_DIR
+    os.makedirs(directory, exist_ok=True)
+    gauge("last_flush_timestamp_seconds", round(time.time(), 3))
+
+    with _lock:
+        spans = _spans[:]
+        _spans.clear()
+    with open(os.path.join(directory, "events.jsonl"), "a", encoding="utf-8") as f:
+        for record in spans:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.write(json.dumps({"type": "metrics", "time": round(time.time(), 3), **snapshot()},
+                           ensure_ascii=False) + "\n")
+
+    # textfile collector 可能隨時來讀，先寫暫存檔再換名
+    path = os.path.join(directory, "taiwanbot.prom")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+def reset():
+    """清掉所有資料 (效能測試用)"""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _bucket_bounds.clear()
+
+
+describe("span_duration_seconds", "流程各階段 (span) 耗時")
+describe("http_requests_total", "對外 HTTP 請求數 (依 endpoint / method / 狀態碼)")
+describe("http_request_duration_seconds", "對外 HTTP 請求延遲 (到收到回應標頭)")
+describe("http_request_bytes", "送出的 request body 大小")
+describe("http_response_bytes", "回應大小 (Content-Length)")
@@ -0,0 +1,171 @@
+"""鄉鎮預報 (F-D0047-xxx) 串流解析
+
+F-D0047 全台資料集一次幾十 MB，整包 response.json() 會把整棵樹放進記憶體。
+這裡改成邊下載邊掃描：
+1. 只找 "LocationsName" (縣市) 與 "Location": [ (鄉鎮陣列)
+2. 鄉鎮陣列裡一次只解一個 { ... } 物件 (JSONDecoder.raw_decode)
+3. 只保留需要的天氣因子與前 N 個時段，處理完就丟掉緩衝區
+
+所以記憶體上限大約是「一個鄉鎮物件 + 一個下載區塊」，跟整包大小無關。
+鄉鎮會掛回 REGION_MAP 的 區域 → 縣市 → 鄉鎮 階層。
+
+用法：
+    python taiwanbot.py township [--county 臺北市 ...] [-o FILE]
+不指定縣市時只保留偏好檔裡訂閱者選的縣市 (沒有偏好檔或有人選全台時保留全部)。
+"""
+import codecs
+import json
+import os
+import re
+
+import http_client
+from regions import COUNTY_TO_REGION, REGION_MAP
+
+CWA_API_BASE = os.environ.get("CWA_API_BASE", "https://opendata.cwa.gov.tw")
+
+# 全台鄉鎮未來 3 天 (逐 3 小時)；一週預報為 F-D0047-091
+DEFAULT_DATASET = "F-D0047-089"
+DEFAULT_MAX_PERIODS = 8
+CHUNK_SIZE = 64 * 1024
+
+# ElementName → (簡寫, ElementValue 裡的欄位)
+ELEMENTS = {
+    "溫度": ("T", "Temperature"),
+    "平均溫度": ("T", "Temperature"),
+    "最高溫度": ("MaxT", "MaxTemperature"),
+    "最低溫度": ("MinT", "MinTemperature"),
+    "3小時降雨機率": ("PoP", "ProbabilityOfPrecipitation"),
+    "12小時降雨機率": ("PoP", "ProbabilityOfPrecipitation"),
+    "天氣現象": ("Wx", "Weather"),
+}
+
+_KEY_RE = re.compile(r'"LocationsName"\s*:\s*"((?:[^"\\]|\\.)*)"|"Location"\s*:\s*\[')
+_WS_RE = re.compile(r"[\s,]*")
+_DECODER = json.JSONDecoder()
+# 找不到關鍵字時保留的尾巴長度 (避免關鍵字剛好被切成兩半)
+_TAIL = 256
+# 單一鄉鎮物件的上限，超過代表資料格式有問題，不再無限累積
+MAX_OBJECT_CHARS = 8 * 1024 * 1024
+
+
+def _slim_township(obj, county, elements, max_periods):
+    """只留需要的因子與時段"""
+    kept = {}
+    for element in obj.get("WeatherElement", []):
+        spec = elements.get(element.get("ElementName"))
+        if not spec:
+            continue
+        key, field = spec
+        series = []
+        for t in element.get("Time", [])[:max_periods]:
+            value = (t.get("ElementValue") or [{}])[0]
+            series.append((t.get("StartTime") or t.get("DataTime"), value.get(field)))
+        kept[key] = series
+    return {
+        "region": COUNTY_TO_REGION.get(county),
+        "county": county,
+        "township": obj.get("LocationName"),
+        "geocode": obj.get("Geocode"),
+        "lat": float(obj["Latitude"]) if obj.get("Latitude") else None,
+        "lon": float(obj["Longitude"]) if obj.get("Longitude") else None,
+        "elements": kept,
+    }
+
+
+def iter_townships(chunks, elements=None, max_periods=DEFAULT_MAX_PERIODS, counties=None):
+    """
+    從 bytes 區塊 (例如 response.iter_content()) 逐一產生精簡後的鄉鎮預報。
+    counties 是要保留的縣市 (None 代表全部)，其他縣市的鄉鎮解完就丟，不會精簡也不會產生。
+    假設每個 Locations 物件裡 "LocationsName" 出現在 "Location" 陣列之前 (氣象局目前的順序)。
+    """
+    elements = elements or ELEMENTS
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    county = None
+    in_array = False
+
+    for chunk in chunks:
+        buf += decoder.decode(chunk)
+        pos = 0
+        while True:
+            if in_array:
+                pos = _WS_RE.match(buf, pos).end()
+                if pos >= len(buf):
+                    break
+                if buf[pos] == "]":
+                    in_array = False
+                    pos += 1
+                    continue
+                try:
+                    # raw_decode 在 C 裡跑；物件還沒下載完會失敗，等下一塊再試
+                    obj, end = _DECODER.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if len(buf) - pos > MAX_OBJECT_CHARS:
+                        raise ValueError("鄉鎮物件過大或格式錯誤")
+                    break
+                if counties is None or county in counties:
+                    yield _slim_township(obj, county, elements, max_periods)
+                pos = end
+                continue
+
+            m = _KEY_RE.search(buf, pos)
+            if not m:
+                pos = max(pos, len(buf) - _TAIL)
+                break
+            if m.group(1) is not None:
+                county = json.loads(f'"{m.group(1)}"')
+            else:
+                in_array = True
+            pos = m.end()
+
+        # 丟掉已處理的部分，緩衝區只留下未完成的物件
+        buf = buf[pos:]
+
+    if in_array:
+        raise ValueError("鄉鎮預報資料不完整 (下載中斷?)")
+
+
+def group_by_region(townships):
+    """整理成 {區域: {縣市: [鄉鎮...]}}，區域與縣市順序照 REGION_MAP"""
+    tree = {region: {county: [] for county in counties} for region, counties in REGION_MAP.items()}
+    for t in townships:
+        if t["region"]:
+            tree[t["region"]][t["county"]].append(t)
+    return tree
+
+
+def describe(township):
+    """一行文字摘要 (第一個時段)：「臺北市大安區：多雲，28°，降雨 20%」"""
+    def first(key):
+        series = township["elements"].get(key) or [(None, None)]
+        return series[0][1]
+
+    parts = [first("Wx") or "?"]
+    if first("T") is not None:
+        parts.append(f"{first('T')}°")
+    elif first("MinT") is not None or first("MaxT") is not None:
+        parts.append(f"{first('MinT') or '?'}-{first('MaxT') or '?'}°")
+    if first("PoP") not in (None, "", " ", "-"):
+        parts.append(f"降雨 {first('PoP')}%")
+    return f"{township['county']}{township['township']}：{'，'.join(parts)}"
+
+
+def fetch_townships(api_key, dataset=DEFAULT_DATASET, elements=None, max_periods=DEFAULT_MAX_PERIODS,
+                    counties=None, deadline=None):
+    """
+    串流下載並解析鄉鎮預報 (只保留 counties 的鄉鎮)，回傳精簡後的鄉鎮 list；失敗回傳 None。
+    deadline (time.perf_counter 的截止時間) 會交給 http_client，重試與 timeout 不超過預算
+    """
+    print(f"📡 正在串流下載鄉鎮預報 ({dataset})...")
+    url = f"{CWA_API_BASE}/api/v1/rest/datastore/{dataset}?Authorization={api_key}&format=JSON"
+    try:
+        with http_client.get("cwa_township", url, stream=True, deadline=deadline) as resp:
+            if resp.status_code != 200:
+                print(f"❌ 氣象局拒絕連線 (Code: {resp.status_code})")
+                return None
+            townships = list(iter_townships(resp.iter_content(CHUNK_SIZE), elements, max_periods, counties))
+        print(f"✅ 取得 {len(townships)} 個鄉鎮預報")
+        return townships
+    except Exception as e:
+        print(f"❌ 鄉鎮預報解析失敗: {e}")
+        return None
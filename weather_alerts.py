@@ -0,0 +1,354 @@
+"""天氣警特報即時推播 (W-C0033-001)
+
+高頻輪詢氣象局「各縣市目前的天氣警特報」，只處理新增或變更的特報，並只推給受影響縣市的訂閱者：
+1. 條件式請求 (ETag / Last-Modified)：沒更新時伺服器回 304，連內容都不用下載
+2. 下載後內容雜湊沒變：不解析
+3. 解析後和上一次的狀態比對 (縣市 + 現象 + 等級 為一筆，有效時間不同算變更)，沒有新增 / 變更就結束
+4. 有變化才查「縣市 → 訂閱者」索引，只推給偏好縣市有新特報的人；內容以區域為單位，
+   每種內容只渲染一次，走 LINE outbox 發送
+
+索引依 preferences 的縣市偏好建立 (區域會展開成 REGION_MAP 的縣市)，
+只在訂閱者名單或偏好檔變動後、真的有特報要發時才重建，平常輪詢不會掃描訂閱者。
+
+用法：
+    python taiwanbot.py alerts [--interval 60] [--once]
+或在長駐排程器設定 ALERT_CRON (例如 "* * * * *")。
+"""
+import hashlib
+import json
+import os
+import signal
+import threading
+import time
+
+import cwa_snapshot
+import http_client
+import telemetry
+from preferences import ALL_CITIES, PREFS_FILE, load_preferences
+from regions import COUNTY_TO_REGION, REGION_MAP
+
+CWA_API_KEY = os.environ.get("CWA_API_KEY")
+CWA_API_BASE = os.environ.get("CWA_API_BASE", "https://opendata.cwa.gov.tw")
+ALERT_DATASET = os.environ.get("ALERT_DATASET", "W-C0033-001")
+ALERT_INTERVAL = float(os.environ.get("ALERT_INTERVAL", 60))
+# 本機訂閱者名單超過這麼久沒同步，發特報前先向 GAS 增量同步一次
+SUBSCRIBER_MAX_AGE = float(os.environ.get("ALERT_SUBSCRIBER_MAX_AGE", 60 * 60))
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+LINE_TOKEN = os.environ.get("LINE_TOKEN")
+LINE_USER_ID = os.environ.get("LINE_USER_ID")
+
+# 縣市的顯示順序 (REGION_MAP 由北到南)
+_COUNTY_ORDER = {county: i for i, county in enumerate(COUNTY_TO_REGION)}
+
+
+def _county_name(name):
+    return (name or "").strip().replace("台", "臺")
+
+
+def parse_alerts(payload):
+    """W-C0033-001 → {alert_id: {"county", "phenomena", "significance", "start", "end"}}"""
+    alerts = {}
+    for loc in payload.get("records", {}).get("location", []):
+        county = _county_name(loc.get("locationName"))
+        hazards = (loc.get("hazardConditions") or {}).get("hazards") or []
+        for hazard in hazards:
+            info = hazard.get("info") or {}
+            valid = hazard.get("validTime") or {}
+            phenomena, significance = info.get("phenomena"), info.get("significance")
+            if not county or not phenomena:
+                continue
+            alert_id = f"{county}|{phenomena}{significance or ''}"
+            alerts[alert_id] = {
+                "county": county,
+                "phenomena": phenomena,
+                "significance": significance or "",
+                "start": valid.get("startTime"),
+                "end": valid.get("endTime"),
+            }
+    return alerts
+
+
+def _fingerprint(alert):
+    return f"{alert['start']}~{alert['end']}"
+
+
+def diff_alerts(previous, current):
+    """
+    previous 是 {alert_id: fingerprint}；回傳 (新增, 變更, 解除)：
+    新增 / 變更是 alert dict 的 list，解除是 alert_id 的 list
+    """
+    new, changed = [], []
+    for alert_id, alert in current.items():
+        before = previous.get(alert_id)
+        if before is None:
+            new.append(alert)
+        elif before != _fingerprint(alert):
+            changed.append(alert)
+    cleared = [alert_id for alert_id in previous if alert_id not in current]
+    return new, changed, cleared
+
+
+class SubscriberIndex:
+    """
+    縣市 / 區域 → 訂閱者。訂閱者先依偏好分組 (group 數通常只有幾十種)，
+    縣市對應到「有訂這個縣市的 group」，查詢時只碰到相關的 group。
+    """
+
+    def __init__(self, subscriber_ids, prefs):
+        self.groups = {}  # 偏好 (frozenset 或 ALL_CITIES) → [訂閱者]
+        for sid in subscriber_ids:
+            self.groups.setdefault(prefs.get(sid, ALL_CITIES), []).append(sid)
+        self.by_county = {county: [] for county in COUNTY_TO_REGION}
+        for pref in self.groups:
+            for county in (COUNTY_TO_REGION if pref is ALL_CITIES else pref):
+                self.by_county[county].append(pref)
+        self.size = sum(len(ids) for ids in self.groups.values())
+
+    def groups_for(self, counties):
+        """受這些縣市影響的 {偏好: [訂閱者]}"""
+        prefs = {pref for county in counties for pref in self.by_county.get(county, ())}
+        return {pref: self.groups[pref] for pref in prefs}
+
+    def groups_for_region(self, region):
+        return self.groups_for(REGION_MAP.get(region, ()))
+
+
+def _short_time(text):
+    """"2026-10-17 14:00:00" → "10/17 14:00"""
+    if not text or len(text) < 16:
+        return text or "?"
+    return f"{text[5:7]}/{text[8:10]} {text[11:16]}"
+
+
+def render_alert_text(alerts, title="⚠️ 天氣特報"):
+    """同一種特報 (現象 + 等級 + 時間) 合併成一行，縣市由北到南排列"""
+    merged = {}
+    for a in alerts:
+        merged.setdefault((a["phenomena"], a["significance"], a["start"], a["end"]), []).append(a["county"])
+    lines = [title]
+    for (phenomena, significance, start, end), counties in sorted(merged.items()):
+        counties.sort(key=lambda c: _COUNTY_ORDER.get(c, 99))
+        lines.append(f"🔸 {phenomena}{significance}：{'、'.join(counties)}")
+        lines.append(f"   {_short_time(start)} ~ {_short_time(end)}")
+    lines.append("請留意最新氣象資訊，注意安全。")
+    return "\n".join(lines)
+
+
+def plan_messages(alerts, index):
+    """
+    依偏好分組決定誰要收到哪些特報：回傳 [(LINE messages, [訂閱者...])]。
+    只有偏好縣市有新特報的訂閱者會收到；內容則以「區域」為單位 (訂閱者偏好縣市所在區域的全部特報)，
+    全台性的特報 (例如颱風) 也最多只有 2^5 種內容，multicast 批次才不會被切成上千個小請求。
+    """
+    by_region = {}
+    for a in alerts:
+        by_region.setdefault(COUNTY_TO_REGION.get(a["county"]), []).append(a)
+    counties = {a["county"] for a in alerts}
+
+    by_content = {}  # 區域 tuple → (messages, 訂閱者)
+    for pref, ids in index.groups_for(counties).items():
+        if pref is ALL_CITIES:
+            regions = tuple(r for r in by_region)
+        else:
+            regions = tuple(r for r in by_region if any(a["county"] in pref for a in by_region[r]))
+        if regions not in by_content:
+            relevant = [a for r in regions for a in by_region[r]]
+            by_content[regions] = ([{"type": "text", "text": render_alert_text(relevant)}], [])
+        by_content[regions][1].extend(ids)
+    return list(by_content.values())
+
+
+def _state_path(dataset):
+    return os.path.join(cwa_snapshot.SNAPSHOT_DIR, f"{dataset}.alerts.json")
+
+
+class AlertWatcher:
+    """保存上一次輪詢的狀態 (ETag、內容雜湊、目前特報) 與訂閱者索引，長駐模式下跨次重用"""
+
+    def __init__(self, dataset=ALERT_DATASET, api_base=None, state_path=None):
+        self.dataset = dataset
+        self.url = f"{api_base or CWA_API_BASE}/api/v1/rest/datastore/{dataset}"
+        self.state_path = state_path or _state_path(dataset)
+        self.state = self._load_state()
+        self._index = None
+        self._index_version = None
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"alerts": {}}
+
+    def _save_state(self):
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, ensure_ascii=False)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"⚠️ 特報狀態寫入失敗: {e}")
+
+    def _fetch(self):
+        """回傳 (原始 bytes 或 None, 回應)；304 時 bytes 是 None"""
+        headers = cwa_snapshot.conditional_headers(self.state)
+        resp = http_client.get("cwa_alerts", self.url, headers=headers,
+                               params={"Authorization": CWA_API_KEY, "format": "JSON"})
+        if resp.status_code == 304:
+            return None, resp
+        if resp.status_code != 200:
+            raise RuntimeError(f"氣象局回應 {resp.status_code}")
+        return resp.content, resp
+
+    def subscriber_index(self):
+        """名單 (SQLite 同步時間) 或偏好檔沒變就沿用上一次建好的索引"""
+        from subscribers import DB_PATH, SubscriberStore, parse_env_ids, sync_from_gas
+
+        subscriber_api_url = os.getenv("SUBSCRIBER_API_URL")
+        with SubscriberStore(DB_PATH) as store:
+            synced_at = float(store.get_meta("synced_at", 0))
+            if subscriber_api_url and time.time() - synced_at > SUBSCRIBER_MAX_AGE:
+                sync_from_gas(store, subscriber_api_url)
+                synced_at = float(store.get_meta("synced_at", 0))
+            try:
+                prefs_mtime = os.path.getmtime(PREFS_FILE)
+            except OSError:
+                prefs_mtime = None
+            version = (synced_at, prefs_mtime, LINE_USER_ID)
+            if self._index is None or version != self._index_version:
+                with telemetry.span("特報索引") as sp:
+                    ids = parse_env_ids(LINE_USER_ID)
+                    ids.update(store)
+                    self._index = SubscriberIndex(ids, load_preferences())
+                    self._index_version = version
+                    sp.set(subscribers=self._index.size, groups=len(self._index.groups))
+        return self._index
+
+    def poll(self):
+        """
+        輪詢一次，回傳這次的結果：
+        "not_modified" / "unchanged" (內容雜湊相同) / "no_new" (只有解除) / "delivered" /
+        "retry" (有特報暫時送不出去，狀態不更新，下次輪詢重來)
+        """
+        with telemetry.span("特報輪詢", dataset=self.dataset) as sp:
+            raw, resp = self._fetch()
+            if raw is None:
+                result = "not_modified"
+            else:
+                digest = cwa_snapshot.content_hash(raw)
+                # ETag / Last-Modified 要等這份內容處理完才記下，否則下次會拿到 304 而漏掉沒送出的特報
+                validators = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+                if digest == self.state.get("content_hash"):
+                    result = "unchanged"
+                    if any(self.state.get(k) != v for k, v in validators.items()):
+                        self.state.update(validators)
+                        self._save_state()
+                else:
+                    result = self._process(json.loads(raw), digest, validators)
+            sp.set(result=result)
+        telemetry.count("alert_polls_total", result=result)
+        return result
+
+    def _process(self, payload, digest, validators):
+        current = parse_alerts(payload)
+        new, changed, cleared = diff_alerts(self.state.get("alerts", {}), current)
+        for alert_id in cleared:
+            print(f"✅ 特報解除：{alert_id.replace('|', ' ')}")
+
+        result = "no_new"
+        if new or changed:
+            print(f"🚨 特報新增 {len(new)} / 變更 {len(changed)}")
+            result = "delivered"
+            if not self._deliver(new + changed, digest):
+                # 狀態 (連同 ETag) 都不更新：下次輪詢重新下載、比對出同一批特報，outbox 只續傳沒送達的批次
+                print("⚠️ 部分特報暫時送不出去，下次輪詢再試")
+                return "retry"
+
+        # 發送完成後才和 ETag / Last-Modified 一起記下狀態：中途失敗時下次輪詢會再處理同一批
+        self.state["alerts"] = {alert_id: _fingerprint(a) for alert_id, a in current.items()}
+        self.state["content_hash"] = digest
+        self.state.update(validators)
+        self._save_state()
+        return result
+
+    def _deliver(self, alerts, digest):
+        """回傳 Discord 和 LINE 是否都送達了 (有暫時性錯誤 — 429 / 5xx / 連線失敗 — 時為 False)"""
+        # 同一批特報的 key：LINE 的 outbox 和 Discord 的送達紀錄共用，重試時不會重複發送
+        key = hashlib.sha256(json.dumps(sorted(a["county"] + _fingerprint(a) + a["phenomena"] for a in alerts),
+                                        ensure_ascii=False).encode()).hexdigest()[:16]
+        broadcast_id = f"alert:{self.dataset}:{key}"
+        ok = self._deliver_discord(alerts, broadcast_id)
+
+        if not LINE_TOKEN:
+            return ok
+        from line_delivery import deliver_durable, print_delivery_report, retryable
+
+        index = self.subscriber_index()
+        planned = plan_messages(alerts, index)
+        recipients = sum(len(ids) for _, ids in planned)
+        print(f"🎯 受影響的訂閱者 {recipients} / {index.size} 位，共 {len(planned)} 種內容")
+        if planned:
+            # 同一份特報內容重新執行會續傳，不會重複發送
+            results = deliver_durable(planned, LINE_TOKEN, broadcast_id)
+            print_delivery_report(results)
+            ok = ok and not any(not r["ok"] and retryable(r["status"]) for r in results.values())
+        return ok
+
+    def _deliver_discord(self, alerts, broadcast_id):
+        """送到 Discord 並記下這批特報已送達；上次已送達 (LINE 重試中) 就跳過。回傳是否不需要再重試"""
+        if not WEBHOOK_URL:
+            return True
+        if self.state.get("discord_sent") == broadcast_id:
+            print("⏭️ 這批特報 Discord 已經送過，略過")
+            return True
+        text = render_alert_text(alerts)[:2000]
+        try:
+            status = http_client.post("discord", WEBHOOK_URL, json={"content": text}).status_code
+        except Exception as e:
+            print(f"❌ Discord 特報發送失敗: {e}")
+            return False
+        if not 200 <= status < 300:
+            print(f"❌ Discord 特報發送失敗: HTTP {status}")
+            from line_delivery import retryable
+            return not retryable(status)
+        # 馬上存檔：LINE 送不完時 _process 不會存狀態，下次輪詢靠這筆紀錄跳過 Discord
+        self.state["discord_sent"] = broadcast_id
+        self._save_state()
+        return True
+
+
+_watcher = None
+
+
+def poll_once():
+    """輪詢一次 (給排程器用)；同一個行程裡共用同一個 watcher 與索引"""
+    global _watcher
+    if _watcher is None:
+        _watcher = AlertWatcher()
+    try:
+        _watcher.poll()
+    except Exception as e:
+        print(f"⚠️ 特報輪詢失敗: {e}")
+        return 1
+    finally:
+        telemetry.flush()
+    return 0
+
+
+def run(interval=ALERT_INTERVAL, once=False):
+    """每 interval 秒輪詢一次，SIGTERM / SIGINT 時在這一輪結束後離開"""
+    if once:
+        return poll_once()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    print(f"🚨 特報輪詢啟動：{ALERT_DATASET}，每 {interval:g} 秒一次")
+    while not stop.is_set():
+        started = time.perf_counter()
+        poll_once()
+        stop.wait(max(interval - (time.perf_counter() - started), 0))
+    http_client.close()
+    print("👋 特報輪詢已停止")
+    return 0
@@ -1,133 +1,336 @@
-import requests
-from google import genai  # 🟢 改用新版 SDK
+import functools
 import os
 import sys
-from dotenv import load_dotenv
-
-# 載入 .env 檔案
-load_dotenv()
+import time
+import http_client
+import ai_cache
+import ai_json
+import telemetry
+import cwa_snapshot
+from regions import COUNTY_TO_REGION, REGION_MAP
+from forecast_table import BLANK, ForecastTable, build_forecast_table
+from subscribers import get_subscriber_ids
+from preferences import group_by_preference, load_locations, load_preferences
+from line_delivery import deliver_durable, print_delivery_report, retryable
+from flex_templates import Template, json_array, slots
+from pipeline import Deadline, StageTimer
 
 # ================= 設定區 =================
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 CWA_API_KEY = os.environ.get("CWA_API_KEY")
+CWA_DATASET = "F-C0032-001"
+# API 位址可以換成代理或本機假伺服器 (benchmarks/bench_e2e.py)
+CWA_API_BASE = os.environ.get("CWA_API_BASE", "https://opendata.cwa.gov.tw")
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE")
+AI_MODEL = "gemini-3-flash-preview"
+# 主要模型逾時 / 失敗時改用的輕量模型
+AI_FALLBACK_MODEL = os.environ.get("GEMINI_FALLBACK_MODEL", "gemini-2.5-flash-lite")
+
+# 預報沒更新時是否略過廣播 (高頻輪詢時打開，避免重複洗版)
+SKIP_UNCHANGED_BROADCAST = os.environ.get("SKIP_UNCHANGED_BROADCAST") == "1"
+# 忽略快照，強制重新下載
+CWA_FORCE_REFRESH = os.environ.get("CWA_FORCE_REFRESH") == "1"
+# 要播報哪個 12 小時時段 (0 = 今日, 1 = 今晚明晨, 2 = 明日)
+FORECAST_PERIOD = int(os.environ.get("FORECAST_PERIOD", 0))
+# 高溫和昨天同時段差這麼多度以上，卡片與 Discord 才標示 ▲ / ▼
+TREND_DEGREES = int(os.environ.get("TREND_DEGREES", 3))
 # ==========================================
 
 # Line Bot 設定
 LINE_TOKEN = os.environ.get("LINE_TOKEN")
 LINE_USER_ID = os.environ.get("LINE_USER_ID")
 
-# 1. 檢查鑰匙有沒有帶到 (除錯關鍵)
-if not CWA_API_KEY:
-    print("❌ 嚴重錯誤：找不到 CWA_API_KEY！")
-    print("請檢查你的 .github/workflows/xxx.yml 裡面，env: 底下有沒有寫 CWA_API_KEY")
-    sys.exit(1)
-
-# 📍 定義區域與縣市對照表
-REGION_MAP = {
-    "北部地區": ["基隆市", "臺北市", "新北市", "桃園市", "新竹市", "新竹縣", "苗栗縣"],
-    "中部地區": ["臺中市", "彰化縣", "南投縣", "雲林縣", "嘉義市", "嘉義縣"],
-    "南部地區": ["臺南市", "高雄市", "屏東縣"],
-    "東部地區": ["宜蘭縣", "花蓮縣", "臺東縣"],
-    "外島地區": ["澎湖縣", "金門縣", "連江縣"]
-}
-
-def get_taiwan_weather_data():
+# Gemini client 只建一次 (長駐模式下跨次重用)
+_genai_client = None
+
+def load_trends(table, period=0):
+    """
+    把這次的預報附加到預報歷史，回傳這個時段的 forecast_history.Trends。
+    歷史檔讀寫失敗時回傳 None，卡片照常發送 (只是沒有和昨天的比較)。
+    """
+    try:
+        import forecast_history  # 用到 numpy，只有真的要比較時才載入
+
+        history = forecast_history.load()
+        added = history.append_table(table)
+        trends = history.trends(forecast_history.parse_time(table.periods[period][0]))
+        print(f"📈 預報歷史新增 {added} 筆 (共 {len(history)} 筆、{trends.days} 天)")
+        return trends
+    except Exception as e:
+        print(f"⚠️ 預報歷史讀寫失敗，略過和昨天的比較: {e}")
+        return None
+
+def trend_badge(trend):
+    """溫度後面的標示：高溫 / 低溫創紀錄 🔥 / ❄️，或高溫和昨天差 TREND_DEGREES 度以上的 ▲n / ▼n"""
+    if trend["record_high"]:
+        return " 🔥"
+    if trend["record_low"]:
+        return " ❄️"
+    delta = trend["max_day"]
+    if delta is None or abs(delta) < TREND_DEGREES:
+        return ""
+    return f" {'▲' if delta > 0 else '▼'}{abs(delta):.0f}"
+
+def trend_phrases(trend):
+    """給 AI 看的比較 (只列有資料的)"""
+    phrases = []
+    if trend["max_day"] is not None:
+        phrases.append(f"高溫比昨天{trend['max_day']:+.0f}度")
+    if trend["min_day"] is not None:
+        phrases.append(f"低溫比昨天{trend['min_day']:+.0f}度")
+    if trend["max_week"] is not None and abs(trend["max_week"]) >= TREND_DEGREES:
+        phrases.append(f"高溫比上週{trend['max_week']:+.0f}度")
+    if trend["max_avg7"] is not None:
+        phrases.append(f"近7日平均高溫{trend['max_avg7']:.1f}度")
+    if trend["record_high"]:
+        phrases.append("高溫是有紀錄以來最高")
+    if trend["record_low"]:
+        phrases.append("低溫是有紀錄以來最低")
+    return phrases
+
+def forecast_views(table, period=0, trends=None):
+    """
+    從預報表取出某個時段的 (weather_data, raw_data_list, time_range)；
+    有 trends (load_trends) 時，weather_data 的 "trend" 填上卡片標示，raw_data_list 附上給 AI 的比較
+    """
+    # weather_data 的 "display" 給 Discord (保留 **粗體**)，其他欄位給 Line Flex Message 重新排版
+    weather_data, raw_data_list = table.weather_data(period), table.raw_data_list(period)
+    if trends:
+        for i, city in enumerate(table.cities):
+            trend = trends.for_city(city)
+            badge = trend_badge(trend)
+            weather_data[city]["trend"] = badge
+            weather_data[city]["display"] += badge
+            phrases = trend_phrases(trend)
+            if phrases:
+                raw_data_list[i] += "；" + "、".join(phrases)
+    return weather_data, raw_data_list, table.time_range(period)
+
+def get_forecast_snapshot(force=False, budget=None):
+    """
+    取得最新預報快照，回傳 (snapshot, changed)。
+    - 還沒到氣象局下一個發布時間：直接用快照，不連線
+    - 下載後內容雜湊沒變：不重新解析，changed = False
+    - budget：抓資料階段的時間預算，請求的 timeout 不會超過它
+    失敗時回傳 (None, False)。
+    """
+    snapshot = cwa_snapshot.load(CWA_DATASET)
+    if not force and cwa_snapshot.is_fresh(snapshot):
+        print("💾 預報尚未更新，沿用快照 (略過下載)")
+        return snapshot, False
+
     print("📡 正在抓取氣象局資料...")
-    url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001?Authorization={CWA_API_KEY}&format=JSON"
+    url = f"{CWA_API_BASE}/api/v1/rest/datastore/{CWA_DATASET}?Authorization={CWA_API_KEY}&format=JSON"
     
     try:
-        response = requests.get(url, timeout=10)
+        response = http_client.get("cwa", url, headers=cwa_snapshot.conditional_headers(snapshot),
+                                   deadline=budget.expires_at() if budget else None)
+
+        if response.status_code == 304 and snapshot:
+            print("💾 氣象局回應 304，預報沒有變化")
+            cwa_snapshot.touch(CWA_DATASET, snapshot)
+            return snapshot, False
         
         # 🟢 除錯重點：如果狀態碼不是 200，印出原因
         if response.status_code != 200: 
             print(f"❌ 氣象局拒絕連線 (Code: {response.status_code})")
             print(f"回傳內容: {response.text}") # 看看它到底說什麼
-            return None, None, None
-            
-        data = response.json()
-        location_list = data['records']['location']
-        
-        weather_data = {} 
-        raw_data_list = [] 
-        
-        for location in location_list:
-            city = location['locationName']
-            wx = location['weatherElement'][0]['time'][0]['parameter']['parameterName']
-            pop = location['weatherElement'][1]['time'][0]['parameter']['parameterName']
-            min_t = location['weatherElement'][2]['time'][0]['parameter']['parameterName']
-            max_t = location['weatherElement'][4]['time'][0]['parameter']['parameterName']
-            
-            pop_val = int(pop)
-            if pop_val >= 60: icon = "🌧️"
-            elif pop_val >= 30: icon = "☂️"
-            elif "晴" in wx: icon = "☀️"
-            else: icon = "☁️"
+            return None, False
+
+        raw = response.content
+        digest = cwa_snapshot.content_hash(raw)
+        if snapshot and snapshot.get("content_hash") == digest:
+            print("💾 預報內容沒有變化，沿用上次解析結果")
+            cwa_snapshot.touch(CWA_DATASET, snapshot)
+            return snapshot, False
             
-            display_line = f"**{city}**\n└ {icon} {min_t}-{max_t}°C | 降雨 {pop}%"
-            # 🟢 [關鍵修改] 這裡把資料分兩份：
-            # 1. "display": 專門給 Discord 用的字串 (保留 **粗體** 格式)
-            # 2. 其他欄位 (city, min_t, etc): 給 Line Flex Message 用 (乾淨的數據，方便重新排版)
-            weather_data[city] = {
-                "display": display_line,  # 給 Discord 吃這行
-                "city": city,             # 以下給 Line 吃
-                "icon": icon,
-                "min_t": min_t,
-                "max_t": max_t,
-                "pop": pop_val
-            }
-            raw_data_list.append(f"{city}: {wx}, 氣溫{min_t}-{max_t}, 降雨{pop}%")
-
-        start_time = location_list[0]['weatherElement'][0]['time'][0]['startTime']
-        end_time = location_list[0]['weatherElement'][0]['time'][0]['endTime']
-        time_range = f"{start_time} ~ {end_time}"
-        
-        return weather_data, raw_data_list, time_range
+        # 依 elementName 一次建好 縣市 × 時段 × 因子 的預報表
+        with telemetry.span("CWA 解析", bytes=len(raw)):
+            table = build_forecast_table(response.json())
+        new_snapshot = {
+            "version": cwa_snapshot.SNAPSHOT_VERSION,
+            "dataset": CWA_DATASET,
+            "content_hash": digest,
+            "time_range": table.time_range(0),
+            # 第一個時段的開始時間，用來判斷這份預報是不是最近一次發布的 (cwa_snapshot.is_fresh)
+            "period_start": table.periods[0][0] if table.periods else None,
+            "fetched_at": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "table": table.to_dict(),
+            "broadcast_hash": snapshot.get("broadcast_hash") if snapshot else None
+        }
+        cwa_snapshot.save(CWA_DATASET, new_snapshot, raw)
+        return new_snapshot, True
 
     except Exception as e:
         print(f"❌ 抓取資料發生例外: {e}")
+        return None, False
+
+def get_taiwan_weather_data(period=0):
+    snapshot, _ = get_forecast_snapshot()
+    if not snapshot:
         return None, None, None
+    return forecast_views(ForecastTable.from_dict(snapshot["table"]), period)
+
+def _get_genai_client():
+    global _genai_client
+    if _genai_client is None:
+        # 🟢 改用新版 SDK；用到才載入 (只渲染卡片時不需要)
+        from google import genai
+        http_options = {"base_url": GEMINI_API_BASE} if GEMINI_API_BASE else None
+        _genai_client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+    return _genai_client
+
+def _generate(model, prompt, schema=None, timeout=None):
+    client = _get_genai_client()
+    # 有 schema 時要求模型直接輸出符合 schema 的 JSON；timeout (秒) 由時間預算決定
+    config = {"response_mime_type": "application/json", "response_schema": schema} if schema else {}
+    if timeout:
+        config["http_options"] = {"timeout": int(timeout * 1000)}
+    with telemetry.span("Gemini", model=model, prompt_chars=len(prompt)) as sp:
+        response = client.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=config or None
+        )
+        sp.set(response_chars=len(response.text or ""))
+    return response.text
+
+AI_FALLBACK_COMMENT = "🐭 AI 氣象鼠正在啃瓜子，暫時無法提供評論..."
+
+def _comment_schema(regions):
+    return ai_json.obj({
+        "summary": ai_json.string("全台評論：【今日重點】【天氣觀察】【貼心叮嚀】三段，150 字內", 150),
+        "regions": ai_json.obj({region: ai_json.string(f"{region}的一句話短評，30 字內", 30) for region in regions}),
+    })
+
+def template_comment(weather_data):
+    """
+    不靠 AI、由預報數字產生的評論 (最熱 / 最冷 / 最可能下雨的縣市)，回傳 (全台評論, {區域: 短評})。
+    AI 時間預算用完又沒有上一則評論時使用，內容一定和今天的數字一致。
+    """
+    # 缺值 (BLANK) 的縣市不參加比較
+    cities = [d for d in weather_data.values() if BLANK not in (d["min_t"], d["max_t"], d["pop"])]
+    complete = {d["city"] for d in cities}
+    if not cities:
+        return AI_FALLBACK_COMMENT, {}
+    hot = max(cities, key=lambda d: int(d["max_t"]))
+    cold = min(cities, key=lambda d: int(d["min_t"]))
+    wet = max(cities, key=lambda d: d["pop"])
 
-def get_ai_comment(raw_data_list):
-    print("☕ 呼叫 gemini-3-flash-preview...")
-    weather_text = "\n".join(raw_data_list)
+    if wet["pop"] >= 30:
+        observe = f"{wet['city']}降雨機率 {wet['pop']}%，是今天最可能下雨的地方。"
+    else:
+        observe = f"各地降雨機率都在 {wet['pop']}% 以下，大致是好天氣。"
+    if wet["pop"] >= 50:
+        advice = "出門記得帶把傘☂️"
+    elif int(hot["max_t"]) >= 32:
+        advice = "注意防曬、多補充水分🥤"
+    elif int(cold["min_t"]) <= 15:
+        advice = "早晚偏涼，記得加件外套🧥"
+    else:
+        advice = "天氣穩定，適合出門走走🚶"
+    summary = (f"【今日重點】全台最熱在{hot['city']} {hot['max_t']}°，最冷在{cold['city']} {cold['min_t']}°。\n"
+               f"【天氣觀察】{observe}\n"
+               f"【貼心叮嚀】{advice}")
+
+    regions = {}
+    for region, names in REGION_MAP.items():
+        rows = [weather_data[c] for c in names if c in complete]
+        if rows:
+            r_hot = max(rows, key=lambda d: int(d["max_t"]))
+            r_wet = max(rows, key=lambda d: d["pop"])
+            regions[region] = f"{r_hot['city']}最高 {r_hot['max_t']}°，{r_wet['city']}降雨 {r_wet['pop']}%"
+    return summary, regions
+
+def get_ai_comment(raw_data_list, weather_data=None, budget=None):
+    """
+    一次呼叫同時拿到全台評論和各區域短評 (結構化 JSON 輸出)，回傳 (全台評論, {區域: 短評})。
+    在 budget (AI 階段的時間預算) 內依序降級：
+    主要模型 → 輕量模型 → 上一則成功的評論 (區域短評改用樣板) → 由 weather_data 產生的樣板評論
+    """
+    budget = budget or Deadline().stage("ai")
+    print(f"☕ 呼叫 {AI_MODEL}...")
+    try:
+        _get_genai_client()  # SDK 載入也算在預算裡，先做完再分配各模型的 timeout
+    except Exception as e:
+        print(f"⚠️ Gemini client 建立失敗: {e}")
+    # 依區域分組，讓模型知道每一區包含哪些縣市
+    grouped = {}
+    for line in raw_data_list:
+        region = COUNTY_TO_REGION.get(line.partition(":")[0])
+        if region:
+            grouped.setdefault(region, []).append(line)
+    regions = [region for region in REGION_MAP if region in grouped]
+    weather_text = "\n".join(f"[{region}]\n" + "\n".join(grouped[region]) for region in regions)
     
     prompt = f"""
     你是個講話「輕鬆幽默」且「點到為止」的氣象播報員。
-    以下是台灣最新的天氣預報數據：
+    以下是台灣最新的天氣預報數據 (依區域分組)：
     {weather_text}
 
-    請產出氣象評論 (150字內，繁體中文)，請包含：
-    1. 【今日重點】：平舖直敘天氣狀況。
-    2. 【天氣觀察】：選一個地區簡單描述生活共鳴。
-    3. 【貼心叮嚀】：穿搭或生活建議。
+    請用繁體中文輸出 JSON：
+    - summary：全台氣象評論 (150字內)，包含
+      1. 【今日重點】：平舖直敘天氣狀況。
+      2. 【天氣觀察】：選一個地區簡單描述生活共鳴。
+      3. 【貼心叮嚀】：穿搭或生活建議。
+    - regions：每個區域一句話短評 (30字內)，點出該區最值得注意的天氣。
+    數據後面若附有和昨天 / 上週的比較，溫差明顯或創紀錄時請順便提到 (例如「臺北市比昨天涼 5 度」)。
     """
     
     try:
-        # 🟢 改用新版 client 寫法
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        response = client.models.generate_content(
-            model="gemini-3-flash-preview", 
-            contents=prompt
-        )
-        return response.text
+        # 相同輸入直接讀快取，不重複呼叫模型；逾時 / 格式壞掉就換輕量模型
+        result, model = ai_json.generate_within([AI_MODEL, AI_FALLBACK_MODEL], prompt, _comment_schema(regions),
+                                                _generate, budget)
+        summary = result["summary"].strip()
+        comments = {region: text.strip() for region, text in result["regions"].items()}
+        ai_cache.remember("weather_comment", summary)
+        tier = "primary" if model == AI_MODEL else "lighter"
     except Exception as e:
         print(f"❌ AI 錯誤: {e}")
-        return "🐭 AI 氣象鼠正在啃瓜子，暫時無法提供評論..."
+        previous = ai_cache.recall("weather_comment")
+        template_summary, comments = template_comment(weather_data or {})
+        # 上一則評論的區域短評可能和今天的數字對不上，區域一律用樣板
+        summary, tier = (previous, "previous") if previous else (template_summary, "template")
 
-def send_webhook(weather_data, ai_comment, time_range):
-    print("🚀 正在組裝 Discord 卡片...")
-    
+    label = {"primary": f"主要模型 {AI_MODEL}", "lighter": f"輕量模型 {AI_FALLBACK_MODEL}",
+             "previous": "上一則評論", "template": "樣板評論"}[tier]
+    left = budget.finish(label)
+    telemetry.count("ai_fallback_total", bot="weather", tier=tier)
+    print(f"🪜 AI 點評來源：{label} (預算剩 {left:.1f}s)")
+    return summary, comments
+
+def _region_field(region_name, region_content):
+    return {
+        "name": f"🔹 {region_name}",
+        "value": region_content,
+        "inline": True
+    }
+
+def _ai_field(ai_comment):
+    return {
+        "name": "🐭 Ai氣象鼠點評",
+        "value": f">>> {ai_comment}",
+        "inline": False
+    }
+
+def _webhook_layout(time_range, fields):
     embed = {
         "title": "🌤️ 全台氣象播報",
         "description": f"📅 **預報時間**\n{time_range}",
         "color": 15105570,
-        "fields": [],
+        "fields": fields,
         "footer": {
             "text": "Powered by CWA & Gemini AI"
         }
     }
-    
+    return {"content": "", "embeds": [embed]}
+
+def _region_contents(weather_data, region_comments=None):
+    """[(區域名, 該區文字)]，沒有資料的區域略過；有 AI 區域短評時接在最後一行"""
+    contents = []
     for region_name, cities in REGION_MAP.items():
         region_content = ""
         for city in cities:
@@ -135,32 +338,92 @@ def send_webhook(weather_data, ai_comment, time_range):
                 # 🟢 [Discord 專用] 這裡只拿 "display" 那一格
                 # 所以 Discord 收到的還是原本的格式 (含粗體)，完全不受 Line 改版的影響
                 region_content += weather_data[city]["display"] + "\n"
-        
+        if region_content and region_comments and region_comments.get(region_name):
+            region_content += f"💬 {region_comments[region_name]}\n"
         if region_content:
-            embed["fields"].append({
-                "name": f"🔹 {region_name}",
-                "value": region_content,
-                "inline": True
-            })
+            contents.append((region_name, region_content))
+    return contents
 
-    embed["fields"].append({
-        "name": "🐭 Ai氣象鼠點評",
-        "value": f">>> {ai_comment}",
-        "inline": False
-    })
+def build_webhook_payload(weather_data, ai_comment, time_range, region_comments=None):
+    """Discord webhook 的 dict 版本 (預覽、比對用)"""
+    fields = [_region_field(name, content) for name, content in _region_contents(weather_data, region_comments)]
+    fields.append(_ai_field(ai_comment))
+    return _webhook_layout(time_range, fields)
+
+def render_webhook_bytes(weather_data, ai_comment, time_range, region_comments=None):
+    """用預先編譯的樣板產生 Discord webhook body (和 build_webhook_payload 逐 byte 相同)"""
+    t = _templates()
+    fields = [t["field"].render(region_name=name, region_content=content)
+              for name, content in _region_contents(weather_data, region_comments)]
+    fields.append(t["ai_field"].render(ai_comment=ai_comment))
+    return t["webhook"].render(time_range=time_range, fields=json_array(fields))
+
+def send_webhook(weather_data, ai_comment, time_range, region_comments=None):
+    """回傳 False 代表暫時性錯誤 (429 / 5xx / 連線失敗)，值得下次重新執行時再送"""
+    print("🚀 正在組裝 Discord 卡片...")
+
+    body = render_webhook_bytes(weather_data, ai_comment, time_range, region_comments)
 
-    data = {"content": "", "embeds": [embed]}
-    
     try:
-        requests.post(WEBHOOK_URL, json=data)
-        print("✅ 發送完成！")
+        status = http_client.post("discord", WEBHOOK_URL, data=body, headers=http_client.JSON_HEADERS).status_code
     except Exception as e:
         print(f"❌ Discord 發送失敗: {e}")
+        return False
+    if not 200 <= status < 300:
+        print(f"❌ Discord 發送失敗: HTTP {status}")
+        return not retryable(status)
+    print("✅ 發送完成！")
+    return True
 
-def generate_flex_message(weather_data, ai_comment, time_range):
-    """產生 Line Flex Message JSON"""
-    contents = []
+def build_region_block(region_name, cities_list, weather_data, comment=None):
+    """一個區域的標題 (+ AI 區域短評) + 城市列 (Flex box 的 list)"""
+    block = []
+
+    # 區域標題
+    header = [{"type": "text", "text": region_name, "weight": "bold", "color": "#1DB446", "size": "sm"}]
+    if comment:
+        header.append({"type": "text", "text": comment, "size": "xxs", "color": "#888888", "wrap": True, "margin": "xs"})
+    header.append({"type": "separator", "margin": "sm"})
+    block.append({
+        "type": "box",
+        "layout": "vertical",
+        "margin": "lg",
+        "contents": header
+    })
 
+    # 城市列表
+    for city in cities_list:
+        d = weather_data[city]
+        pop_color = d['pop_color']  # 預報表已整批分類好
+        
+        row = {
+            "type": "box",
+            "layout": "horizontal",
+            "margin": "sm",
+            "contents": [
+                {"type": "text", "text": d['city'], "size": "sm", "flex": 2, "color": "#333333"},
+                {"type": "text", "text": d['icon'], "size": "sm", "flex": 1, "align": "center"},
+                {"type": "text", "text": f"{d['min_t']}-{d['max_t']}°{d.get('trend', '')}", "size": "sm", "flex": 2, "align": "center", "color": "#333333"},
+                {"type": "text", "text": f"☂️{d['pop']}%", "size": "sm", "flex": 2, "align": "end", "color": pop_color}
+            ]
+        }
+        block.append(row)
+    return block
+
+def build_nearby_block(reading):
+    """附近測站的即時觀測 (偏好檔有座標的訂閱者，卡片最上方一列)"""
+    return {
+        "type": "box",
+        "layout": "horizontal",
+        "margin": "md",
+        "contents": [
+            {"type": "text", "text": f"📍 {reading['name']} ({reading['town']}) {reading['time']} 實測", "size": "xs", "flex": 5, "color": "#555555", "gravity": "center"},
+            {"type": "text", "text": f"{reading['temp']}°C", "size": "md", "flex": 2, "align": "end", "weight": "bold", "color": "#333333"}
+        ]
+    }
+
+def _flex_layout(time_range, body_contents, ai_comment):
+    """Flex Message 外框：標題、內容 (body_contents)、AI 點評"""
     # 1. 標題區塊
     header = {
         "type": "box",
@@ -173,40 +436,6 @@ def generate_flex_message(weather_data, ai_comment, time_range):
         "paddingAll": "lg"
     }
 
-    # 2. 內容區塊 (分區顯示)
-    body_contents = []
-    
-    for region_name, cities_list in REGION_MAP.items():
-        # 區域標題
-        body_contents.append({
-            "type": "box",
-            "layout": "vertical",
-            "margin": "lg",
-            "contents": [
-                {"type": "text", "text": region_name, "weight": "bold", "color": "#1DB446", "size": "sm"},
-                {"type": "separator", "margin": "sm"}
-            ]
-        })
-
-        # 城市列表
-        for city in cities_list:
-            if city in weather_data:
-                d = weather_data[city]
-                pop_color = "#ff3333" if d['pop'] >= 50 else "#666666"
-                
-                row = {
-                    "type": "box",
-                    "layout": "horizontal",
-                    "margin": "sm",
-                    "contents": [
-                        {"type": "text", "text": d['city'], "size": "sm", "flex": 2, "color": "#333333"},
-                        {"type": "text", "text": d['icon'], "size": "sm", "flex": 1, "align": "center"},
-                        {"type": "text", "text": f"{d['min_t']}-{d['max_t']}°", "size": "sm", "flex": 2, "align": "center", "color": "#333333"},
-                        {"type": "text", "text": f"☂️{d['pop']}%", "size": "sm", "flex": 2, "align": "end", "color": pop_color}
-                    ]
-                }
-                body_contents.append(row)
-
     # 3. AI 點評區塊 in Footer
     footer = {
         "type": "box",
@@ -237,78 +466,243 @@ def generate_flex_message(weather_data, ai_comment, time_range):
     }
     return flex_message
 
-def send_line_message(weather_data, ai_comment, time_range):
+def _selected_regions(weather_data, cities):
+    """依偏好篩選，回傳 [(區域名, 縣市 tuple)]"""
+    selected_regions = []
+    for region_name, cities_list in REGION_MAP.items():
+        selected = tuple(c for c in cities_list if c in weather_data and (cities is None or c in cities))
+        if cities is not None and not selected:
+            continue  # 這個區域沒有訂閱的縣市
+        selected_regions.append((region_name, selected))
+    return selected_regions
+
+def generate_flex_message(weather_data, ai_comment, time_range, cities=None, region_cache=None, region_comments=None,
+                          nearby=None):
+    """
+    產生 Line Flex Message JSON (dict 版本，預覽與比對用；實際發送走 render_flex_bytes)
+    - cities：只顯示這些縣市 (None = 全部)
+    - region_cache：同一次廣播共用的 dict，內容相同的區域區塊只建一次
+    - region_comments：{區域: AI 短評}，顯示在區域標題下
+    - nearby：最近測站的即時觀測 (station_obs.nearest_readings 的值)，顯示在最上方
+    """
+    region_comments = region_comments or {}
+    # 2. 內容區塊 (分區顯示)
+    body_contents = [build_nearby_block(nearby)] if nearby else []
+    if region_cache is None:
+        region_cache = {}
+
+    for key in _selected_regions(weather_data, cities):
+        if key not in region_cache:
+            region_cache[key] = build_region_block(key[0], key[1], weather_data, region_comments.get(key[0]))
+        body_contents.extend(region_cache[key])
+
+    return _flex_layout(time_range, body_contents, ai_comment)
+
+_ROW_FIELDS = ("city", "icon", "min_t", "max_t", "pop", "pop_color")
+_NEARBY_FIELDS = ("name", "town", "time", "temp")
+
+@functools.lru_cache(maxsize=None)
+def _templates():
+    """第一次用到時才編譯樣板，之後整個行程共用"""
+    row_data = {"{{city}}": slots(*_ROW_FIELDS, "trend")}
+    region_header, row = build_region_block("{{region}}", ["{{city}}"], row_data)
+    return {
+        "flex": Template(_flex_layout("{{time_range}}", "{{body}}", "{{ai_comment}}")),
+        "region": Template(region_header),
+        "region_comment": Template(build_region_block("{{region}}", [], {}, "{{comment}}")[0]),
+        "row": Template(row),
+        "nearby": Template(build_nearby_block(slots(*_NEARBY_FIELDS))),
+        "webhook": Template(_webhook_layout("{{time_range}}", "{{fields}}")),
+        "field": Template(_region_field("{{region_name}}", "{{region_content}}")),
+        "ai_field": Template(_ai_field("{{ai_comment}}")),
+    }
+
+def render_flex_bytes(weather_data, ai_comment, time_range, cities=None, region_cache=None, region_comments=None,
+                      nearby=None):
+    """
+    用預先編譯的樣板產生 Flex Message 的 JSON bytes，
+    和 json.dumps(generate_flex_message(...)) 逐 byte 相同。
+    region_cache 存的是已序列化的區域片段。
+    """
+    t = _templates()
+    if region_cache is None:
+        region_cache = {}
+    region_comments = region_comments or {}
+
+    blocks = [t["nearby"].render(**{f: nearby[f] for f in _NEARBY_FIELDS})] if nearby else []
+    for key in _selected_regions(weather_data, cities):
+        if key not in region_cache:
+            comment = region_comments.get(key[0])
+            if comment:
+                parts = [t["region_comment"].render(region=key[0], comment=comment)]
+            else:
+                parts = [t["region"].render(region=key[0])]
+            for city in key[1]:
+                d = weather_data[city]
+                parts.append(t["row"].render(trend=d.get("trend", ""), **{f: d[f] for f in _ROW_FIELDS}))
+            region_cache[key] = b", ".join(parts)
+        blocks.append(region_cache[key])
+
+    return t["flex"].render(time_range=time_range, body=json_array(blocks), ai_comment=ai_comment)
+
+def _split_by_reading(ids, readings):
+    """同一種偏好的訂閱者再依最近測站分開：[(觀測或 None, [訂閱者...])]"""
+    if not readings:
+        return [(None, ids)]
+    by_station = {}
+    for sid in ids:
+        reading = readings.get(sid)
+        key = reading["id"] if reading else None
+        if key not in by_station:
+            by_station[key] = (reading, [])
+        by_station[key][1].append(sid)
+    return list(by_station.values())
+
+def render_flex_by_preference(weather_data, ai_comment, time_range, groups, region_comments=None, readings=None):
+    """
+    groups 為 {縣市 frozenset 或 None: [訂閱者...]}；readings 為 {訂閱者: 最近測站觀測} (沒填座標的不在裡面)。
+    每種 (偏好, 測站) 只渲染一次，回傳 [(messages JSON bytes, 訂閱者 list), ...] 給 deliver_line_groups。
+    """
+    region_cache = {}
+    return [
+        (json_array([render_flex_bytes(weather_data, ai_comment, time_range, cities, region_cache, region_comments,
+                                       reading)]), sub_ids)
+        for cities, ids in groups.items()
+        for reading, sub_ids in _split_by_reading(ids, readings)
+    ]
+
+def load_line_subscribers():
+    """檢查 LINE 設定並取得訂閱者 (合併 .env 與 GAS API)；不需要發送時回傳空 set"""
     # 檢查 Token 是否存在
     if not LINE_TOKEN:
         print("⚠️ 未設定 LINE_TOKEN，跳過 LINE 發送。")
-        return
+        return set()
 
     # 檢查是否有 User ID 或 API URL
     subscriber_api_url = os.getenv("SUBSCRIBER_API_URL")
     if not LINE_USER_ID and not subscriber_api_url:
         print("⚠️ 未設定 LINE_USER_ID 且無 SUBSCRIBER_API_URL，跳過 LINE 發送。")
-        return
+        return set()
+
+    user_ids = get_subscriber_ids(LINE_USER_ID, subscriber_api_url)
+    if not user_ids:
+        print("⚠️ 無任何訂閱者 ID (LINE_USER_ID 未設定且 API 無回傳)")
+    return user_ids
 
+def get_nearby_readings(budget=None):
+    """
+    偏好檔有座標的訂閱者 → {訂閱者: 最近測站的即時觀測}。
+    沒有人填座標時不連線、也不載入 numpy；失敗時回傳空 dict，卡片照常發送 (只是沒有附近氣溫)。
+    """
+    locations = load_locations()
+    if not locations or not LINE_TOKEN:
+        return {}
+    try:
+        import station_obs
+
+        stations = station_obs.fetch_stations(budget.expires_at() if budget else None)
+        readings = station_obs.nearest_readings(locations, stations)
+        print(f"📍 {len(readings)} / {len(locations)} 位訂閱者找到附近測站 (全台 {len(stations)} 站)")
+        return readings
+    except Exception as e:
+        print(f"⚠️ 測站觀測取得失敗，卡片不顯示附近氣溫: {e}")
+        return {}
+
+def deliver_line_message(weather_data, ai_comment, time_range, user_ids, region_comments=None, deadline=None,
+                         readings=None):
+    """回傳 False 代表還有批次暫時送不出去 (留在 outbox，重新執行時續傳)"""
     print("🚀 正在發送 Line Flex Message...")
-    
-    # 產生 Flex Message payload
-    flex_payload = generate_flex_message(weather_data, ai_comment, time_range)
+    deadline = deadline or Deadline()
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_TOKEN}"
-    }
-    
-    payload = {
-        "to": "",  # 會在迴圈中設定
-        "messages": [flex_payload]
-    }
+    # 依縣市偏好 (與最近測站) 分組，每種組合只產生一次 Flex Message payload
+    render_budget = deadline.stage("render")
+    groups = group_by_preference(user_ids, load_preferences())
+    with telemetry.span("渲染卡片", groups=len(groups)) as sp:
+        payloads = render_flex_by_preference(weather_data, ai_comment, time_range, groups, region_comments, readings)
+        sp.set(bytes=sum(len(p) for p, _ in payloads))
+    render_budget.finish()
+    print(f"🎨 {len(user_ids)} 位訂閱者，共 {len(payloads)} 種卡片")
 
-    # 取得訂閱者列表 (合併 .env 與 GAS API)
-    user_ids = set()
-    
-    # 1. 從 .env 讀取
-    if LINE_USER_ID:
-        for uid in LINE_USER_ID.split(","):
-            if uid.strip():
-                user_ids.add(uid.strip())
+    # 使用者走 multicast 批次、群組/聊天室走 push，平行發送
+    # 狀態記在 outbox：同一個時段重新執行只會補送上次沒送達的批次；超過發送預算的重試也留到下次
+    deliver_budget = deadline.stage("deliver")
+    results = deliver_durable(payloads, LINE_TOKEN, f"weather:{time_range}", deadline=deliver_budget.expires_at())
+    deliver_budget.finish()
+    print_delivery_report(results)
+    return not any(not r["ok"] and retryable(r["status"]) for r in results.values())
 
-    # 2. 從 GAS API 讀取 (自動訂閱)
-    subscriber_api_url = os.getenv("SUBSCRIBER_API_URL")
-    if subscriber_api_url:
-        try:
-            print(f"📡 正在從 GAS API 取得訂閱者列表...")
-            resp = requests.get(subscriber_api_url)
-            if resp.status_code == 200:
-                api_ids = resp.json()
-                print(f"✅ 取得 {len(api_ids)} 個訂閱者: {api_ids}")
-                for uid in api_ids:
-                    user_ids.add(uid)
-            else:
-                print(f"⚠️ GAS API 回傳錯誤: {resp.status_code}")
-        except Exception as e:
-            print(f"⚠️ 讀取訂閱者 API 失敗: {e}")
+def send_line_message(weather_data, ai_comment, time_range, region_comments=None):
+    user_ids = load_line_subscribers()
+    if user_ids:
+        deliver_line_message(weather_data, ai_comment, time_range, user_ids, region_comments)
 
-    if not user_ids:
-        print("⚠️ 無任何訂閱者 ID (LINE_USER_ID 未設定且 API 無回傳)")
+async def run_pipeline(timer, deadline):
+    """
+    訂閱者同步一開始就在背景跑，和氣象局資料、AI 點評重疊；
+    Discord 與 LINE 互不相依，同時發送。
+    AI 點評受 deadline 的時間預算限制 (逾時就降級)，發送一定會準時開始。
+    """
+    import asyncio  # 延遲載入，只 render 卡片的指令不必付這個成本
+
+    subscribers_task = asyncio.create_task(timer.run("訂閱者同步", load_line_subscribers))
+
+    fetch_budget = deadline.stage("fetch")
+    # 附近測站的即時氣溫 (只有偏好檔有座標的訂閱者需要) 和預報一起抓
+    readings_task = asyncio.create_task(timer.run("測站觀測", get_nearby_readings, fetch_budget))
+    snapshot, changed = await timer.run("氣象局資料", get_forecast_snapshot, CWA_FORCE_REFRESH, fetch_budget)
+    fetch_budget.finish()
+    if snapshot and SKIP_UNCHANGED_BROADCAST and not changed and cwa_snapshot.already_broadcast(snapshot):
+        print("💤 預報沒有更新，這份預報也已經廣播過，本次略過。")
+        snapshot = None
+
+    if not snapshot:
+        await subscribers_task  # 執行緒沒辦法中途取消，等它同步完 (本機名單也順便更新)
+        await readings_task
         return
 
-    for uid in user_ids:
-        payload["to"] = uid
-        try:
-            response = requests.post("https://api.line.me/v2/bot/message/push", headers=headers, json=payload)
-            if response.status_code == 200:
-                print(f"✅ Line 發送成功！(Target: {uid})")
-            else:
-                print(f"❌ Line 發送失敗 (Target: {uid}): {response.status_code} {response.text}")
-        except Exception as e:
-            print(f"❌ Line 發送例外 (Target: {uid}): {e}")
+    table = ForecastTable.from_dict(snapshot["table"])
+    # 附加到預報歷史並算出和昨天 / 上週的比較，卡片與 AI 都會用到
+    trends = await timer.run("預報歷史", load_trends, table, FORECAST_PERIOD)
+    w_data, raw_list, t_range = forecast_views(table, FORECAST_PERIOD, trends)
+    # 全台評論和各區域短評是同一次模型呼叫
+    comment, region_comments = await timer.run("AI 點評", get_ai_comment, raw_list, w_data, deadline.stage("ai"))
+
+    # 各通道回傳是否不需要再重試；Discord 沒有 outbox，已送過的靠快照記錄跳過
+    deliveries = {}
+    if WEBHOOK_URL and not cwa_snapshot.already_broadcast(snapshot, "discord"):
+        # Discord 不用等訂閱者同步，先開始送
+        deliveries["discord"] = asyncio.create_task(
+            timer.run("Discord", send_webhook, w_data, comment, t_range, region_comments))
+    user_ids = await subscribers_task
+    readings = await readings_task
+    if user_ids:
+        deliveries["line"] = timer.run("LINE", deliver_line_message, w_data, comment, t_range, user_ids,
+                                       region_comments, deadline, readings)
+    delivered = dict(zip(deliveries, await asyncio.gather(*deliveries.values())))
+    if delivered.get("discord"):
+        cwa_snapshot.mark_broadcast(CWA_DATASET, snapshot, "discord")
+    if all(delivered.values()):
+        cwa_snapshot.mark_broadcast(CWA_DATASET, snapshot)
+    else:
+        # 不標記已廣播：重新執行時 LINE 從 outbox 續傳、Discord 只在上次沒送達時重送
+        print("⚠️ 有通道暫時送不出去，這份預報不標記為已廣播，重新執行時會續傳")
+
+def main():
+    # 設定 (CWA_API_KEY 等) 由 taiwanbot.py 在執行前檢查
+    import asyncio
+
+    timer = StageTimer()
+    deadline = Deadline()
+    with telemetry.span("weather"):
+        asyncio.run(run_pipeline(timer, deadline))
+    timer.print_report()
+    deadline.print_report()
+    http_client.print_stats()
+    ai_cache.print_stats()
+    telemetry.flush()
+    return 0
 
 if __name__ == "__main__":
-    w_data, raw_list, t_range = get_taiwan_weather_data()
-    if w_data:
-        comment = get_ai_comment(raw_list)
-        comment = get_ai_comment(raw_list)
-        if WEBHOOK_URL:
-            send_webhook(w_data, comment, t_range)
-        send_line_message(w_data, comment, t_range)
+    # 相容舊的 `python weather_bot.py`，實際交給統一指令處理 (.env 載入、設定檢查)
+    from taiwanbot import main as cli_main
+    sys.exit(cli_main(["weather"]))